@@ -0,0 +1,182 @@
+import os
+import re
+import tempfile
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# Words, numbers and codes like "CS101", lowercased
+TOKEN_PATTERN = re.compile(r'\w+')
+
+DEFAULT_BM25_K1 = 1.2
+DEFAULT_BM25_B = 0.75
+DEFAULT_RRF_K = 60
+
+INDEX_FORMAT_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25IndexBuilder:
+    """Collects documents one at a time and packs them into a BM25Index.
+
+    Postings are accumulated in typed arrays instead of Python lists so building
+    the index of a large corpus stays cheap in memory.
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.doc_lengths = array('i')
+        self._postings: Dict[str, Tuple[array, array]] = {}
+
+    def add(self, doc_id: str, text: str):
+        doc_index = len(self.ids)
+        self.ids.append(doc_id)
+
+        term_counts: Dict[str, int] = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            term_counts[token] = term_counts.get(token, 0) + 1
+        self.doc_lengths.append(len(tokens))
+
+        for term, count in term_counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('i'), array('i'))
+            postings[0].append(doc_index)
+            postings[1].append(count)
+
+    def build(self, k1: float = DEFAULT_BM25_K1, b: float = DEFAULT_BM25_B) -> 'BM25Index':
+        terms = sorted(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self._postings[term][0])
+
+        doc_indices = np.empty(offsets[-1], dtype=np.int32)
+        term_frequencies = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            docs, counts = self._postings[term]
+            doc_indices[offsets[i]:offsets[i + 1]] = np.frombuffer(docs, dtype=np.int32)
+            term_frequencies[offsets[i]:offsets[i + 1]] = np.frombuffer(counts, dtype=np.int32)
+
+        return BM25Index(self.ids, terms, offsets, doc_indices, term_frequencies,
+                         np.frombuffer(self.doc_lengths, dtype=np.int32).copy(), k1, b)
+
+
+class BM25Index:
+    """In-process BM25 keyword index with array-backed postings.
+
+    The postings of all terms are stored back to back (CSR layout): the
+    postings of term t are doc_indices[offsets[t]:offsets[t + 1]] with their
+    term frequencies at the same positions.
+    """
+
+    def __init__(self, ids: Sequence[str], terms: Sequence[str], offsets: np.ndarray, doc_indices: np.ndarray,
+                 term_frequencies: np.ndarray, doc_lengths: np.ndarray,
+                 k1: float = DEFAULT_BM25_K1, b: float = DEFAULT_BM25_B):
+        self.ids = list(ids)
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_indices = doc_indices
+        self.term_frequencies = term_frequencies
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        num_docs = len(self.ids)
+        average_length = float(doc_lengths.mean()) if num_docs else 0.0
+        # Per document part of the BM25 denominator, computed once instead of per query
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(average_length, 1e-9))).astype(np.float32)
+
+        document_frequencies = np.diff(offsets).astype(np.float32)
+        self._idf = np.log1p((num_docs - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query"""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.doc_indices[start:end]
+            tf = self.term_frequencies[start:end]
+            # A document appears once in a term's postings, so plain fancy indexing adds correctly
+            scores[docs] += self._idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+        return scores
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """Return up to n_results (doc_id, score) pairs, best first, documents without any query term are left out"""
+        scores = self.get_scores(query)
+        matching = np.flatnonzero(scores)
+        if len(matching) > n_results:
+            matching = matching[np.argpartition(-scores[matching], n_results - 1)[:n_results]]
+        order = matching[np.argsort(-scores[matching], kind='stable')]
+        return [(self.ids[i], float(scores[i])) for i in order]
+
+    def batch_search(self, queries: Sequence[str], n_results: int = 10) -> List[List[Tuple[str, float]]]:
+        return [self.search(query, n_results) for query in queries]
+
+    def save(self, path: str):
+        """Write the index to an .npz file, replacing it atomically"""
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+
+        terms = sorted(self.term_ids, key=self.term_ids.get)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.savez(file,
+                         version=np.array(INDEX_FORMAT_VERSION),
+                         params=np.array([self.k1, self.b], dtype=np.float64),
+                         ids=np.array(self.ids, dtype=str),
+                         terms=np.array(terms, dtype=str),
+                         offsets=self.offsets,
+                         doc_indices=self.doc_indices,
+                         term_frequencies=self.term_frequencies,
+                         doc_lengths=self.doc_lengths)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str, k1: float = None, b: float = None) -> 'BM25Index':
+        """Read an index written by save, k1 and b override the saved parameters"""
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported BM25 index version {int(data['version'])}")
+            saved_k1, saved_b = data['params']
+            return cls(data['ids'].tolist(), data['terms'].tolist(), data['offsets'], data['doc_indices'],
+                       data['term_frequencies'], data['doc_lengths'],
+                       float(saved_k1) if k1 is None else k1, float(saved_b) if b is None else b)
+
+
+def build_bm25_index(documents: Iterable[Tuple[str, str]], k1: float = DEFAULT_BM25_K1,
+                     b: float = DEFAULT_BM25_B) -> BM25Index:
+    """Build an index from (doc_id, text) pairs"""
+    builder = BM25IndexBuilder()
+    for doc_id, text in documents:
+        builder.add(doc_id, text)
+    return builder.build(k1, b)
+
+
+def get_bm25_index_path(index_dir: str, collection_name: str) -> str:
+    return os.path.join(index_dir, f"{collection_name}.bm25.npz")
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = DEFAULT_RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists, each id scores the sum of 1 / (k + rank) over the lists it appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,136 @@
+import re
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from contextPacker import SENTENCE_END, approximate_token_count
+
+# all-MiniLM-L6-v2 truncates its input at 256 word pieces, windows stay below
+# that with room for the section title each chunk is prefixed with
+DEFAULT_CHUNK_TOKENS = 200
+DEFAULT_CHUNK_OVERLAP = 40
+
+# Separates the id of a section from the number of one of its chunks, '_' is
+# already used for the section hierarchy
+CHUNK_ID_SEPARATOR = '#'
+
+WORD = re.compile(r'\S+')
+
+
+def get_chunk_id(source_id: str, chunk_index: int) -> str:
+    return f"{source_id}{CHUNK_ID_SEPARATOR}{chunk_index}"
+
+
+def get_source_id(doc_id: str) -> str:
+    """Id of the section a chunk was cut from, ids without a chunk number are returned unchanged"""
+    return str(doc_id).split(CHUNK_ID_SEPARATOR, 1)[0]
+
+
+def split_sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the sentences of text"""
+    spans = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def _split_long_span(text: str, start: int, end: int, max_tokens: int,
+                     count_tokens: Callable[[str], int]) -> List[Tuple[int, int, int]]:
+    """Cut a sentence longer than the window at word boundaries"""
+    pieces = []
+    piece_start = None
+    piece_end = start
+    tokens = 0
+    for word in WORD.finditer(text, start, end):
+        word_tokens = count_tokens(word.group())
+        if piece_start is not None and tokens + word_tokens > max_tokens:
+            pieces.append((piece_start, piece_end, tokens))
+            piece_start = None
+            tokens = 0
+        if piece_start is None:
+            piece_start = word.start()
+        piece_end = word.end()
+        tokens += word_tokens
+    if piece_start is not None:
+        pieces.append((piece_start, piece_end, tokens))
+    return pieces
+
+
+def chunk_spans(text: str, max_tokens: int = DEFAULT_CHUNK_TOKENS, overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+                count_tokens: Callable[[str], int] = approximate_token_count) -> List[Tuple[int, int]]:
+    """Cut text into (start, end) windows of at most max_tokens tokens.
+
+    Windows end at sentence boundaries and each window repeats the last
+    sentences of the previous one, up to overlap_tokens, so a passage is never
+    only split between two chunks. Sentences longer than a window are cut at words.
+    """
+    units = []
+    for start, end in split_sentence_spans(text):
+        tokens = count_tokens(text[start:end])
+        if tokens <= max_tokens:
+            units.append((start, end, tokens))
+        else:
+            units.extend(_split_long_span(text, start, end, max_tokens, count_tokens))
+
+    chunks = []
+    first = 0
+    while first < len(units):
+        last = first
+        tokens = 0
+        while last < len(units) and (last == first or tokens + units[last][2] <= max_tokens):
+            tokens += units[last][2]
+            last += 1
+        chunks.append((units[first][0], units[last - 1][1]))
+        if last >= len(units):
+            break
+
+        # Start the next window on the trailing sentences of this one, leaving
+        # room for at least the sentence that did not fit
+        max_overlap = min(overlap_tokens, max_tokens - units[last][2])
+        next_first = last
+        overlap = 0
+        while next_first - 1 > first and overlap + units[next_first - 1][2] <= max_overlap:
+            next_first -= 1
+            overlap += units[next_first][2]
+        first = next_first
+
+    return chunks
+
+
+def chunk_section(doc_id: str, content: str, metadata: Dict, max_tokens: int = DEFAULT_CHUNK_TOKENS,
+                  overlap_tokens: int = DEFAULT_CHUNK_OVERLAP,
+                  count_tokens: Callable[[str], int] = approximate_token_count) -> List[Tuple[str, str, Dict]]:
+    """Split a section into (chunk id, chunk content, metadata) tuples.
+
+    The metadata of every chunk maps it back to its section: source_id, its
+    position chunk_index of chunk_count and the character span char_start:char_end
+    of the section content. A section that fits in one window keeps its own id.
+    """
+    if count_tokens(content) <= max_tokens:
+        spans = [(0, len(content))]
+    else:
+        spans = chunk_spans(content, max_tokens, overlap_tokens, count_tokens) or [(0, len(content))]
+
+    chunks = []
+    for chunk_index, (start, end) in enumerate(spans):
+        chunk_id = doc_id if len(spans) == 1 else get_chunk_id(doc_id, chunk_index)
+        chunk_metadata = dict(metadata, source_id=doc_id, chunk_index=chunk_index, chunk_count=len(spans),
+                              char_start=start, char_end=end)
+        chunks.append((chunk_id, content[start:end], chunk_metadata))
+    return chunks
+
+
+def stitch_chunks(chunks: Sequence[Tuple[int, int, str]]) -> str:
+    """Rebuild section content from (char_start, char_end, text) chunks, removing the overlaps"""
+    parts = []
+    covered = 0
+    for start, end, text in sorted(chunks):
+        if end <= covered:
+            continue
+        if parts and start > covered:
+            parts.append(' ')
+        parts.append(text[max(0, covered - start):])
+        covered = end
+    return ''.join(parts)
@@ -0,0 +1,262 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict
+
+from vectorStore import create_vector_store
+
+# Exceptions worth retrying: the server was unreachable, too slow or temporarily failing
+RETRYABLE_ERROR_NAMES = {
+    'APIConnectionError', 'APITimeoutError', 'InternalServerError', 'RateLimitError',
+    'TransportError', 'TimeoutException', 'ConnectError', 'ReadTimeout', 'ConnectTimeout', 'RemoteProtocolError',
+}
+
+DEFAULT_CLIENT_SETTINGS = {
+    'llmBaseUrl': 'http://localhost:8080/v1',
+    'llmApiKey': 'sk-no-key-required',
+    'llmModel': 'davinci-002',
+    'llmConnectTimeout': 2.0,
+    'llmReadTimeout': 30.0,
+    'llmMaxRetries': 2,
+    'llmMaxConnections': 8,
+    'llmCachePrompt': True,
+    'llmSlotId': -1,
+    'vectorStore': 'chroma',
+    'chromaHost': 'localhost',
+    'chromaPort': 8000,
+    'chromaConnectTimeout': 2.0,
+    'chromaReadTimeout': 10.0,
+    'chromaMaxRetries': 2,
+    'chromaMaxConnections': 8,
+    'vectorStoreDir': None,
+    'embeddingModel': 'all-MiniLM-L6-v2',
+    'keepAliveSeconds': 60.0,
+    'retryBackoffBase': 0.2,
+    'retryBackoffMax': 2.0,
+    'circuitFailureThreshold': 5,
+    'circuitResetTimeout': 30.0,
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a backend whose circuit breaker is open"""
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Return True for connection problems and timeouts, False for errors a retry would not fix"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """Fail fast while a backend keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and calls are
+    rejected for reset_timeout seconds. Then a single trial call is let through,
+    closing the circuit again if it succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Circuit breaker for {self.name} opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+
+def call_with_retry(func: Callable[[], Any], breaker: CircuitBreaker, max_retries: int = 2,
+                    backoff_base: float = 0.2, backoff_max: float = 2.0):
+    """Call func, retrying retryable errors with exponential backoff and jitter.
+
+    Raises CircuitOpenError without calling func when the breaker is open.
+    """
+    if not breaker.allow_request():
+        raise CircuitOpenError(f"{breaker.name} is unavailable, circuit breaker is open")
+
+    attempt = 0
+    while True:
+        try:
+            result = func()
+            breaker.record_success()
+            return result
+        except Exception as e:
+            if not is_retryable_error(e):
+                breaker.record_success()
+                raise
+            if attempt >= max_retries:
+                breaker.record_failure()
+                raise
+            delay = min(backoff_max, backoff_base * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            attempt += 1
+
+
+class ClientManager:
+    """Creates the LLM client and vector store on first use and shares them between requests.
+
+    Clients keep pooled keep-alive connections, use bounded connect/read
+    timeouts, and every call goes through call_with_retry with a circuit breaker
+    per backend.
+    """
+
+    def __init__(self, settings: Dict[str, Any] = None):
+        self._lock = threading.Lock()
+        self._llm_client = None
+        self._vector_store = None
+        self._deadline_executor = None
+        self.settings = dict(DEFAULT_CLIENT_SETTINGS)
+        self.configure(settings or {})
+
+    def configure(self, settings: Dict[str, Any]):
+        """Apply new settings, clients are recreated on their next use"""
+        with self._lock:
+            for key, value in settings.items():
+                if key in DEFAULT_CLIENT_SETTINGS:
+                    self.settings[key] = value
+            self._close_llm_client()
+            self._llm_client = None
+            self._vector_store = None
+
+            self.llm_breaker = CircuitBreaker('LLM server', int(self.settings['circuitFailureThreshold']),
+                                              float(self.settings['circuitResetTimeout']))
+            self.vector_store_breaker = CircuitBreaker('vector store', int(self.settings['circuitFailureThreshold']),
+                                                       float(self.settings['circuitResetTimeout']))
+
+    def _close_llm_client(self):
+        if self._llm_client is not None:
+            try:
+                self._llm_client.close()
+            except Exception:
+                pass
+
+    def _timeout(self, prefix: str):
+        import httpx
+
+        return httpx.Timeout(float(self.settings[f'{prefix}ReadTimeout']),
+                             connect=float(self.settings[f'{prefix}ConnectTimeout']))
+
+    def _limits(self, prefix: str):
+        import httpx
+
+        max_connections = int(self.settings[f'{prefix}MaxConnections'])
+        return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=float(self.settings['keepAliveSeconds']))
+
+    def get_llm_client(self):
+        """Return the shared OpenAI compatible client, creating it on first use"""
+        with self._lock:
+            if self._llm_client is None:
+                import httpx
+                import openai
+
+                self._llm_client = openai.OpenAI(
+                    base_url=self.settings['llmBaseUrl'],
+                    api_key=self.settings['llmApiKey'],
+                    timeout=self._timeout('llm'),
+                    # Retries are done by call_with_retry so they count towards the circuit breaker
+                    max_retries=0,
+                    http_client=httpx.Client(timeout=self._timeout('llm'), limits=self._limits('llm'))
+                )
+            return self._llm_client
+
+    def get_vector_store(self):
+        """Return the shared vector store, creating it on first use"""
+        with self._lock:
+            if self._vector_store is None:
+                self._vector_store = create_vector_store(
+                    str(self.settings['vectorStore']),
+                    host=self.settings['chromaHost'],
+                    port=int(self.settings['chromaPort']),
+                    persist_dir=self.settings['vectorStoreDir'],
+                    embedding_model_name=self.settings['embeddingModel'],
+                    timeout=self._timeout('chroma'),
+                    limits=self._limits('chroma'),
+                )
+            return self._vector_store
+
+    def get_completion_options(self) -> Dict[str, Any]:
+        """llama.cpp specific completion options, passed as extra_body.
+
+        cache_prompt keeps the evaluated prompt in the server's KV cache so the
+        next request only evaluates what follows the shared prefix, id_slot pins
+        requests to a server slot (-1 lets the server choose).
+        """
+        return {
+            'cache_prompt': str(self.settings['llmCachePrompt']).lower() == 'true',
+            'id_slot': int(self.settings['llmSlotId']),
+        }
+
+    def call_llm(self, func: Callable[[Any], Any]):
+        """Run func(llm_client) with retries, failing fast while the LLM server is down"""
+        return call_with_retry(lambda: func(self.get_llm_client()), self.llm_breaker,
+                               int(self.settings['llmMaxRetries']), float(self.settings['retryBackoffBase']),
+                               float(self.settings['retryBackoffMax']))
+
+    def _call_with_deadline(self, func: Callable[[], Any]):
+        """Run func in a worker thread and raise TimeoutError if it takes longer than the chroma timeouts.
+
+        The call itself cannot be interrupted, its thread finishes in the
+        background while the caller moves on (and may retry).
+        """
+        with self._lock:
+            if self._deadline_executor is None:
+                self._deadline_executor = ThreadPoolExecutor(int(self.settings['chromaMaxConnections']),
+                                                             thread_name_prefix='vector_store_call')
+            executor = self._deadline_executor
+
+        deadline = float(self.settings['chromaConnectTimeout']) + float(self.settings['chromaReadTimeout'])
+        future = executor.submit(func)
+        try:
+            return future.result(timeout=deadline)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Vector store call did not finish within {deadline:.1f}s")
+
+    def call_vector_store(self, func: Callable[[], Any], deadline: bool = True):
+        """Run func with retries, failing fast while the vector store is down.
+
+        If the vector store cannot time out its own requests (see
+        VectorStore.bounds_requests) every attempt gets a deadline instead,
+        deadline=False leaves it out for calls made of many requests such as bulk loads.
+        """
+        def attempt():
+            if deadline and not self.get_vector_store().bounds_requests:
+                return self._call_with_deadline(func)
+            return func()
+
+        return call_with_retry(attempt, self.vector_store_breaker, int(self.settings['chromaMaxRetries']),
+                               float(self.settings['retryBackoffBase']), float(self.settings['retryBackoffMax']))
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+# Collections kept open by default
+DEFAULT_COLLECTION_POOL_SIZE = 4
+
+
+class CollectionPool:
+    """LRU pool of open collection handles, shared by the executor threads.
+
+    open_collection(name) returns a ready handle or None if the collection
+    does not exist, it is called outside the pool's lock so opening a large
+    collection does not hold up prompts to the others. When the pool is full
+    the least recently used handle is dropped and close_collection(name) is
+    called to free what was loaded for it.
+    """
+
+    def __init__(self, open_collection: Callable[[str], Any], capacity: int = DEFAULT_COLLECTION_POOL_SIZE,
+                 close_collection: Optional[Callable[[str], None]] = None):
+        self.open_collection = open_collection
+        self.close_collection = close_collection
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._collections: 'OrderedDict[str, Any]' = OrderedDict()
+
+    def get(self, name: str):
+        """Handle of the named collection, opened on first use, None if it does not exist"""
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is not None:
+                self._collections.move_to_end(name)
+                return collection
+
+        collection = self.open_collection(name)
+        if collection is None:
+            return None
+        # Another thread may have opened it meanwhile, keep the handle that is already in use
+        with self._lock:
+            if name in self._collections:
+                self._collections.move_to_end(name)
+                return self._collections[name]
+        self.put(name, collection)
+        return collection
+
+    def put(self, name: str, collection):
+        """Add or replace a handle, e.g. after the collection was rebuilt"""
+        with self._lock:
+            self._collections[name] = collection
+            self._collections.move_to_end(name)
+            evicted = []
+            while len(self._collections) > self.capacity:
+                evicted.append(self._collections.popitem(last=False)[0])
+
+        for evicted_name in evicted:
+            if self.close_collection is not None:
+                self.close_collection(evicted_name)
+
+    def names(self) -> List[str]:
+        """Open collections, least recently used first"""
+        with self._lock:
+            return list(self._collections)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_SUFFIX = '.snapshot.npz'
+
+
+def get_snapshot_path(snapshot_dir: str, collection_name: str) -> str:
+    return str(Path(snapshot_dir) / f"{collection_name}{SNAPSHOT_SUFFIX}")
+
+
+def _checksum(embeddings: np.ndarray, records: bytes) -> str:
+    digest = hashlib.sha256()
+    if embeddings.size:
+        # memoryview hashes a memory-mapped matrix without copying it
+        digest.update(memoryview(np.ascontiguousarray(embeddings)).cast('B'))
+    digest.update(records)
+    return digest.hexdigest()
+
+
+def write_snapshot(path: str, ids: List[str], embeddings: np.ndarray, documents: List[Optional[str]],
+                   metadatas: List[Optional[Dict]], collection_metadata: Dict = None, model_tag: str = '') -> Dict:
+    """Write a collection to one .npz file and return its header.
+
+    The file holds the float32 embedding matrix uncompressed, so it can be
+    memory-mapped on restore, the ids, documents and metadata as zlib
+    compressed JSON, and a header with the model tag and a sha256 checksum of both.
+    The file is replaced atomically.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or len(embeddings) != len(ids):
+        embeddings = embeddings.reshape(len(ids), -1) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    records = zlib.compress(json.dumps({'ids': ids, 'documents': documents, 'metadatas': metadatas}).encode('utf-8'))
+    header = {
+        'format_version': SNAPSHOT_FORMAT_VERSION,
+        'model_tag': model_tag,
+        'collection_metadata': collection_metadata or {},
+        'count': len(ids),
+        'dimension': int(embeddings.shape[1]),
+        'checksum': _checksum(embeddings, records),
+    }
+
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            # savez stores members uncompressed, which memory mapping relies on
+            np.savez(file, header=np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8),
+                     records=np.frombuffer(records, dtype=np.uint8), embeddings=embeddings)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return header
+
+
+def _memmap_npz_member(path: str, member: str) -> np.ndarray:
+    """Memory-map an array stored uncompressed in an .npz file, copy-on-write"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{member} in {path} is compressed and cannot be memory-mapped")
+
+    with open(path, 'rb') as file:
+        # The member's data follows its local file header (30 bytes, name and extra field)
+        file.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(file.read(4), dtype='<u2')
+        file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+def read_snapshot(path: str, mmap: bool = True, verify: bool = True) -> Dict:
+    """Read a snapshot written by write_snapshot.
+
+    Returns the header fields plus ids, documents, metadatas and embeddings.
+    With mmap the embedding matrix is memory-mapped instead of read into memory.
+    Raises ValueError if the file is of an unknown version or fails its checksum.
+    """
+    with np.load(path) as data:
+        header = json.loads(data['header'].tobytes().decode('utf-8'))
+        if header.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format version {header.get('format_version')} in {path}")
+        records = data['records'].tobytes()
+        embeddings = None if mmap else data['embeddings']
+
+    if embeddings is None:
+        embeddings = _memmap_npz_member(path, 'embeddings.npy')
+
+    if embeddings.shape != (header['count'], header['dimension']):
+        raise ValueError(f"Snapshot {path} holds {embeddings.shape} embeddings, its header says "
+                         f"{(header['count'], header['dimension'])}")
+    if verify and _checksum(embeddings, records) != header['checksum']:
+        raise ValueError(f"Snapshot {path} is corrupted, its checksum does not match")
+
+    snapshot = dict(header)
+    snapshot.update(json.loads(zlib.decompress(records).decode('utf-8')))
+    snapshot['embeddings'] = embeddings
+    return snapshot
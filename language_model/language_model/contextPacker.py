@@ -0,0 +1,138 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Rough size of a token for English text with llama style tokenizers
+APPROXIMATE_CHARS_PER_TOKEN = 4
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 512
+DEFAULT_CONTEXT_MAX_DOCUMENTS = 3
+
+
+def approximate_token_count(text: str) -> int:
+    """Estimate the number of tokens of text without a tokenizer"""
+    if not text:
+        return 0
+    return max(len(text.split()), (len(text) + APPROXIMATE_CHARS_PER_TOKEN - 1) // APPROXIMATE_CHARS_PER_TOKEN)
+
+
+class TokenCounter:
+    """Counts tokens with the llama.cpp server's /tokenize endpoint, or approximately.
+
+    Counts are cached since the same sections are retrieved over and over. If
+    the server cannot be reached the approximation is used for retry_after seconds.
+    """
+
+    def __init__(self, server_url: Optional[str] = None, timeout: float = 1.0, cache_size: int = 4096,
+                 retry_after: float = 60.0):
+        self.server_url = server_url.rstrip('/') if server_url else None
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()
+        self._http_client = None
+        self._server_failed_at = None
+
+    def _count_with_server(self, text: str) -> int:
+        if self._http_client is None:
+            import httpx
+            self._http_client = httpx.Client(timeout=self.timeout)
+        response = self._http_client.post(f"{self.server_url}/tokenize", json={'content': text})
+        response.raise_for_status()
+        return len(response.json()['tokens'])
+
+    def count(self, text: str) -> int:
+        if self.server_url is None:
+            return approximate_token_count(text)
+        if self._server_failed_at is not None and time.monotonic() - self._server_failed_at < self.retry_after:
+            return approximate_token_count(text)
+
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+
+        try:
+            tokens = self._count_with_server(text)
+        except Exception as e:
+            print(f"Error counting tokens with {self.server_url}, using an approximation instead: {e}")
+            self._server_failed_at = time.monotonic()
+            return approximate_token_count(text)
+
+        with self._lock:
+            self._cache[text] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+def get_ancestor_ids(doc_id: str) -> List[str]:
+    """Ids of the parent sections of a document, e.g. 1_2_3 -> ['1', '1_2']"""
+    parts = str(doc_id).split('_')
+    return ['_'.join(parts[:i]) for i in range(1, len(parts))]
+
+
+def drop_covered_children(search_results: List[Dict]) -> List[Dict]:
+    """Leave out results whose parent (or any ancestor) section is among the results as well.
+
+    Chunks are placed in the hierarchy by the section they were cut from (source_id).
+    """
+    result_ids = {str(result.get('source_id', result['doc_id'])) for result in search_results}
+    return [
+        result for result in search_results
+        if not any(ancestor in result_ids for ancestor in get_ancestor_ids(result.get('source_id', result['doc_id'])))
+    ]
+
+
+def truncate_to_sentences(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """Longest run of leading sentences of text that fits in max_tokens, '' if not even the first one fits"""
+    kept = []
+    used = 0
+    for sentence in SENTENCE_END.split(text.strip()):
+        tokens = count_tokens(sentence + ' ')
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return ' '.join(kept)
+
+
+def pack_context(search_results: List[Dict], render_document: Callable[[int, Dict, str], str],
+                 token_budget: int, count_tokens: Callable[[str], int],
+                 max_documents: int = DEFAULT_CONTEXT_MAX_DOCUMENTS) -> Tuple[List[str], Dict[str, int]]:
+    """Fit the best search results into token_budget tokens.
+
+    Children whose parent section is also retrieved are dropped, then documents
+    are added in rank order as long as they fit. The first document that does
+    not fit is cut at a sentence boundary and packing stops there.
+    render_document(number, result, content) formats one document. Returns the
+    rendered documents and stats with the tokens used and the tokens an
+    unpacked context of the first max_documents results would have taken.
+    """
+    blocks = []
+    used = 0
+    for result in drop_covered_children(search_results)[:max_documents]:
+        block = render_document(len(blocks) + 1, result, result['content'])
+        tokens = count_tokens(block)
+        if used + tokens <= token_budget:
+            blocks.append(block)
+            used += tokens
+            continue
+
+        # Room left for the content once the rest of the block is accounted for
+        overhead = count_tokens(render_document(len(blocks) + 1, result, ''))
+        content = truncate_to_sentences(result['content'], token_budget - used - overhead, count_tokens)
+        if content:
+            block = render_document(len(blocks) + 1, result, content)
+            blocks.append(block)
+            used += count_tokens(block)
+        break
+
+    unpacked = sum(count_tokens(render_document(i, result, result['content']))
+                   for i, result in enumerate(search_results[:max_documents], 1))
+    return blocks, {'used': used, 'unpacked': unpacked, 'saved': max(0, unpacked - used)}
@@ -0,0 +1,108 @@
+import json
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, TextIO
+
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_json_values(file: TextIO, array_mode: bool) -> Iterator[Any]:
+    """Decode JSON values one at a time from a text stream.
+
+    In array mode the stream must hold a single top-level JSON array and each
+    element is yielded as soon as it has been read completely. Otherwise the
+    stream is treated as a sequence of whitespace separated JSON values (JSONL).
+    Only the value currently being decoded is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    chunk_size = READ_CHUNK_SIZE
+    eof = False
+    opened = not array_mode
+
+    while True:
+        # Skip whitespace and (in array mode) element separators
+        while position < len(buffer) and (buffer[position].isspace() or (opened and array_mode and buffer[position] == ',')):
+            position += 1
+
+        if position >= len(buffer):
+            if eof:
+                if array_mode:
+                    raise ValueError("Unexpected end of file, JSON array is not closed")
+                return
+            buffer = buffer[position:] + file.read(chunk_size)
+            position = 0
+            eof = len(buffer) == 0
+            continue
+
+        if not opened:
+            if buffer[position] != '[':
+                raise ValueError("Expected a JSON array at the top level of the data file")
+            opened = True
+            position += 1
+            continue
+
+        if array_mode and buffer[position] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The value is not complete yet: read more, growing the chunk so that
+            # large values do not get decoded from scratch too many times.
+            more = file.read(chunk_size)
+            chunk_size *= 2
+            buffer = buffer[position:] + more
+            position = 0
+            eof = len(more) == 0
+            continue
+
+        yield value
+        position = end
+        chunk_size = READ_CHUNK_SIZE
+
+
+def _flatten_item(item: Dict, doc_id: str) -> Iterator[Dict]:
+    """Yield an item and all of its nested subsections, at any depth, in document order"""
+    stack = [(item, doc_id)]
+    while stack:
+        node, node_id = stack.pop()
+        yield {
+            'doc_id': node_id,
+            'section': node.get('section', '') or '',
+            'content': node.get('content', '') or '',
+        }
+        children = node.get('subsections') or []
+        # Push in reverse so children come out in their original order
+        for idx in range(len(children) - 1, -1, -1):
+            child = children[idx]
+            child_id = f"{node_id}_{child.get('doc_id', idx)}"
+            stack.append((child, child_id))
+
+
+def iter_json_data(file_path: str) -> Iterator[Dict]:
+    """Stream normalized items from a JSON or JSONL data file.
+
+    Every item, including subsections at any nesting depth, is yielded as a dict
+    with 'doc_id' (the '_' joined path of ids), 'section' and 'content'.
+    """
+    jsonl = str(file_path).lower().endswith(JSONL_SUFFIXES)
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for i, item in enumerate(_iter_json_values(file, array_mode=not jsonl)):
+            if not isinstance(item, dict):
+                continue
+            doc_id = str(item['doc_id']) if 'doc_id' in item else str(i + 1)
+            yield from _flatten_item(item, doc_id)
+
+
+def batched(items: Iterable, batch_size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most batch_size elements"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
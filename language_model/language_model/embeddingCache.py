@@ -0,0 +1,174 @@
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Index record per slot: hex digest of the cache key and the last time (tick) it was used
+INDEX_DTYPE = np.dtype([('key', 'S40'), ('tick', '<i8')])
+EMPTY_TICK = -1
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so trivially different strings share a cache entry"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+class EmbeddingCache:
+    """Persistent, size-bounded cache of embeddings keyed by (model name, normalized text hash).
+
+    Embeddings live in a memory-mapped float32 matrix with one row per slot and a
+    memory-mapped index file records which key owns each slot and when it was last
+    used. When the cache is full the least recently used slots are overwritten.
+    Each model gets its own sub-directory since embedding sizes differ.
+    """
+
+    def __init__(self, cache_dir, model_name: str, capacity: int):
+        self.model_name = model_name
+        self.capacity = capacity
+        self.directory = Path(cache_dir) / re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        self.meta_path = self.directory / 'meta.json'
+        self.embeddings_path = self.directory / 'embeddings.npy'
+        self.index_path = self.directory / 'index.npy'
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._index = None
+        self._slots = {}
+        self._free_slots = []
+        self._tick = 0
+
+        self._open()
+
+    def _open(self):
+        """Open the cache files if they exist and match the configured model and capacity"""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            if meta.get('model_name') != self.model_name or meta.get('capacity') != self.capacity:
+                print(f"Embedding cache in {self.directory} does not match the configuration, it will be rebuilt")
+                return
+
+            self._embeddings = np.load(self.embeddings_path, mmap_mode='r+')
+            self._index = np.load(self.index_path, mmap_mode='r+')
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error opening embedding cache {self.directory}: {e}")
+            self._embeddings = None
+            self._index = None
+            return
+
+        used = np.flatnonzero(self._index['tick'] != EMPTY_TICK)
+        self._slots = dict(zip(self._index['key'][used].tolist(), used.tolist()))
+        self._free_slots = np.flatnonzero(self._index['tick'] == EMPTY_TICK)[::-1].tolist()
+        self._tick = int(self._index['tick'].max()) + 1 if len(used) else 0
+
+    def _create(self, dim: int):
+        """Create empty cache files for embeddings of size dim"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._embeddings = np.lib.format.open_memmap(self.embeddings_path, mode='w+', dtype=np.float32,
+                                                     shape=(self.capacity, dim))
+        self._index = np.lib.format.open_memmap(self.index_path, mode='w+', dtype=INDEX_DTYPE,
+                                                shape=(self.capacity,))
+        self._index['tick'] = EMPTY_TICK
+        self._slots = {}
+        self._free_slots = list(range(self.capacity - 1, -1, -1))
+        self._tick = 0
+
+        with open(self.meta_path, 'w', encoding='utf-8') as file:
+            json.dump({'model_name': self.model_name, 'capacity': self.capacity, 'dim': dim}, file)
+
+    def make_key(self, text: str) -> bytes:
+        """Return the cache key of a text for this cache's model"""
+        payload = f"{self.model_name}\0{normalize_text(text)}".encode('utf-8')
+        return hashlib.sha1(payload).hexdigest().encode('ascii')
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Return the cached embedding of every text, None where it is not cached"""
+        keys = [self.make_key(text) for text in texts]
+        with self._lock:
+            if self._embeddings is None:
+                self.misses += len(texts)
+                return [None] * len(texts)
+
+            results = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    results.append(None)
+                    continue
+                self._index['tick'][slot] = self._tick
+                self._tick += 1
+                results.append(np.array(self._embeddings[slot]))
+
+            hit_count = sum(result is not None for result in results)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+            return results
+
+    def store(self, texts: Sequence[str], embeddings):
+        """Add embeddings for texts, evicting the least recently used entries if the cache is full"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(texts) == 0 or self.capacity <= 0:
+            return
+
+        # Only the newest entries can be kept if there are more than fit
+        texts = list(texts)[-self.capacity:]
+        embeddings = embeddings[-self.capacity:]
+        keys = [self.make_key(text) for text in texts]
+
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != embeddings.shape[1]:
+                self._create(embeddings.shape[1])
+
+            # Mark entries being overwritten as recently used so eviction skips them
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None:
+                    self._index['tick'][slot] = self._tick
+                    self._tick += 1
+
+            new_keys = list(dict.fromkeys(key for key in keys if key not in self._slots))
+            self._evict(len(new_keys) - len(self._free_slots))
+
+            for key, embedding in zip(keys, embeddings):
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._free_slots.pop()
+                    self._slots[key] = slot
+                    self._index['key'][slot] = key
+                self._embeddings[slot] = embedding
+                self._index['tick'][slot] = self._tick
+                self._tick += 1
+
+    def _evict(self, count: int):
+        """Free count slots holding the least recently used entries"""
+        if count <= 0:
+            return
+
+        ticks = np.array(self._index['tick'])
+        ticks[ticks == EMPTY_TICK] = np.iinfo(np.int64).max
+        victims = np.argpartition(ticks, count - 1)[:count]
+
+        for slot in victims.tolist():
+            del self._slots[bytes(self._index['key'][slot])]
+            self._index['tick'][slot] = EMPTY_TICK
+            self._free_slots.append(slot)
+
+    def flush(self):
+        """Write pending changes of the memory-mapped files to disk"""
+        with self._lock:
+            if self._embeddings is not None:
+                self._embeddings.flush()
+                self._index.flush()
+
+    def __len__(self):
+        return len(self._slots)
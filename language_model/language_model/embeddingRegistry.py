@@ -0,0 +1,137 @@
+import threading
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# torch: full precision PyTorch, torch-int8: dynamically quantized Linear layers,
+# onnx: ONNX Runtime, onnx-int8: ONNX Runtime with a quantized model file
+EMBEDDING_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+DEFAULT_ONNX_INT8_FILE = 'onnx/model_quint8_avx2.onnx'
+
+_settings = {
+    'backend': 'torch',
+    'num_threads': 0,
+    'onnx_file': DEFAULT_ONNX_INT8_FILE,
+    'model_factories': {},
+}
+_models: Dict[tuple, object] = {}
+_lock = threading.Lock()
+_chroma_embedding_function_class = None
+
+
+def configure_embedding_backend(backend: str = 'torch', num_threads: int = 0, onnx_file: str = DEFAULT_ONNX_INT8_FILE):
+    """Select how embedding models are run in this process, 0 threads keeps the library default"""
+    backend = backend.lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    with _lock:
+        _settings.update(backend=backend, num_threads=num_threads, onnx_file=onnx_file)
+
+
+def register_embedding_model(model_name: str, factory: str):
+    """Load model_name with factory instead of sentence-transformers.
+
+    factory is a 'module:callable' path called with the model name, it must
+    return an object with a SentenceTransformer compatible encode method. Being
+    a path it is passed on to the ingestion worker processes with the settings.
+    """
+    with _lock:
+        _settings['model_factories'] = dict(_settings['model_factories'], **{model_name: factory})
+
+
+def get_embedding_settings() -> dict:
+    """Return the current backend settings, e.g. to configure worker processes the same way"""
+    with _lock:
+        return dict(_settings, model_factories=dict(_settings['model_factories']))
+
+
+def get_model_tag(model_name: str) -> str:
+    """Identify the vectors a model produces with the current backend.
+
+    Quantized backends give slightly different vectors, so caches, manifests and
+    collections use this tag instead of the bare model name.
+    """
+    backend = get_embedding_settings()['backend']
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+
+def _load_model(model_name: str, backend: str, num_threads: int, onnx_file: str):
+    factory = _settings['model_factories'].get(model_name)
+    if factory is not None:
+        import importlib
+
+        module_name, attribute = factory.split(':', 1)
+        return getattr(importlib.import_module(module_name), attribute)(model_name)
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+    if backend == 'torch':
+        return SentenceTransformer(model_name, device='cpu')
+
+    if backend == 'torch-int8':
+        model = SentenceTransformer(model_name, device='cpu')
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    if num_threads > 0:
+        session_options.intra_op_num_threads = num_threads
+        session_options.inter_op_num_threads = 1
+    model_kwargs = {'provider': 'CPUExecutionProvider', 'session_options': session_options}
+    if backend == 'onnx-int8':
+        model_kwargs['file_name'] = onnx_file
+    return SentenceTransformer(model_name, device='cpu', backend='onnx', model_kwargs=model_kwargs)
+
+
+def get_embedding_model(model_name: str):
+    """Return the process-wide instance of a model, loading it on first use"""
+    with _lock:
+        settings = dict(_settings)
+        key = (model_name, settings['backend'], settings['onnx_file'])
+        model = _models.get(key)
+        if model is None:
+            model = _load_model(model_name, settings['backend'], settings['num_threads'], settings['onnx_file'])
+            _models[key] = model
+        return model
+
+
+def embed(texts: Sequence[str], model_name: str) -> np.ndarray:
+    """Embed texts with the shared model instance, one float32 row per text"""
+    if len(texts) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    model = get_embedding_model(model_name)
+    # Same settings as chromadb's SentenceTransformerEmbeddingFunction
+    return model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=False).astype(np.float32)
+
+
+def get_chroma_embedding_function(model_name: str):
+    """Return a chromadb embedding function that embeds through this registry.
+
+    It is stored in the collection configuration as chromadb's sentence
+    transformer function, but reuses the shared model instead of loading its own copy.
+    """
+    global _chroma_embedding_function_class
+
+    if _chroma_embedding_function_class is None:
+        from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+
+        class RegistryEmbeddingFunction(SentenceTransformerEmbeddingFunction):
+            def __init__(self, model_name: str):
+                # The parent constructor is skipped, it would load another copy of the model
+                self.model_name = model_name
+                self.device = 'cpu'
+                self.normalize_embeddings = False
+                self.kwargs = {}
+
+            def __call__(self, input: List[str]):
+                return list(embed(list(input), self.model_name))
+
+        _chroma_embedding_function_class = RegistryEmbeddingFunction
+
+    return _chroma_embedding_function_class(model_name)
@@ -0,0 +1,48 @@
+import re
+import zlib
+from typing import List, Sequence
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Same size as all-MiniLM-L6-v2 vectors
+DEFAULT_HASHING_DIMENSION = 384
+
+
+class HashingEmbedder:
+    """Deterministic bag-of-words embedder that needs no model download.
+
+    Words are hashed into a fixed number of signed buckets (feature hashing).
+    Similar texts get similar vectors, which is enough to exercise and time the
+    pipeline offline, but it is no substitute for a sentence transformer.
+    Register it with embeddingRegistry.register_embedding_model(name, 'hashingEmbedder:HashingEmbedder').
+    """
+
+    def __init__(self, model_name: str = 'hashing', dimension: int = DEFAULT_HASHING_DIMENSION):
+        self.model_name = model_name
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _hash_tokens(self, text: str) -> List[int]:
+        # crc32 instead of hash() so every process maps a word to the same bucket
+        return [zlib.crc32(token.encode()) for token in TOKEN_PATTERN.findall(text.lower())]
+
+    def encode(self, sentences: Sequence[str], convert_to_numpy: bool = True, normalize_embeddings: bool = False,
+               **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self.encode([sentences], convert_to_numpy, normalize_embeddings)[0]
+
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            hashes = np.array(self._hash_tokens(sentence), dtype=np.uint32)
+            if len(hashes) == 0:
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(embeddings[row], hashes % self.dimension, signs)
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
@@ -0,0 +1,195 @@
+"""Tune the HNSW index parameters of a collection for recall and latency.
+
+Computes the exact top-k neighbours of a sample of queries by brute force,
+then loads the collection's stored vectors (no embedding work) into a
+scratch collection for every M / ef_construction / ef_search combination
+(Chroma only uses the ef_search an index was loaded with, so it is set at
+creation) and queries it. Reports recall@k and p50/p99 query latency of each
+setting and picks the fastest one meeting the target recall:
+
+    ros2 run language_model hnsw_tuner --collection interactive_upanzi_search --target-recall 0.95 --update-config
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.append(str(Path(__file__).parent))
+
+import numpy as np
+
+import ragImplementation
+
+SCRATCH_COLLECTION_SUFFIX = '_hnsw_tuning'
+
+
+def load_query_texts(file_path: str) -> List[str]:
+    """Queries from a JSON list of strings or a text file with one query per line"""
+    with open(file_path) as file:
+        text = file.read()
+    if file_path.endswith('.json'):
+        return [str(query) for query in json.loads(text)]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def neighbour_thresholds(embeddings: np.ndarray, queries: np.ndarray, k: int, block_size: int = 256) -> np.ndarray:
+    """Cosine similarity of the k-th most similar embedding of every query"""
+    documents = normalize_rows(embeddings)
+    k = min(k, len(documents))
+    thresholds = []
+    for start in range(0, len(queries), block_size):
+        scores = normalize_rows(queries[start:start + block_size]) @ documents.T
+        thresholds.append(-np.partition(-scores, k - 1, axis=1)[:, k - 1])
+    return np.concatenate(thresholds)
+
+
+def measure_queries(collection, queries: np.ndarray, thresholds: np.ndarray, k: int,
+                    tolerance: float = 1e-4) -> Dict[str, float]:
+    """Query the collection one query at a time like a prompt does, returns recall@k and latency percentiles.
+
+    A result counts as a true neighbour when it is at least as similar as the
+    k-th exact neighbour, so documents tied with it are not counted as misses.
+    """
+    # The first query after a build loads the index, it is not timed
+    collection.query(query_embeddings=queries[:1].tolist(), n_results=k, include=[])
+
+    latencies, recalls = [], []
+    for query, threshold in zip(queries, thresholds):
+        start = time.perf_counter()
+        results = collection.query(query_embeddings=[query.tolist()], n_results=k, include=['distances'])
+        latencies.append(time.perf_counter() - start)
+        similarities = 1 - np.asarray(results['distances'][0])
+        recalls.append(np.count_nonzero(similarities >= threshold - tolerance) / k)
+
+    milliseconds = np.asarray(latencies) * 1000
+    return {
+        'recall': float(np.mean(recalls)),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+    }
+
+
+def sweep(items: Dict, queries: np.ndarray, thresholds: np.ndarray, k: int, m_values: List[int],
+          ef_construction_values: List[int], ef_search_values: List[int], scratch_name: str) -> List[Dict]:
+    """Build a scratch collection per M / ef_construction / ef_search and measure it"""
+    store = ragImplementation.get_vector_store()
+    results = []
+    for m, ef_construction, ef_search in itertools.product(m_values, ef_construction_values, ef_search_values):
+        hnsw = {'max_neighbors': m, 'ef_construction': ef_construction, 'ef_search': ef_search}
+        try:
+            store.delete_collection(scratch_name)
+        except Exception:
+            pass
+
+        start = time.perf_counter()
+        collection = store.create_collection(scratch_name, metadata={'description': 'HNSW tuning'},
+                                             configuration=ragImplementation.get_collection_configuration(hnsw))
+        try:
+            store.bulk_load(collection, items['ids'], items['embeddings'], items['documents'], items['metadatas'])
+            build_seconds = time.perf_counter() - start
+            result = dict(m=m, ef_construction=ef_construction, ef_search=ef_search, build_seconds=build_seconds,
+                          **measure_queries(collection, queries, thresholds, k))
+        finally:
+            store.delete_collection(scratch_name)
+
+        print(f"M {m:3d}, ef_construction {ef_construction:4d}, ef_search {ef_search:4d}: "
+              f"recall@{k} {result['recall']:.3f}, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms "
+              f"(built in {build_seconds:.1f}s)", flush=True)
+        results.append(result)
+    return results
+
+
+def choose_settings(results: List[Dict], target_recall: float) -> Dict:
+    """Fastest (p50, then p99) setting meeting the target recall, or the most accurate one if none does"""
+    meeting = [result for result in results if result['recall'] >= target_recall]
+    if meeting:
+        return min(meeting, key=lambda result: (result['p50_ms'], result['p99_ms']))
+    return max(results, key=lambda result: (result['recall'], -result['p50_ms']))
+
+
+def parse_values(text: str) -> List[int]:
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default=str(ragImplementation.parent_dir / 'config' / 'ragSystem.ini'))
+    parser.add_argument('--collection', default=ragImplementation.DEFAULT_COLLECTION_NAME)
+    parser.add_argument('--queries', help="JSON list or text file of queries, stored vectors are sampled if omitted")
+    parser.add_argument('--sample', type=int, default=200, help="number of queries used")
+    parser.add_argument('--k', type=int, help="neighbours compared for recall@k, topK of the config by default")
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--m', default='8,16,32', help="comma separated M (max_neighbors) values")
+    parser.add_argument('--ef-construction', default='100,200')
+    parser.add_argument('--ef-search', default='10,40,160')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    parser.add_argument('--update-config', action='store_true', help="write the chosen settings into the config file")
+    options = parser.parse_args(args)
+
+    config = ragImplementation.read_config(options.config)
+    ragImplementation.configure_rag_system(config)
+    k = options.k or int(config.get('topK', 3))
+
+    collection = ragImplementation.get_similarity_search_collection(options.collection)
+    if collection is None:
+        return None
+    items = ragImplementation.read_collection_items(collection)
+    if not items['ids']:
+        print(f"Collection {options.collection} is empty.")
+        return None
+    k = min(k, len(items['ids']))
+
+    rng = np.random.default_rng(options.seed)
+    if options.queries:
+        query_texts = load_query_texts(options.queries)[:options.sample]
+        queries = np.asarray(ragImplementation.embed_texts(query_texts), dtype=np.float32)
+    else:
+        # Stored vectors stand in for queries, their own document is one of the k neighbours
+        rows = rng.choice(len(items['ids']), size=min(options.sample, len(items['ids'])), replace=False)
+        queries = items['embeddings'][rows]
+
+    print(f"Computing exact top-{k} neighbours of {len(queries)} queries over {len(items['ids'])} vectors...")
+    thresholds = neighbour_thresholds(items['embeddings'], queries, k)
+
+    results = sweep(items, queries, thresholds, k, parse_values(options.m), parse_values(options.ef_construction),
+                    sorted(parse_values(options.ef_search)), f"{options.collection}{SCRATCH_COLLECTION_SUFFIX}")
+    best = choose_settings(results, options.target_recall)
+    settings = {'hnswEfSearch': best['ef_search'], 'hnswEfConstruction': best['ef_construction'], 'hnswM': best['m']}
+
+    if best['recall'] < options.target_recall:
+        print(f"No setting reached recall {options.target_recall:g}, the most accurate one is:")
+    print(f"Chosen: recall@{k} {best['recall']:.3f}, p50 {best['p50_ms']:.2f} ms, p99 {best['p99_ms']:.2f} ms")
+    print("\n".join(f"{key} {value}" for key, value in settings.items()))
+
+    report = {
+        'collection': options.collection,
+        'vectors': len(items['ids']),
+        'queries': len(queries),
+        'k': k,
+        'target_recall': options.target_recall,
+        'results': results,
+        'best': best,
+        'settings': settings,
+    }
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if options.update_config:
+        ragImplementation.update_config(options.config, settings)
+        print(f"Updated {options.config}, rebuild the collection with create_collection to apply them.")
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
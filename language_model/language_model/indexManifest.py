@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+MANIFEST_VERSION = 1
+
+
+def content_hash(document: str, metadata: Dict, model_name: str) -> str:
+    """Hash everything that ends up in the collection for one item.
+
+    The embedding model name is part of the hash so switching models re-embeds
+    every item on the next sync.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(document.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(metadata, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_manifest_path(manifest_dir, collection_name: str) -> Path:
+    """Return the manifest file used for a collection"""
+    return Path(manifest_dir) / f"{collection_name}.manifest.json"
+
+
+def load_manifest(path) -> Optional[Dict[str, str]]:
+    """Load the doc_id -> content hash map, None if there is no usable manifest"""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('version') != MANIFEST_VERSION:
+            return None
+        return data.get('items', {})
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading manifest {path}: {e}")
+        return None
+
+
+def save_manifest(path, manifest: Dict[str, str]):
+    """Atomically write the doc_id -> content hash map"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': MANIFEST_VERSION, 'items': manifest}, file)
+    os.replace(tmp_path, path)
+
+
+def delete_manifest(path):
+    """Remove a collection manifest if it exists"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def track_hashes(documents: Iterable[Tuple[str, str, Dict]], manifest: Dict[str, str],
+                 model_name: str) -> Iterator[Tuple[str, str, Dict, str]]:
+    """Record the content hash of every (id, document, metadata) in manifest while passing it on with its hash"""
+    for doc_id, document, metadata in documents:
+        digest = content_hash(document, metadata, model_name)
+        manifest[doc_id] = digest
+        yield doc_id, document, metadata, digest
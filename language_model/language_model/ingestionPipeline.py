@@ -0,0 +1,153 @@
+import itertools
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from embeddingRegistry import (configure_embedding_backend, embed, get_embedding_model, get_embedding_settings,
+                               register_embedding_model)
+
+# One (ids, documents, metadatas) triple per batch
+Batch = Tuple[List[str], List[str], List[Dict]]
+
+# Name of the model the pool workers embed with, set by _init_embedding_worker
+_worker_model_name = None
+
+
+def _init_embedding_worker(model_name: str, num_threads: int, backend_settings: dict):
+    """Load the embedding model in a pool worker, limiting it to its share of the CPU threads"""
+    global _worker_model_name
+
+    configure_embedding_backend(backend_settings['backend'], num_threads, backend_settings['onnx_file'])
+    for registered_name, factory in backend_settings.get('model_factories', {}).items():
+        register_embedding_model(registered_name, factory)
+    get_embedding_model(model_name)
+    _worker_model_name = model_name
+
+
+def _embed_batch(documents: List[str]):
+    """Embed one batch of documents in a pool worker"""
+    return embed(documents, _worker_model_name)
+
+
+class _InProcessExecutor:
+    """Runs submitted calls right away in this process, used instead of the pool when there is nothing to parallelize"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def resolve_worker_count(num_workers: int) -> int:
+    """Return the number of embedding processes to use, 0 or less means one per CPU core"""
+    if num_workers and num_workers > 0:
+        return num_workers
+    return os.cpu_count() or 1
+
+
+def ingest_batches(collection, batches: Iterable[Batch], model_name: str, num_workers: int = 0,
+                   write_method: str = 'add', verbose_mode: bool = False, embedding_cache=None) -> int:
+    """Embed batches in a process pool and write them to the collection as they complete.
+
+    Up to two batches per worker are embedded ahead while finished batches are
+    written to the collection in order, so embedding and writing overlap.
+    With one worker or a single batch the documents are embedded in this
+    process with its already loaded model, since starting a worker costs more
+    than it saves.
+    write_method selects the collection method used to store a batch ('add' or 'upsert').
+    If an embedding_cache is given, cached documents skip the model and newly
+    computed embeddings are added to the cache.
+    Returns the number of items written.
+    """
+    workers = resolve_worker_count(num_workers)
+
+    # Peek at the first two batches to tell whether there is more than one
+    batches = iter(batches)
+    first_batches = list(itertools.islice(batches, 2))
+    batches = itertools.chain(first_batches, batches)
+    in_process = workers == 1 or len(first_batches) < 2
+    if in_process:
+        workers = 1
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    max_in_flight = 2 * workers
+    write = getattr(collection, write_method)
+
+    total_written = 0
+    total_cached = 0
+    start_time = time.perf_counter()
+
+    def submit_batch(pool, batch: Batch):
+        documents = batch[1]
+        cached = embedding_cache.lookup(documents) if embedding_cache is not None else [None] * len(documents)
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        future = pool.submit(embed_documents, [documents[i] for i in missing]) if missing else None
+        return batch, cached, missing, future
+
+    def write_batch(batch: Batch, cached, missing, future):
+        nonlocal total_written, total_cached
+        ids, documents, metadatas = batch
+
+        if future is not None:
+            computed = future.result()
+            for i, embedding in zip(missing, computed):
+                cached[i] = embedding
+            if embedding_cache is not None:
+                embedding_cache.store([documents[i] for i in missing], computed)
+
+        embeddings = np.stack(cached).astype(np.float32)
+        write(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings.tolist())
+        total_written += len(ids)
+        total_cached += len(ids) - len(missing)
+
+        if verbose_mode:
+            elapsed = time.perf_counter() - start_time
+            rate = total_written / elapsed if elapsed > 0 else 0.0
+            print(f"Ingested {total_written} items ({rate:.1f} docs/sec)")
+
+    if in_process:
+        executor = _InProcessExecutor()
+
+        def embed_documents(documents: List[str]):
+            return embed(documents, model_name)
+    else:
+        # spawn rather than fork: forking a process that already runs torch threads can deadlock
+        context = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_embedding_worker,
+                                       initargs=(model_name, threads_per_worker, get_embedding_settings()))
+        embed_documents = _embed_batch
+
+    with executor as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(submit_batch(pool, batch))
+            while len(pending) >= max_in_flight:
+                write_batch(*pending.popleft())
+
+        while pending:
+            write_batch(*pending.popleft())
+
+    if embedding_cache is not None:
+        embedding_cache.flush()
+
+    elapsed = time.perf_counter() - start_time
+    if total_written:
+        print(f"Embedded and stored {total_written} items in {elapsed:.1f}s "
+              f"({total_written / max(elapsed, 1e-9):.1f} docs/sec, {'in-process' if in_process else f'{workers} workers'}, "
+              f"{total_cached} from embedding cache)")
+
+    return total_written
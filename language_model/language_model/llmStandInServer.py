@@ -0,0 +1,186 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+DEFAULT_RESPONSE_TEXT = ("Thanks for asking! The Upanzi lab builds digital public infrastructure for Africa. "
+                         "The retrieved options describe its projects, which is why they match your question.")
+
+
+def stand_in_tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text)
+
+
+def common_prefix_length(a: List[str], b: List[str]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class StandInLLMServer:
+    """Local stand-in for the llama.cpp server, for measurements without a model.
+
+    Serves /v1/completions (plain and streaming), /tokenize and /health. Each
+    slot remembers the tokens of its last prompt like llama.cpp's KV cache: with
+    cache_prompt only the tokens after the shared prefix are evaluated, costing
+    prompt_ms_per_token each. Every request also takes latency_ms plus
+    generation_ms_per_token per generated word. Responses carry llama.cpp style 'timings'.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, num_slots: int = 1,
+                 prompt_ms_per_token: float = 0.5, generation_ms_per_token: float = 0.0,
+                 response_text: str = DEFAULT_RESPONSE_TEXT, latency_ms: float = 0.0):
+        self.num_slots = num_slots
+        self.latency_ms = latency_ms
+        self.prompt_ms_per_token = prompt_ms_per_token
+        self.generation_ms_per_token = generation_ms_per_token
+        self.response_text = response_text
+
+        self._slot_tokens: List[List[str]] = [[] for _ in range(num_slots)]
+        self._slot_locks = [threading.Lock() for _ in range(num_slots)]
+        self._lock = threading.Lock()
+        self.requests = 0
+
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        """Serve in a background thread and return the OpenAI compatible base url"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return f"{self.url}/v1"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        """Forget the cached prompts of all slots"""
+        with self._lock:
+            self._slot_tokens = [[] for _ in range(self.num_slots)]
+            self.requests = 0
+
+    def _choose_slot(self, tokens: List[str], requested_slot: int) -> int:
+        if 0 <= requested_slot < self.num_slots:
+            return requested_slot
+        with self._lock:
+            # Like llama.cpp, take the idle slot whose cached prompt shares the longest prefix
+            idle_slots = [slot for slot in range(self.num_slots) if not self._slot_locks[slot].locked()]
+            return max(idle_slots or range(self.num_slots),
+                       key=lambda slot: common_prefix_length(tokens, self._slot_tokens[slot]))
+
+    def complete(self, body: Dict) -> Dict:
+        """Evaluate a completion request, sleeping for the simulated compute time"""
+        prompt = body.get('prompt', '')
+        if isinstance(prompt, list):
+            prompt = prompt[0] if prompt else ''
+        tokens = stand_in_tokenize(prompt)
+        slot = self._choose_slot(tokens, int(body.get('id_slot', -1)))
+
+        with self._slot_locks[slot]:
+            cached = common_prefix_length(tokens, self._slot_tokens[slot]) if body.get('cache_prompt', True) else 0
+            # The last prompt token is always evaluated to produce logits
+            cached = min(cached, max(len(tokens) - 1, 0))
+            evaluated = len(tokens) - cached
+
+            start = time.perf_counter()
+            time.sleep(evaluated * self.prompt_ms_per_token / 1000)
+            prompt_ms = (time.perf_counter() - start) * 1000
+
+            words = self.response_text.split(' ')[:max(1, int(body.get('max_tokens', 16)))]
+            time.sleep((self.latency_ms + len(words) * self.generation_ms_per_token) / 1000)
+            self._slot_tokens[slot] = tokens
+
+        with self._lock:
+            self.requests += 1
+
+        return {
+            'text': ' '.join(words),
+            'words': words,
+            'timings': {
+                'prompt_n': evaluated,
+                'cache_n': cached,
+                'prompt_ms': prompt_ms,
+                'predicted_n': len(words),
+                'id_slot': slot,
+            },
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: Dict, status: int = 200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self) -> Dict:
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._send_json({'status': 'ok'})
+                else:
+                    self._send_json({'error': 'not found'}, 404)
+
+            def do_POST(self):
+                if self.path == '/tokenize':
+                    self._send_json({'tokens': list(range(len(stand_in_tokenize(self._read_json().get('content', '')))))})
+                elif self.path == '/v1/completions':
+                    self._complete(self._read_json())
+                else:
+                    self._send_json({'error': 'not found'}, 404)
+
+            def _complete(self, body: Dict):
+                result = server.complete(body)
+                base = {'id': f"cmpl-{server.requests}", 'object': 'text_completion', 'created': int(time.time()),
+                        'model': body.get('model', 'stand-in')}
+
+                if not body.get('stream'):
+                    self._send_json(dict(base, choices=[{'text': result['text'], 'index': 0, 'logprobs': None,
+                                                         'finish_reason': 'stop'}],
+                                         usage={'prompt_tokens': result['timings']['prompt_n'] + result['timings']['cache_n'],
+                                                'completion_tokens': len(result['words']),
+                                                'total_tokens': result['timings']['prompt_n'] + result['timings']['cache_n']
+                                                + len(result['words'])},
+                                         timings=result['timings']))
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for i, word in enumerate(result['words']):
+                    text = word if i == 0 else f" {word}"
+                    chunk = dict(base, choices=[{'text': text, 'index': 0, 'logprobs': None, 'finish_reason': None}])
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                final = dict(base, choices=[{'text': '', 'index': 0, 'logprobs': None, 'finish_reason': 'stop'}],
+                             timings=result['timings'])
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
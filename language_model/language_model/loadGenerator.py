@@ -0,0 +1,394 @@
+"""Load generator for the rag_prompt service.
+
+Sends queries to rag_prompt at fixed rates (open loop: requests are sent on
+schedule whether or not earlier ones finished) or with fixed numbers of
+requests in flight (closed loop), one step per rate or concurrency. Reports
+latency percentiles and histograms, throughput and error and fallback rates
+per step as JSON, and the highest step that still meets the latency SLO:
+
+    ros2 run language_model load_generator --qps 0.5,1,2,4 --duration 60 --output load.json
+    ros2 run language_model load_generator --concurrency 1,2,4 --stand-in --compare load.json
+
+With --stand-in the service is answered in-process from a synthetic corpus
+with the hashing embedder, an in-memory vector store and the stand-in LLM
+server, so capacity can be explored without a robot, model or database.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(str(Path(__file__).parent))
+
+import numpy as np
+import rclpy
+from rclpy.callback_groups import ReentrantCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
+from rclpy.node import Node
+
+from llm_interfaces.srv import Prompt
+from metrics import Histogram
+from ragImplementation import FALLBACK_RESPONSE, NO_MATCH_RESPONSE
+from syntheticCorpus import generate_queries
+
+REPORT_FORMAT_VERSION = 1
+STAND_IN_COLLECTION = 'load_test_collection'
+
+# Outcomes of a request; answered requests are the ones that got a response in time
+ANSWERED_OUTCOMES = ('ok', 'fallback', 'no_match')
+OUTCOMES = ANSWERED_OUTCOMES + ('error', 'timeout')
+
+
+def load_queries(file_path: Optional[str], num_generated: int = 200, seed: int = 1) -> List[str]:
+    """Queries from a JSON list (strings or objects with a 'prompt') or a text file with one query per line.
+
+    Without a file, synthetic queries over the stand-in corpus vocabulary are generated.
+    """
+    if not file_path:
+        return generate_queries(num_generated, seed=seed)
+
+    with open(file_path) as file:
+        text = file.read()
+
+    if file_path.endswith('.json'):
+        items = json.loads(text)
+        return [item if isinstance(item, str) else item.get('prompt', item.get('query', '')) for item in items]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith('#')]
+
+
+def classify_response(response: str) -> str:
+    if response == FALLBACK_RESPONSE:
+        return 'fallback'
+    if response == NO_MATCH_RESPONSE:
+        return 'no_match'
+    return 'ok' if response else 'error'
+
+
+class RequestLog:
+    """Start time, latency and outcome of every request of a step, shared with the executor thread"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.step_start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.requests: List[Dict] = []
+
+    def start(self) -> Dict:
+        request = {'start': time.perf_counter(), 'latency': None, 'outcome': None}
+        with self._lock:
+            self.requests.append(request)
+        return request
+
+    def finish(self, request: Dict, outcome: str):
+        with self._lock:
+            if request['outcome'] is not None:
+                return
+            request['latency'] = time.perf_counter() - request['start']
+            # A late answer still counts as a timeout, its caller has given up on it
+            request['outcome'] = 'timeout' if request['latency'] > self.timeout else outcome
+
+    def expire(self):
+        """Mark requests still waiting for an answer as timed out"""
+        with self._lock:
+            for request in self.requests:
+                if request['outcome'] is None:
+                    request['outcome'] = 'timeout'
+
+    def outstanding(self) -> int:
+        with self._lock:
+            return sum(1 for request in self.requests if request['outcome'] is None)
+
+
+class LoadGeneratorNode(Node):
+    def __init__(self, service_name: str, collection_name: str = ''):
+        super().__init__('rag_load_generator')
+        self.collection_name = collection_name
+        self.client = self.create_client(Prompt, service_name, callback_group=ReentrantCallbackGroup())
+
+    def send(self, query: str, log: RequestLog, on_done=None) -> Dict:
+        """Send one prompt without waiting for it, its outcome is recorded in log"""
+        request = log.start()
+        future = self.client.call_async(Prompt.Request(prompt=query, collection=self.collection_name))
+
+        def done(completed_future):
+            try:
+                log.finish(request, classify_response(completed_future.result().response))
+            except Exception:
+                log.finish(request, 'error')
+            if on_done is not None:
+                on_done()
+
+        future.add_done_callback(done)
+        return request
+
+
+def run_open_loop(node: LoadGeneratorNode, queries: List[str], qps: float, duration: float, timeout: float,
+                  poisson: bool, rng: random.Random) -> RequestLog:
+    """Send requests at qps for duration seconds, then wait up to timeout for the last answers"""
+    log = RequestLog(timeout)
+    start = time.perf_counter()
+    next_send = start
+    i = 0
+    while next_send - start < duration:
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        node.send(queries[i % len(queries)], log)
+        i += 1
+        next_send += rng.expovariate(qps) if poisson else 1.0 / qps
+
+    deadline = time.perf_counter() + timeout
+    while log.outstanding() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    log.expire()
+    return log
+
+
+def run_closed_loop(node: LoadGeneratorNode, queries: List[str], concurrency: int, duration: float,
+                    timeout: float) -> RequestLog:
+    """Keep concurrency requests in flight for duration seconds, each sender waits for its answer"""
+    log = RequestLog(timeout)
+    end = time.perf_counter() + duration
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def sender():
+        while time.perf_counter() < end:
+            with counter_lock:
+                i = next(counter)
+            answered = threading.Event()
+            request = node.send(queries[i % len(queries)], log, answered.set)
+            if not answered.wait(timeout):
+                log.finish(request, 'timeout')
+
+    threads = [threading.Thread(target=sender, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.expire()
+    return log
+
+
+def summarize_step(log: RequestLog, warm_up: float, duration: float) -> Dict:
+    """Latency, throughput and outcome rates of the requests started after the warm-up"""
+    requests = [request for request in log.requests if request['start'] - log.step_start >= warm_up]
+    window = max(duration - warm_up, 1e-9)
+
+    outcomes = {outcome: 0 for outcome in OUTCOMES}
+    for request in requests:
+        outcomes[request['outcome']] += 1
+
+    latencies = np.array([request['latency'] for request in requests if request['outcome'] in ANSWERED_OUTCOMES])
+    histogram = Histogram()
+    for latency in latencies:
+        histogram.observe(float(latency))
+
+    # Answers that trail in after the last request was sent stretch the time the step took to serve its load
+    answered = [request for request in requests if request['outcome'] in ANSWERED_OUTCOMES]
+    serving_time = max([window] + [request['start'] + request['latency'] - log.step_start - warm_up
+                                   for request in answered])
+
+    total = len(requests)
+    summary = {
+        'requests': total,
+        'offered_qps': total / window,
+        'throughput_qps': len(answered) / serving_time,
+        'outcomes': outcomes,
+        'error_rate': (outcomes['error'] + outcomes['timeout']) / total if total else 0.0,
+        'fallback_rate': outcomes['fallback'] / total if total else 0.0,
+        'histogram': {'buckets': list(histogram.buckets), 'counts': histogram.counts},
+    }
+    if len(latencies):
+        milliseconds = latencies * 1000
+        summary['latency'] = {
+            'p50_ms': float(np.percentile(milliseconds, 50)),
+            'p90_ms': float(np.percentile(milliseconds, 90)),
+            'p99_ms': float(np.percentile(milliseconds, 99)),
+            'mean_ms': float(milliseconds.mean()),
+            'max_ms': float(milliseconds.max()),
+        }
+    return summary
+
+
+def meets_slo(step: Dict, slo_p99_ms: float, max_error_rate: float) -> bool:
+    """A step is sustained when the p99 latency and the error rate stay within the limits and nothing piles up"""
+    latency = step.get('latency')
+    if latency is None or latency['p99_ms'] > slo_p99_ms or step['error_rate'] > max_error_rate:
+        return False
+    # An open loop that answers much slower than it sends is saturated even if the answers are still fast
+    return step['mode'] == 'closed' or step['throughput_qps'] >= 0.9 * step['offered_qps']
+
+
+class StandInRAGService(Node):
+    """rag_prompt service answered in-process by the pipeline running on local stand-ins"""
+
+    def __init__(self, service_name: str, collection, top_k: int):
+        super().__init__('rag_stand_in_node')
+        self.collection = collection
+        self.top_k = top_k
+        self.srv = self.create_service(Prompt, service_name, self.rag_prompt_callback,
+                                       callback_group=ReentrantCallbackGroup())
+
+    def rag_prompt_callback(self, request, response):
+        import ragImplementation
+        response.response = ragImplementation.handle_rag_query(self.collection, request.prompt, [], False, self.top_k)
+        return response
+
+
+def start_stand_in_service(options, work_dir: str):
+    """Load a synthetic corpus into the pipeline and serve it, returns the node and the stand-in LLM server"""
+    import ragImplementation
+    from llmStandInServer import StandInLLMServer
+    from ragBenchmark import get_stand_in_config
+    from syntheticCorpus import write_corpus
+
+    server = StandInLLMServer(num_slots=options.llm_slots, latency_ms=options.llm_latency_ms,
+                              generation_ms_per_token=options.generation_ms_per_token)
+    ragImplementation.configure_rag_system(get_stand_in_config(work_dir, server.start()))
+
+    data_file_path = os.path.join(work_dir, 'corpus.json')
+    write_corpus(data_file_path, num_documents=options.documents, seed=options.seed)
+    collection = ragImplementation.create_collection_and_load_data(STAND_IN_COLLECTION, 'load test', data_file_path,
+                                                                    num_workers=1)
+    return StandInRAGService(options.service, collection, options.top_k), server
+
+
+def compare_reports(previous: Dict, current: Dict):
+    """Print how the latency and throughput of each step changed relative to an earlier report"""
+    previous_steps = {(step['mode'], step['target']): step for step in previous.get('steps', [])}
+    for step in current['steps']:
+        old_step = previous_steps.get((step['mode'], step['target']))
+        if old_step is None:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p99_ms'):
+            old_value = old_step.get('latency', {}).get(metric)
+            value = step.get('latency', {}).get(metric)
+            if old_value and value is not None:
+                changes.append(f"{metric} {old_value:.1f} -> {value:.1f} ({100 * (value / old_value - 1):+.1f}%)")
+        if old_step['throughput_qps']:
+            changes.append(f"throughput {old_step['throughput_qps']:.2f} -> {step['throughput_qps']:.2f} qps")
+        print(f"{step['mode']} {step['target']}: " + ", ".join(changes))
+
+
+def print_step(step: Dict):
+    latency = step.get('latency', {})
+    print(f"{step['mode']:>6} {step['target']:>7g}: {step['throughput_qps']:6.2f} qps answered, "
+          f"p50 {latency.get('p50_ms', float('nan')):8.1f} ms, p99 {latency.get('p99_ms', float('nan')):8.1f} ms, "
+          f"errors {100 * step['error_rate']:5.1f}%, fallbacks {100 * step['fallback_rate']:5.1f}%"
+          f"{'' if step['sustained'] else '  (over SLO)'}", file=sys.stderr, flush=True)
+
+
+def parse_targets(text: Optional[str], convert) -> List:
+    return [convert(value) for value in text.split(',') if value.strip()] if text else []
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', help="JSON list or text file (one query per line), synthetic queries if omitted")
+    parser.add_argument('--qps', help="comma separated request rates, one open loop step each")
+    parser.add_argument('--concurrency', help="comma separated numbers of requests in flight, one closed loop step each")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds per step")
+    parser.add_argument('--warm-up', type=float, default=5.0, help="seconds at the start of a step that are not reported")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds after which a request counts as failed")
+    parser.add_argument('--poisson', action='store_true', help="open loop requests arrive randomly instead of evenly")
+    parser.add_argument('--slo-p99-ms', type=float, default=5000.0, help="p99 latency a sustained step must meet")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--service', default='rag_prompt')
+    parser.add_argument('--collection', default='', help="collection the prompts are routed to, the node's default if empty")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    parser.add_argument('--compare', help="report JSON of an earlier run to compare with")
+    stand_in = parser.add_argument_group('stand-in service')
+    stand_in.add_argument('--stand-in', action='store_true', help="serve the service in-process on local stand-ins")
+    stand_in.add_argument('--documents', type=int, default=200, help="top level documents in the synthetic corpus")
+    stand_in.add_argument('--top-k', type=int, default=3)
+    stand_in.add_argument('--llm-slots', type=int, default=1, help="requests the stand-in LLM evaluates in parallel")
+    stand_in.add_argument('--llm-latency-ms', type=float, default=200.0, help="fixed latency of the stand-in LLM")
+    stand_in.add_argument('--generation-ms-per-token', type=float, default=5.0)
+    options = parser.parse_args(args)
+
+    steps = [('open', target) for target in parse_targets(options.qps, float)] + \
+            [('closed', target) for target in parse_targets(options.concurrency, int)]
+    if not steps:
+        parser.error("give at least one --qps or --concurrency step")
+    if options.warm_up >= options.duration:
+        parser.error("--warm-up must be shorter than --duration")
+
+    queries = load_queries(options.queries, seed=options.seed + 1)
+    if not queries:
+        parser.error(f"no queries in {options.queries}")
+
+    rclpy.init()
+    node = LoadGeneratorNode(options.service, options.collection)
+    executor = MultiThreadedExecutor()
+    executor.add_node(node)
+
+    work_dir = tempfile.TemporaryDirectory() if options.stand_in else None
+    server = None
+    if work_dir is not None:
+        stand_in_node, server = start_stand_in_service(options, work_dir.name)
+        executor.add_node(stand_in_node)
+
+    spin_thread = threading.Thread(target=executor.spin, daemon=True)
+    spin_thread.start()
+
+    report = None
+    try:
+        if not node.client.wait_for_service(timeout_sec=10.0):
+            print(f"Service {options.service} is not available.")
+            return None
+
+        rng = random.Random(options.seed)
+        results = []
+        for mode, target in steps:
+            if mode == 'open':
+                log = run_open_loop(node, queries, target, options.duration, options.timeout, options.poisson, rng)
+            else:
+                log = run_closed_loop(node, queries, target, options.duration, options.timeout)
+            step = dict(mode=mode, target=target, **summarize_step(log, options.warm_up, options.duration))
+            step['sustained'] = meets_slo(step, options.slo_p99_ms, options.max_error_rate)
+            print_step(step)
+            results.append(step)
+
+        sustained = [step for step in results if step['sustained']]
+        report = {
+            'version': REPORT_FORMAT_VERSION,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+            'options': vars(options),
+            'steps': results,
+            'max_sustained_qps': max((step['throughput_qps'] for step in sustained), default=0.0),
+        }
+        print(f"Highest sustained throughput: {report['max_sustained_qps']:.2f} qps "
+              f"(p99 <= {options.slo_p99_ms:g} ms, errors <= {100 * options.max_error_rate:g}%)")
+
+        if options.compare:
+            with open(options.compare) as file:
+                compare_reports(json.load(file), report)
+
+        if options.output:
+            with open(options.output, 'w') as file:
+                json.dump(report, file, indent=2)
+    finally:
+        executor.shutdown()
+        if server is not None:
+            server.stop()
+        if work_dir is not None:
+            work_dir.cleanup()
+        rclpy.try_shutdown()
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
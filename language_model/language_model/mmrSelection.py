@@ -0,0 +1,48 @@
+from typing import List, Sequence
+
+import numpy as np
+
+DEFAULT_MMR_LAMBDA = 0.7
+DEFAULT_MMR_CANDIDATES = 20
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def maximal_marginal_relevance(query_embedding: Sequence[float], candidate_embeddings: Sequence[Sequence[float]],
+                               k: int, lambda_mult: float = DEFAULT_MMR_LAMBDA) -> List[int]:
+    """Pick k diverse candidates with maximal marginal relevance, returns their indices in pick order.
+
+    Each step picks the candidate maximizing
+    lambda_mult * sim(query, c) - (1 - lambda_mult) * max sim(c, already picked),
+    so 1.0 ranks by relevance only and lower values favour diversity. The
+    candidate-candidate cosine matrix is computed once and the step only
+    updates a running maximum, keeping selection O(k * n) after one matrix product.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    num_candidates = len(candidates)
+    k = min(k, num_candidates)
+    if k <= 0:
+        return []
+
+    candidates = normalize_rows(candidates)
+    query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    available = np.ones(num_candidates, dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        np.maximum(max_similarity, similarity[chosen], out=max_similarity)
+
+    return selected
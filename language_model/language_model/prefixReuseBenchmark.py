@@ -0,0 +1,146 @@
+"""Measure the prompt evaluation saved by the prefix-first prompt layout.
+
+Runs the same conversation against a StandInLLMServer with the old
+query-first prompt and with build_rag_prompt, and reports how many prompt
+tokens the server had to evaluate and how long that took. Start it with
+python3 prefixReuseBenchmark.py [--turns N] [--output results.json].
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.append(str(Path(__file__).parent))
+
+import ragImplementation
+from llmStandInServer import StandInLLMServer
+
+SAMPLE_CONVERSATION = [
+    "What is Upanzi?",
+    "Who leads the lab?",
+    "Which projects work on digital identity?",
+    "Can students join the research?",
+    "Where is the lab located?",
+    "How is it funded?",
+    "What does the digital payments project do?",
+    "How can I contact the team?",
+]
+
+SAMPLE_DOCUMENTS = [
+    {'doc_id': '1', 'section': 'About Upanzi',
+     'content': "The Upanzi Network is a pan-African network building digital public infrastructure. "
+                "It brings together universities, governments and companies."},
+    {'doc_id': '2', 'section': 'Projects',
+     'content': "Projects cover digital identity, digital payments and data exchange. "
+                "Each project publishes open source software and research papers."},
+    {'doc_id': '3', 'section': 'People',
+     'content': "The lab is run by faculty and researchers at Carnegie Mellon University Africa in Kigali. "
+                "Students join as research assistants."},
+    {'doc_id': '4', 'section': 'Contact',
+     'content': "The team can be reached through the lab website and at events hosted in Kigali."},
+]
+
+
+def build_query_first_prompt(query: str, search_results: List[Dict], conversation_history: List[Dict]) -> str:
+    """The previous prompt layout, the query comes before the static instructions.
+
+    The conversation is included as well so both layouts send the same text.
+    """
+    context = ragImplementation.prepare_context_for_llm(query, search_results)
+    history = ragImplementation.format_conversation_history(conversation_history)
+    return f'''You are a helpful upanzi lab assistant. A user is asking questions about the Upanzi, and I've retrieved relevant options from a document database.
+
+User Query: "{query}"
+
+{history}Retrieved Document Information:
+{context}
+
+Please provide a helpful, short response that:
+1. Acknowledges the user's request
+2. Answers the question or comment from the retrieved options
+3. Explains why these answers match their request
+4. Includes relevant details
+5. Uses a friendly, conversational tone
+6. Keeps the response concise but informative
+
+Response:'''
+
+
+def run_conversation(build_prompt: Callable, turns: int) -> Dict:
+    """Send the sample conversation through the LLM client, keeping history like RAGNode does"""
+    conversation_history = []
+    totals = {'requests': 0, 'prompt_tokens_evaluated': 0, 'prompt_tokens_cached': 0, 'prompt_ms': 0.0,
+              'wall_ms': 0.0}
+
+    for i in range(turns):
+        query = SAMPLE_CONVERSATION[i % len(SAMPLE_CONVERSATION)]
+        search_results = [dict(document, similarity_score=0.8 - 0.1 * rank)
+                          for rank, document in enumerate(SAMPLE_DOCUMENTS[i % 2:i % 2 + 3])]
+        prompt = build_prompt(query, search_results, conversation_history)
+
+        start = time.perf_counter()
+        response = ragImplementation.client_manager.call_llm(lambda llm_client: llm_client.completions.create(
+            model=ragImplementation.client_manager.settings['llmModel'],
+            prompt=prompt,
+            max_tokens=64,
+            extra_body=ragImplementation.client_manager.get_completion_options()
+        ))
+        totals['wall_ms'] += (time.perf_counter() - start) * 1000
+
+        timings = (response.model_extra or {}).get('timings', {})
+        totals['requests'] += 1
+        totals['prompt_tokens_evaluated'] += timings.get('prompt_n', 0)
+        totals['prompt_tokens_cached'] += timings.get('cache_n', 0)
+        totals['prompt_ms'] += timings.get('prompt_ms', 0.0)
+
+        conversation_history.append({"role": "user", "content": query, "response": response.choices[0].text})
+        ragImplementation.trim_conversation_history(conversation_history)
+
+    return totals
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=len(SAMPLE_CONVERSATION))
+    parser.add_argument('--prompt-ms-per-token', type=float, default=0.5,
+                        help="simulated prompt evaluation cost of the stand-in server")
+    parser.add_argument('--slots', type=int, default=1)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    options = parser.parse_args(args)
+
+    server = StandInLLMServer(num_slots=options.slots, prompt_ms_per_token=options.prompt_ms_per_token)
+    base_url = server.start()
+    ragImplementation.client_manager.configure({'llmBaseUrl': base_url})
+
+    layouts = {
+        'query_first': build_query_first_prompt,
+        'prefix_first': ragImplementation.build_rag_prompt,
+    }
+    results = {}
+    try:
+        for name, build_prompt in layouts.items():
+            server.reset()
+            results[name] = run_conversation(build_prompt, options.turns)
+    finally:
+        server.stop()
+
+    for name, totals in results.items():
+        print(f"{name:>13}: {totals['prompt_tokens_evaluated']} prompt tokens evaluated, "
+              f"{totals['prompt_tokens_cached']} reused, {totals['prompt_ms']:.1f} ms prompt eval, "
+              f"{totals['wall_ms']:.1f} ms total over {totals['requests']} requests")
+
+    before, after = results['query_first'], results['prefix_first']
+    if before['prompt_ms'] > 0:
+        print(f"Prompt evaluation time reduced by {100 * (1 - after['prompt_ms'] / before['prompt_ms']):.1f}%")
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,129 @@
 #!/home/roboticslab/miniconda3/envs/llama-3.1/bin python3
 
+import os
 import sys
+import threading
+import time
 from pathlib import Path
 
+_import_start_time = time.perf_counter()
+
 parent_dir = Path(__file__).parent.parent.parent.parent.parent.parent.parent
 parent_dir = parent_dir / "src/language_model"
 sys.path.append(str(parent_dir / "language_model"))  # Ensure parent directory is in sys.path
 
-from llm_interfaces.srv import Prompt, CreateCollection
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from collectionPool import DEFAULT_COLLECTION_POOL_SIZE, CollectionPool
+from collectionSnapshot import get_snapshot_path
+from llm_interfaces.srv import Prompt, CreateCollection, RestoreCollection, SnapshotCollection
+from llm_interfaces.action import PromptStream
 from ragImplementation import *
+from rclpy.action import ActionServer
+from rclpy.callback_groups import MutuallyExclusiveCallbackGroup, ReentrantCallbackGroup
+from rclpy.executors import MultiThreadedExecutor
 from rclpy.node import Node
+from rclpy.qos import DurabilityPolicy, QoSProfile
+from std_msgs.msg import Bool
+from std_srvs.srv import Trigger
 import rclpy
 
+# Time spent importing the node's dependencies, reported in the startup breakdown
+IMPORT_DURATION = time.perf_counter() - _import_start_time
+
 class RAGNode(Node):
     def __init__(self):
+        init_start_time = time.perf_counter()
         super().__init__('rag_node')
-        self.srv = self.create_service(Prompt, 'rag_prompt', self.rag_prompt_callback)
-        self.create_collection_srv = self.create_service(CreateCollection, 'create_collection', self.create_collection_callback)
+
+        # Prompts run in parallel with each other, collection builds run one at a
+        # time in their own group so they never hold up prompts
+        self.prompt_callback_group = ReentrantCallbackGroup()
+        self.collection_callback_group = MutuallyExclusiveCallbackGroup()
+
+        # Guards self.conversation_histories, which is shared by the executor threads
+        self.state_lock = threading.Lock()
+
+        self.srv = self.create_service(Prompt, 'rag_prompt', self.rag_prompt_callback,
+                                       callback_group=self.prompt_callback_group)
+        self.create_collection_srv = self.create_service(CreateCollection, 'create_collection', self.create_collection_callback,
+                                                         callback_group=self.collection_callback_group)
+        # Snapshots let a collection be moved or recovered without re-embedding it
+        self.snapshot_collection_srv = self.create_service(SnapshotCollection, 'snapshot_collection',
+                                                           self.snapshot_collection_callback,
+                                                           callback_group=self.collection_callback_group)
+        self.restore_collection_srv = self.create_service(RestoreCollection, 'restore_collection',
+                                                          self.restore_collection_callback,
+                                                          callback_group=self.collection_callback_group)
+        # Streams the answer sentence by sentence as feedback so the robot can start speaking early
+        self.prompt_stream_server = ActionServer(self, PromptStream, 'rag_prompt_stream', self.rag_prompt_stream_callback,
+                                                 callback_group=self.prompt_callback_group)
+
+        # Readiness is latched so nodes that subscribe later still get the current state
+        self.ready = False
+        self.ready_publisher = self.create_publisher(Bool, 'rag_ready', QoSProfile(depth=1, durability=DurabilityPolicy.TRANSIENT_LOCAL))
+        self.status_srv = self.create_service(Trigger, 'rag_status', self.rag_status_callback)
+        self.publish_readiness()
 
         self.get_logger().info("RAG Node is up and running.")
 
         # print(f"Parent directory before reading config: {Path(__file__).parent.parent.parent.parent.parent.parent.parent}")
 
+        self.startup_timings = {'imports': IMPORT_DURATION}
+        self.init_start_time = init_start_time
+        step_start = time.perf_counter()
+
         self.config = read_config(Path(__file__).parent.parent.parent.parent.parent.parent.parent / 'src' / 'language_model' / 'config' / 'ragSystem.ini')
+        configure_rag_system(self.config)
+
+        self.startup_timings['config'] = time.perf_counter() - step_start
+
+        # Prompts name the collection they are answered from, the most recently
+        # used ones stay open with their indexes loaded
+        self.default_collection_name = self.config.get('defaultCollection', DEFAULT_COLLECTION_NAME)
+        self.collection_pool = CollectionPool(open_collection,
+                                              int(self.config.get('collectionPoolSize', DEFAULT_COLLECTION_POOL_SIZE)),
+                                              release_collection)
 
-        # Get collection for RAG system
-        self.collection = get_similarity_search_collection("interactive_upanzi_search")
+        # One conversation per collection, so turns about one collection never reach
+        # answers grounded in another
+        self.conversation_histories = {}
 
-        if self.collection is None:
+        # Stage latencies go to /diagnostics and, for Prometheus, a node_exporter textfile
+        self.diagnostics_publisher = self.create_publisher(DiagnosticArray, '/diagnostics', 10)
+        self.metrics_textfile = self.config.get('metricsTextfile', DEFAULT_METRICS_TEXTFILE)
+        metrics_period = float(self.config.get('metricsPublishPeriod', 5.0))
+        if pipeline_metrics.enabled and metrics_period > 0:
+            self.metrics_timer = self.create_timer(metrics_period, self.publish_metrics)
+
+        # The default collection is opened and the pipeline warmed up once the executor
+        # spins, so rag_status and rag_ready report "starting" meanwhile. It runs in the
+        # collection group, collection builds wait for it
+        self.start_up_timer = self.create_timer(0.0, self.start_up, callback_group=self.collection_callback_group)
+
+    def start_up(self):
+        """One-shot timer callback: open the default collection, warm up and report readiness"""
+        self.start_up_timer.cancel()
+        step_start = time.perf_counter()
+
+        collection = self.collection_pool.get(self.default_collection_name)
+
+        self.startup_timings['collection'] = time.perf_counter() - step_start
+
+        if collection is None:
             self.get_logger().error("Call the create_collection service to create a collection before using the RAG system.")
 
-        self.conversation_history = []
+        if self.config.get('warmUpOnStart', 'true').lower() == 'true':
+            verbose_mode = self.config.get('verboseMode', 'false').lower() == 'true'
+            self.startup_timings.update(warm_up_rag_system(collection, verbose_mode))
+
+        self.startup_timings['total'] = IMPORT_DURATION + time.perf_counter() - self.init_start_time
+        self.get_logger().info("Startup time: " + ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self.startup_timings.items()))
+
+        # Warm-up queries would skew the latency percentiles of real requests
+        pipeline_metrics.reset()
+
+        self.ready = True
+        self.publish_readiness()
 
     def rag_prompt_callback(self, request, response):
         # Implement your callback logic here
@@ -39,50 +132,237 @@ class RAGNode(Node):
         if verbose_mode:
             self.get_logger().info(f"Received prompt: {request.prompt}")
 
-        ai_response = handle_rag_query(self.collection, request.prompt, self.conversation_history, verbose_mode, int(self.config.get('topK', 3)))
+        collection, conversation_history = self.get_prompt_state(request.collection)
+        if collection is None:
+            response.response = self.missing_collection_message(request.collection)
+            self.get_logger().error(response.response)
+            return response
 
-        self.conversation_history.append({"role": "user", "content": request.prompt, "response": ai_response})
+        metrics = {}
+        try:
+            ai_response = handle_rag_query(collection, request.prompt, conversation_history, verbose_mode, int(self.config.get('topK', 3)),
+                                           metrics=metrics)
+        except Exception as e:
+            # One failing request must not take down the executor serving the others
+            self.get_logger().error(f"Failed to answer prompt '{request.prompt}': {e}")
+            response.response = FALLBACK_RESPONSE
+            return response
 
-        # Keep conversation history manageable
-        if len(self.conversation_history) > 5:
-            self.conversation_history = self.conversation_history[-3:]
+        self.record_conversation_turn(collection.name, request.prompt, ai_response)
 
         if verbose_mode:
+            self.log_context_stats(metrics)
             self.get_logger().info(f"AI response: {ai_response}")
 
         response.response = ai_response
         return response
 
-    def create_collection_callback(self, request, response):
+    def rag_prompt_stream_callback(self, goal_handle):
         verbose_mode = self.config.get('verboseMode', 'false').lower() == 'true'
+        prompt = goal_handle.request.prompt
+
+        if verbose_mode:
+            self.get_logger().info(f"Received streaming prompt: {prompt}")
+
+        feedback = PromptStream.Feedback()
+
+        def publish_sentence(sentence):
+            feedback.sentence = sentence
+            goal_handle.publish_feedback(feedback)
+            feedback.sequence += 1
+
+        collection, conversation_history = self.get_prompt_state(goal_handle.request.collection)
+        if collection is None:
+            result = PromptStream.Result()
+            result.response = self.missing_collection_message(goal_handle.request.collection)
+            result.time_to_first_token = -1.0
+            self.get_logger().error(result.response)
+            goal_handle.abort()
+            return result
+
+        metrics = {}
+        try:
+            ai_response = handle_rag_query(collection, prompt, conversation_history, verbose_mode, int(self.config.get('topK', 3)),
+                                           on_sentence=publish_sentence, metrics=metrics)
+        except Exception as e:
+            result = PromptStream.Result()
+            result.response = FALLBACK_RESPONSE
+            result.time_to_first_token = -1.0
+            self.get_logger().error(f"Failed to answer streaming prompt '{prompt}': {e}")
+            goal_handle.abort()
+            return result
+
+        self.record_conversation_turn(collection.name, prompt, ai_response)
 
         if verbose_mode:
-            self.get_logger().info(f"Creating collection: {request.name}")
+            self.log_context_stats(metrics)
+            self.get_logger().info(f"AI response: {ai_response}")
+        if 'time_to_first_token' in metrics:
+            self.get_logger().info(f"Time to first token: {metrics['time_to_first_token']:.3f}s, "
+                                   f"first sentence: {metrics['time_to_first_sentence']:.3f}s, "
+                                   f"total: {metrics['total_time']:.3f}s")
+
+        goal_handle.succeed()
+
+        result = PromptStream.Result()
+        result.response = ai_response
+        result.time_to_first_token = float(metrics.get('time_to_first_token', -1.0))
+        return result
+
+    def log_context_stats(self, metrics):
+        """Log how much of the prompt token budget the retrieved documents took"""
+        if 'context_tokens_used' in metrics:
+            self.get_logger().info(f"Context: {metrics['context_tokens_used']} prompt tokens used, "
+                                   f"{metrics['context_tokens_saved']} saved ({metrics['context_documents']} of "
+                                   f"{metrics['context_candidates']} documents)")
+
+    def publish_readiness(self):
+        message = Bool()
+        message.data = self.ready
+        self.ready_publisher.publish(message)
+
+    def rag_status_callback(self, request, response):
+        response.success = self.ready
+        timings = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in self.startup_timings.items())
+        collections = ", ".join(self.collection_pool.names())
+        response.message = f"{'ready' if self.ready else 'starting'}; startup: {timings}; open collections: {collections}"
+        return response
+
+    def publish_metrics(self):
+        snapshot = pipeline_metrics.snapshot()
 
-        collection = create_collection_and_load_data(request.name, request.description, self.config.get('dataFilePath', ''), verbose_mode)
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = f"{self.get_name()}: RAG pipeline"
+        status.hardware_id = self.get_name()
+        status.message = 'ready' if self.ready else 'starting'
+        for stage, summary in sorted(snapshot['stages'].items()):
+            status.values.append(KeyValue(key=f"{stage}.count", value=str(summary['count'])))
+            for statistic in ('mean', 'p50', 'p90', 'p99'):
+                status.values.append(KeyValue(key=f"{stage}.{statistic}_ms", value=f"{summary[statistic] * 1000:.2f}"))
+        for name, value in sorted(snapshot['counters'].items()):
+            status.values.append(KeyValue(key=name, value=str(value)))
+
+        message = DiagnosticArray()
+        message.header.stamp = self.get_clock().now().to_msg()
+        message.status.append(status)
+        self.diagnostics_publisher.publish(message)
+
+        if self.metrics_textfile:
+            try:
+                pipeline_metrics.write_prometheus_textfile(self.metrics_textfile)
+            except Exception as e:
+                self.get_logger().warning(f"Could not write metrics to {self.metrics_textfile}: {e}")
+
+    def get_prompt_state(self, collection_name=''):
+        """Return the named (or default) collection, None if it does not exist, and a snapshot of its conversation history"""
+        collection_name = collection_name or self.default_collection_name
+        collection = self.collection_pool.get(collection_name)
+        with self.state_lock:
+            return collection, list(self.conversation_histories.get(collection_name, []))
+
+    def missing_collection_message(self, collection_name):
+        return (f"Collection '{collection_name or self.default_collection_name}' does not exist. "
+                "Call the create_collection service to create it.")
+
+    def record_conversation_turn(self, collection_name, prompt, ai_response):
+        with self.state_lock:
+            conversation_history = self.conversation_histories.setdefault(collection_name, [])
+            conversation_history.append({"role": "user", "content": prompt, "response": ai_response})
+
+            trim_conversation_history(conversation_history)
+
+    def create_collection_callback(self, request, response):
+        verbose_mode = self.config.get('verboseMode', 'false').lower() == 'true'
+
+        batch_size = int(self.config.get('ingestBatchSize', DEFAULT_INGEST_BATCH_SIZE))
+        num_workers = int(self.config.get('embeddingWorkers', 0))
+        manifest_dir = self.config.get('manifestDir', DEFAULT_MANIFEST_DIR)
+
+        if request.incremental:
+            if verbose_mode:
+                self.get_logger().info(f"Syncing collection: {request.name}")
+
+            collection, stats = sync_collection_with_data(request.name, request.description, self.config.get('dataFilePath', ''),
+                                                          manifest_dir, verbose_mode, batch_size, num_workers)
+        else:
+            if verbose_mode:
+                self.get_logger().info(f"Creating collection: {request.name}")
+
+            collection = create_collection_and_load_data(request.name, request.description, self.config.get('dataFilePath', ''), verbose_mode,
+                                                         batch_size, num_workers, manifest_dir)
 
         if collection:
             response.success = 1
-            response.message = f"Collection '{request.name}' created successfully."
+            if request.incremental:
+                response.message = (f"Collection '{request.name}' synced successfully: {stats['upserted']} updated, "
+                                    f"{stats['deleted']} deleted, {stats['unchanged']} unchanged.")
+            else:
+                response.message = f"Collection '{request.name}' created successfully."
 
-            self.collection = collection  # Update the node's collection
+            # Prompts to the collection are answered from the new build right away
+            self.collection_pool.put(request.name, collection)
 
             if verbose_mode:
                 self.get_logger().info(response.message)
         else:
             response.success = 0
-            response.message = f"Failed to create collection '{request.name}'. Debug logs for details."
+            response.message = f"Failed to {'sync' if request.incremental else 'create'} collection '{request.name}'. Debug logs for details."
             if verbose_mode:
                 self.get_logger().info(response.message)
 
         return response
 
+    def snapshot_collection_callback(self, request, response):
+        snapshot_path = request.path or get_snapshot_path(self.config.get('snapshotDir', DEFAULT_SNAPSHOT_DIR), request.name)
+
+        collection = get_similarity_search_collection(request.name)
+        count = export_collection_snapshot(collection, snapshot_path) if collection is not None else None
+
+        if count is None:
+            response.success = 0
+            response.message = f"Failed to write a snapshot of collection '{request.name}'. Debug logs for details."
+        else:
+            response.success = 1
+            response.message = f"Wrote {count} items of collection '{request.name}' to {snapshot_path}."
+        self.get_logger().info(response.message)
+        return response
+
+    def restore_collection_callback(self, request, response):
+        verbose_mode = self.config.get('verboseMode', 'false').lower() == 'true'
+        snapshot_path = request.path or get_snapshot_path(self.config.get('snapshotDir', DEFAULT_SNAPSHOT_DIR), request.name)
+
+        start_time = time.perf_counter()
+        collection = restore_collection_snapshot(request.name, snapshot_path, verbose_mode,
+                                                 self.config.get('manifestDir', DEFAULT_MANIFEST_DIR))
+
+        if collection is None:
+            response.success = 0
+            response.message = f"Failed to restore collection '{request.name}' from {snapshot_path}. Debug logs for details."
+        else:
+            self.collection_pool.put(request.name, collection)
+            response.success = 1
+            response.message = (f"Restored collection '{request.name}' from {snapshot_path} "
+                                f"in {time.perf_counter() - start_time:.2f}s.")
+        self.get_logger().info(response.message)
+        return response
+
 
 def main(args=None):
     rclpy.init(args=args)
     rag_node = RAGNode()
-    rclpy.spin(rag_node)
-    rag_node.destroy_node()
+
+    # Several worker threads so prompts are served concurrently and alongside collection builds
+    num_threads = int(rag_node.config.get('executorThreads', 0)) or os.cpu_count() or 4
+    executor = MultiThreadedExecutor(num_threads=num_threads)
+    executor.add_node(rag_node)
+    rag_node.get_logger().info(f"Serving requests with {num_threads} executor threads.")
+
+    try:
+        executor.spin()
+    finally:
+        executor.shutdown()
+        rag_node.destroy_node()
     rclpy.shutdown()
 
 
@@ -0,0 +1,191 @@
+"""Offline benchmark of the RAG pipeline.
+
+Generates a synthetic corpus shaped like the data file and runs it through
+the pipeline with an in-memory vector store, a hashing embedder and a local
+stand-in LLM server, so no network or model download is needed. Measures
+ingestion throughput, similarity search latency and end-to-end
+handle_rag_query latency and writes them as JSON:
+
+    python3 ragBenchmark.py --output results.json [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.append(str(Path(__file__).parent))
+
+import numpy as np
+
+import ragImplementation
+from embeddingRegistry import register_embedding_model
+from llmStandInServer import StandInLLMServer
+from syntheticCorpus import generate_queries, write_corpus
+
+BENCHMARK_EMBEDDING_MODEL = 'benchmark-hashing-embedder'
+BENCHMARK_COLLECTION = 'benchmark_collection'
+RESULTS_FORMAT_VERSION = 1
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/mean/max of latencies given in seconds, reported in milliseconds"""
+    milliseconds = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        'count': len(latencies),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p90_ms': float(np.percentile(milliseconds, 90)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'mean_ms': float(milliseconds.mean()),
+        'max_ms': float(milliseconds.max()),
+    }
+
+
+def time_calls(func: Callable[[str], object], queries: List[str], warm_up: int = 5) -> List[float]:
+    """Call func for every query and return the latency of each call, after a few untimed calls"""
+    for query in queries[:warm_up]:
+        func(query)
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def benchmark_ingestion(data_file_path: str, batch_size: int, num_workers: int):
+    """Time load_json_data + populate_similarity_collection on a fresh collection"""
+    start = time.perf_counter()
+    data_items = ragImplementation.load_json_data(data_file_path)
+    load_seconds = time.perf_counter() - start
+
+    collection = ragImplementation.create_similarity_search_collection(BENCHMARK_COLLECTION,
+                                                                      {'description': 'benchmark'})
+    start = time.perf_counter()
+    added = ragImplementation.populate_similarity_collection(collection, data_items, batch_size, num_workers)
+    populate_seconds = time.perf_counter() - start
+
+    total_seconds = load_seconds + populate_seconds
+    return collection, {
+        'items': len(data_items),
+        'documents': added,
+        'load_seconds': load_seconds,
+        'populate_seconds': populate_seconds,
+        'documents_per_second': added / total_seconds if total_seconds > 0 else 0.0,
+    }
+
+
+def get_stand_in_config(work_dir: str, llm_base_url: str, hybrid: bool = False, mmr: bool = False) -> Dict[str, str]:
+    """Pipeline config using the in-memory vector store, the hashing embedder and a stand-in LLM server"""
+    register_embedding_model(BENCHMARK_EMBEDDING_MODEL, 'hashingEmbedder:HashingEmbedder')
+    return {
+        'vectorStore': 'numpy',
+        # An empty directory keeps the numpy vector store in memory
+        'vectorStoreDir': '',
+        'embeddingModel': BENCHMARK_EMBEDDING_MODEL,
+        'embeddingCacheSize': '0',
+        'responseCacheEnabled': 'false',
+        'hybridSearch': str(hybrid).lower(),
+        'bm25IndexDir': os.path.join(work_dir, 'bm25'),
+        'mmrEnabled': str(mmr).lower(),
+        'llmBaseUrl': llm_base_url,
+    }
+
+
+def run_benchmark(options) -> Dict:
+    server = StandInLLMServer(prompt_ms_per_token=options.prompt_ms_per_token, latency_ms=options.llm_latency_ms)
+    base_url = server.start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_file_path = os.path.join(work_dir, 'corpus.json')
+        write_corpus(data_file_path, num_documents=options.documents, depth=options.depth, fanout=options.fanout,
+                     seed=options.seed)
+
+        ragImplementation.configure_rag_system(get_stand_in_config(work_dir, base_url, options.hybrid, options.mmr))
+
+        queries = generate_queries(options.queries, seed=options.seed + 1)
+        results = {}
+        try:
+            collection, results['ingestion'] = benchmark_ingestion(data_file_path, options.batch_size, options.workers)
+            results['similarity_search'] = summarize_latencies(time_calls(
+                lambda query: ragImplementation.perform_similarity_search(collection, query, options.top_k),
+                queries
+            ))
+            results['rag_search'] = summarize_latencies(time_calls(
+                lambda query: ragImplementation.perform_rag_search(collection, query, options.top_k),
+                queries
+            ))
+            # Break the end-to-end latency down into the pipeline's stages
+            ragImplementation.pipeline_metrics.reset()
+            results['handle_rag_query'] = summarize_latencies(time_calls(
+                lambda query: ragImplementation.handle_rag_query(collection, query, [], False, options.top_k),
+                queries[:options.rag_queries]
+            ))
+        finally:
+            server.stop()
+
+    return {
+        'version': RESULTS_FORMAT_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'options': vars(options),
+        'results': results,
+        'stages': ragImplementation.pipeline_metrics.snapshot(),
+    }
+
+
+def compare_results(previous: Dict, current: Dict):
+    """Print how every metric changed relative to a previous run"""
+    for stage, metrics in current['results'].items():
+        for metric, value in metrics.items():
+            old_value = previous.get('results', {}).get(stage, {}).get(metric)
+            if not isinstance(value, (int, float)) or not old_value:
+                continue
+            print(f"{stage}.{metric}: {old_value:.3f} -> {value:.3f} ({100 * (value / old_value - 1):+.1f}%)")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=500, help="top level documents in the synthetic corpus")
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--rag-queries', type=int, default=50, help="queries sent through handle_rag_query")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=ragImplementation.DEFAULT_INGEST_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=1, help="embedding processes, 0 for one per CPU core")
+    parser.add_argument('--hybrid', action='store_true', help="enable BM25 + vector hybrid search")
+    parser.add_argument('--mmr', action='store_true', help="enable MMR diversification")
+    parser.add_argument('--llm-latency-ms', type=float, default=20.0, help="fixed latency of the stand-in LLM")
+    parser.add_argument('--prompt-ms-per-token', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare with")
+    options = parser.parse_args(args)
+
+    report = run_benchmark(options)
+    print(json.dumps(report['results'], indent=2))
+
+    if options.compare:
+        with open(options.compare) as file:
+            compare_results(json.load(file), report)
+
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,330 @@
-import chromadb
-from chromadb.utils import embedding_functions
 import json
 import re
 import numpy as np
-from typing import List, Dict, Any, Optional
-import openai
+from typing import List, Dict, Any, Optional, Iterable, Callable, Tuple
 from pathlib import Path
+from corpusLoader import iter_json_data, batched
+from ingestionPipeline import ingest_batches
+from collectionSnapshot import read_snapshot, write_snapshot
+from indexManifest import content_hash, delete_manifest, get_manifest_path, load_manifest, save_manifest, track_hashes
+from embeddingCache import EmbeddingCache
+from responseCache import ResponseCache
+from clientManager import ClientManager
+from metrics import MetricsRegistry
+from requestCoalescer import DEFAULT_COALESCE_WINDOW, DEFAULT_MAX_BATCH_SIZE, RequestCoalescer
+from sectionHierarchy import SectionHierarchy, get_hierarchy_metadata
+from chunker import DEFAULT_CHUNK_OVERLAP, DEFAULT_CHUNK_TOKENS, chunk_section, stitch_chunks
+from contextPacker import DEFAULT_CONTEXT_MAX_DOCUMENTS, DEFAULT_CONTEXT_TOKEN_BUDGET, TokenCounter, pack_context
+from mmrSelection import DEFAULT_MMR_CANDIDATES, DEFAULT_MMR_LAMBDA, maximal_marginal_relevance
+from bm25Index import (DEFAULT_BM25_B, DEFAULT_BM25_K1, DEFAULT_RRF_K, BM25Index, BM25IndexBuilder,
+                       get_bm25_index_path, reciprocal_rank_fusion)
+from embeddingRegistry import (DEFAULT_ONNX_INT8_FILE, configure_embedding_backend, embed, get_embedding_model,
+                               get_model_tag)
+import threading
+import time
 
 parent_dir = Path(__file__).parent.parent.parent.parent.parent.parent.parent
 parent_dir = parent_dir / "src/language_model"
 
+# Streamed text is cut into sentences at these boundaries before it is published
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+MIN_STREAM_SENTENCE_CHARS = 12
+NON_SENTENCE_ENDINGS = {'e.g.', 'i.e.', 'etc.', 'vs.', 'dr.', 'mr.', 'mrs.', 'ms.', 'prof.', 'st.', 'no.'}
 
-client = openai.OpenAI(
-    base_url="http://localhost:8080/v1",
-    api_key = "sk-no-key-required"
-)
+# Query used to exercise the pipeline during warm-up
+WARM_UP_QUERY = "What is Upanzi?"
 
-# Initialize ChromaDB client
-chroma_client = chromadb.HttpClient(host='localhost', port=8000)
+# Collection prompts are answered from when they do not name one
+DEFAULT_COLLECTION_NAME = "interactive_upanzi_search"
+
+# Canned answers when the LLM gives no usable response or nothing matches the query
+FALLBACK_RESPONSE = "I don't understand what you mean. Try rephrasing your question!"
+NO_MATCH_RESPONSE = "I couldn't find any documents matching your request. Try rephrasing your question!"
+
+# Sentence transformer model used to embed documents and queries
+DEFAULT_EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_MODEL_NAME = DEFAULT_EMBEDDING_MODEL_NAME
+
+# Directory of the embedded vector store (vectorStore numpy)
+DEFAULT_VECTOR_STORE_DIR = str(parent_dir / "vector_store")
+
+# LLM client and vector store, created on first use with the timeouts, retries
+# and circuit breakers configured in ragSystem.ini
+client_manager = ClientManager({
+    'vectorStoreDir': DEFAULT_VECTOR_STORE_DIR,
+    'embeddingModel': EMBEDDING_MODEL_NAME,
+})
+
+# Suffix of the temporary collection a full rebuild is written to before it replaces the live one
+STAGING_COLLECTION_SUFFIX = "_staging"
+
+# Directory holding the doc_id -> content hash manifests of the collections
+DEFAULT_MANIFEST_DIR = str(parent_dir / "manifests")
+
+# Directory of the collection snapshots written by snapshot_collection
+DEFAULT_SNAPSHOT_DIR = str(parent_dir / "snapshots")
+
+# Number of items embedded and written to the collection per add call
+DEFAULT_INGEST_BATCH_SIZE = 256
+
+# HNSW index parameters of new Chroma collections (Chroma's defaults). M and
+# ef_construction are fixed when a collection is built, ef_search is also
+# applied to existing collections when they are opened. See hnswTuner.py
+DEFAULT_HNSW_EF_SEARCH = 100
+DEFAULT_HNSW_EF_CONSTRUCTION = 100
+DEFAULT_HNSW_M = 16
+hnsw_settings = {'ef_search': DEFAULT_HNSW_EF_SEARCH, 'ef_construction': DEFAULT_HNSW_EF_CONSTRUCTION,
+                 'max_neighbors': DEFAULT_HNSW_M}
+
+# Persistent embedding cache shared by ingestion and queries (None when disabled)
+DEFAULT_EMBEDDING_CACHE_DIR = str(parent_dir / "embedding_cache")
+DEFAULT_EMBEDDING_CACHE_SIZE = 50000
+embedding_cache = None
+
+# Cache of generated answers for repeated and near-duplicate questions (None when disabled)
+DEFAULT_RESPONSE_CACHE_THRESHOLD = 0.95
+DEFAULT_RESPONSE_CACHE_SIZE = 256
+DEFAULT_RESPONSE_CACHE_TTL = 3600
+response_cache = None
+
+# Keyword (BM25) search fused with vector search, settings dict or None when disabled
+DEFAULT_BM25_INDEX_DIR = str(parent_dir / "bm25_indexes")
+DEFAULT_HYBRID_CANDIDATES = 20
+hybrid_search = None
+bm25_indexes = {}
+bm25_indexes_lock = threading.Lock()
+
+# Section tree of each collection for subtree-scoped search, built on first use
+section_hierarchies = {}
+section_hierarchies_lock = threading.Lock()
+
+# Maximal marginal relevance re-ranking of a larger candidate pool, settings dict or None when disabled
+mmr_search = None
+
+# Stage latencies and event counters of queries and collection builds
+DEFAULT_METRICS_TEXTFILE = str(parent_dir / "metrics" / "rag_node.prom")
+pipeline_metrics = MetricsRegistry()
+
+# Retrieves queries arriving together as one batch, None retrieves each on its own
+request_coalescer = None
+
+# Long sections are split into overlapping windows of at most max_tokens
+# tokens before embedding (0 embeds whole sections), expand_parents hands the
+# LLM the whole section of a retrieved chunk instead of the chunk alone
+chunking = {'max_tokens': DEFAULT_CHUNK_TOKENS, 'overlap': DEFAULT_CHUNK_OVERLAP, 'expand_parents': False}
+
+# Instructions at the start of every prompt, kept identical between requests so
+# the LLM server can reuse their evaluation
+RAG_SYSTEM_PROMPT = '''You are a helpful upanzi lab assistant. A user is asking questions about the Upanzi, and relevant options are retrieved from a document database for each question.
+
+Please provide a helpful, short response that:
+1. Acknowledges the user's request
+2. Answers the question or comment from the retrieved options
+3. Explains why these answers match their request
+4. Includes relevant details
+5. Uses a friendly, conversational tone
+6. Keeps the response concise but informative
+'''
+
+# Number of previous conversation turns the prompt keeps at least. The history
+# grows to twice as many before it is cut back, see trim_conversation_history
+DEFAULT_HISTORY_TURNS = 5
+prompt_settings = {'history_turns': DEFAULT_HISTORY_TURNS}
+
+# Tokens the retrieved documents may take up in the prompt (0 for no limit) and how they are counted
+context_packing = {'token_budget': DEFAULT_CONTEXT_TOKEN_BUDGET, 'max_documents': DEFAULT_CONTEXT_MAX_DOCUMENTS}
+token_counter = TokenCounter()
+
+def configure_embedding_cache(cache_dir: str = DEFAULT_EMBEDDING_CACHE_DIR,
+                              capacity: int = DEFAULT_EMBEDDING_CACHE_SIZE):
+    """Open the persistent embedding cache, a capacity of 0 disables it"""
+    global embedding_cache
+
+    if capacity <= 0:
+        embedding_cache = None
+        return
 
-def load_json_data(file_path: str) -> List[Dict]:
-    """Load data from JSON file"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            json_data = json.load(file)
+        embedding_cache = EmbeddingCache(cache_dir, get_model_tag(EMBEDDING_MODEL_NAME), capacity)
+    except Exception as e:
+        print(f"Error opening embedding cache, continuing without it: {e}")
+        embedding_cache = None
 
-        subsections = []
+def configure_response_cache(enabled: bool = True, threshold: float = DEFAULT_RESPONSE_CACHE_THRESHOLD,
+                             max_entries: int = DEFAULT_RESPONSE_CACHE_SIZE,
+                             ttl_seconds: float = DEFAULT_RESPONSE_CACHE_TTL):
+    """Set up the response cache used by handle_rag_query"""
+    global response_cache
 
-        # Ensure each item has required fields and normalize the structure
-        for i, item in enumerate(json_data):
-            # Normalize food_id to string
-            if 'doc_id' not in item:
-                item['doc_id'] = str(i + 1)
-            else:
-                item['doc_id'] = str(item['doc_id'])
-            
-            # Ensure required fields exist
-            if 'section' not in item:
-                item['section'] = ''
-            if 'subsections' not in item:
-                item['subsections'] = []
-            if 'content' not in item:
-                item['content'] = ''
-            
-            # Extract nested subsections if available
-            for idx, sub_section in enumerate(item.get('subsections', [])):
-                sub_section['doc_id'] = str(sub_section.get('doc_id', idx))
-                sub_section['doc_id'] = str(item['doc_id']+'_'+sub_section['doc_id'])
-                sub_section['section'] = sub_section.get('section', '')
-                sub_section['content'] = sub_section.get('content', '')
-                for sidx, sub_sub_section in enumerate(sub_section.get('subsections', [])):
-                    sub_sub_section['doc_id'] = str(sub_sub_section.get('doc_id', sidx))
-                    sub_sub_section['doc_id'] = str(sub_section['doc_id']+'_'+sub_sub_section['doc_id'])
-                    sub_sub_section['section'] = sub_sub_section.get('section', '')
-                    sub_sub_section['content'] = sub_sub_section.get('content', '')
-                    subsections.append(sub_sub_section)
-                del sub_section['subsections']
-                subsections.append(sub_section)
-
-            del item['subsections']
-
-        result = json_data + subsections
+    if not enabled or max_entries <= 0:
+        response_cache = None
+        return
+
+    response_cache = ResponseCache(threshold, max_entries, ttl_seconds)
+
+def invalidate_response_cache(collection_name: str = None):
+    """Forget cached answers of a collection whose content changed"""
+    if response_cache is not None:
+        response_cache.invalidate(collection_name)
+
+def configure_hybrid_search(enabled: bool = False, index_dir: str = DEFAULT_BM25_INDEX_DIR,
+                            k1: float = DEFAULT_BM25_K1, b: float = DEFAULT_BM25_B, rrf_k: int = DEFAULT_RRF_K,
+                            candidates: int = DEFAULT_HYBRID_CANDIDATES):
+    """Set up BM25 + vector search with reciprocal rank fusion for handle_rag_query"""
+    global hybrid_search
+
+    with bm25_indexes_lock:
+        bm25_indexes.clear()
+
+    if not enabled:
+        hybrid_search = None
+        return
+
+    hybrid_search = {'index_dir': index_dir, 'k1': k1, 'b': b, 'rrf_k': rrf_k, 'candidates': candidates}
+
+def configure_mmr(enabled: bool = False, lambda_mult: float = DEFAULT_MMR_LAMBDA,
+                  candidates: int = DEFAULT_MMR_CANDIDATES):
+    """Set up maximal marginal relevance diversification of the documents handle_rag_query retrieves"""
+    global mmr_search
+
+    mmr_search = {'lambda': lambda_mult, 'candidates': candidates} if enabled else None
+
+def configure_context_packing(token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                              max_documents: int = DEFAULT_CONTEXT_MAX_DOCUMENTS, token_counting: str = 'approximate'):
+    """Set the prompt token budget of the retrieved documents.
+
+    token_counting 'server' counts with the tokenizer of the model served at
+    llmBaseUrl, 'approximate' estimates counts locally.
+    """
+    global token_counter
+
+    context_packing.update(token_budget=token_budget, max_documents=max_documents)
+
+    server_url = None
+    if token_counting == 'server':
+        # llama.cpp serves /tokenize next to the OpenAI compatible /v1 routes
+        server_url = re.sub(r'/v1/?$', '', client_manager.settings['llmBaseUrl'])
+    token_counter = TokenCounter(server_url, float(client_manager.settings['llmConnectTimeout']))
+
+def configure_hnsw(ef_search: int = DEFAULT_HNSW_EF_SEARCH, ef_construction: int = DEFAULT_HNSW_EF_CONSTRUCTION,
+                   m: int = DEFAULT_HNSW_M):
+    """Set the HNSW parameters used for new collections"""
+    hnsw_settings.update(ef_search=ef_search, ef_construction=ef_construction, max_neighbors=m)
+
+def configure_metrics(enabled: bool = True):
+    """Turn recording of stage latencies and counters on or off"""
+    pipeline_metrics.enabled = enabled
+
+def configure_request_coalescing(window: float = DEFAULT_COALESCE_WINDOW, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+    """Batch the embedding and search of concurrent queries, a window of 0 turns batching off"""
+    global request_coalescer
+    request_coalescer = RequestCoalescer(retrieve_coalesced_queries, window, max_batch_size) if window > 0 else None
+
+def configure_chunking(max_tokens: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_CHUNK_OVERLAP,
+                       expand_parents: bool = False):
+    """Set how sections are split into chunks at ingestion and whether search expands chunks to their section"""
+    chunking.update(max_tokens=max_tokens, overlap=overlap, expand_parents=expand_parents)
+
+def configure_prompt(history_turns: int = DEFAULT_HISTORY_TURNS):
+    """Set how many previous conversation turns the prompt keeps at least, 0 leaves the conversation out"""
+    prompt_settings['history_turns'] = history_turns
+
+def get_vector_store():
+    """Return the configured vector store, connecting on first use"""
+    return client_manager.get_vector_store()
+
+def configure_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL_NAME, backend: str = 'torch',
+                              num_threads: int = 0, onnx_file: str = DEFAULT_ONNX_INT8_FILE):
+    """Select the embedding model and how it runs, used for both ingestion and queries"""
+    global EMBEDDING_MODEL_NAME
+
+    EMBEDDING_MODEL_NAME = model_name
+    configure_embedding_backend(backend, num_threads, onnx_file)
+
+def configure_rag_system(config: dict):
+    """Apply settings from ragSystem.ini to the module level resources"""
+    configure_embedding_model(
+        config.get('embeddingModel', DEFAULT_EMBEDDING_MODEL_NAME),
+        config.get('embeddingBackend', 'torch'),
+        int(config.get('embeddingThreads', 0)),
+        config.get('embeddingOnnxFile', DEFAULT_ONNX_INT8_FILE)
+    )
+    client_manager.configure({**config, 'embeddingModel': EMBEDDING_MODEL_NAME})
+    configure_embedding_cache(
+        config.get('embeddingCacheDir', DEFAULT_EMBEDDING_CACHE_DIR),
+        int(config.get('embeddingCacheSize', DEFAULT_EMBEDDING_CACHE_SIZE))
+    )
+    configure_response_cache(
+        config.get('responseCacheEnabled', 'true').lower() == 'true',
+        float(config.get('responseCacheThreshold', DEFAULT_RESPONSE_CACHE_THRESHOLD)),
+        int(config.get('responseCacheSize', DEFAULT_RESPONSE_CACHE_SIZE)),
+        float(config.get('responseCacheTTL', DEFAULT_RESPONSE_CACHE_TTL))
+    )
+    configure_hybrid_search(
+        config.get('hybridSearch', 'false').lower() == 'true',
+        config.get('bm25IndexDir', DEFAULT_BM25_INDEX_DIR),
+        float(config.get('bm25K1', DEFAULT_BM25_K1)),
+        float(config.get('bm25B', DEFAULT_BM25_B)),
+        int(config.get('rrfK', DEFAULT_RRF_K)),
+        int(config.get('hybridCandidates', DEFAULT_HYBRID_CANDIDATES))
+    )
+    configure_mmr(
+        config.get('mmrEnabled', 'false').lower() == 'true',
+        float(config.get('mmrLambda', DEFAULT_MMR_LAMBDA)),
+        int(config.get('mmrCandidatePool', DEFAULT_MMR_CANDIDATES))
+    )
+    configure_hnsw(
+        int(config.get('hnswEfSearch', DEFAULT_HNSW_EF_SEARCH)),
+        int(config.get('hnswEfConstruction', DEFAULT_HNSW_EF_CONSTRUCTION)),
+        int(config.get('hnswM', DEFAULT_HNSW_M))
+    )
+    configure_metrics(config.get('metricsEnabled', 'true').lower() == 'true')
+    configure_request_coalescing(
+        float(config.get('coalesceWindowMs', DEFAULT_COALESCE_WINDOW * 1000)) / 1000,
+        int(config.get('coalesceMaxBatch', DEFAULT_MAX_BATCH_SIZE))
+    )
+    configure_chunking(
+        int(config.get('chunkTokens', DEFAULT_CHUNK_TOKENS)),
+        int(config.get('chunkOverlap', DEFAULT_CHUNK_OVERLAP)),
+        config.get('chunkParentExpansion', 'false').lower() == 'true'
+    )
+    configure_prompt(int(config.get('historyTurns', DEFAULT_HISTORY_TURNS)))
+    configure_context_packing(
+        int(config.get('contextTokenBudget', DEFAULT_CONTEXT_TOKEN_BUDGET)),
+        int(config.get('contextMaxDocuments', DEFAULT_CONTEXT_MAX_DOCUMENTS)),
+        config.get('tokenCounting', 'approximate').lower()
+    )
+
+def get_query_embedding_model():
+    """Return the shared sentence transformer used to embed queries in this process"""
+    return get_embedding_model(EMBEDDING_MODEL_NAME)
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embed texts with the collection's model, going through the embedding cache"""
+    cached = embedding_cache.lookup(texts) if embedding_cache is not None else [None] * len(texts)
+    missing = [i for i, embedding in enumerate(cached) if embedding is None]
+
+    if embedding_cache is not None:
+        pipeline_metrics.increment('embedding_cache_hits', len(texts) - len(missing))
+        pipeline_metrics.increment('embedding_cache_misses', len(missing))
+
+    if missing:
+        with pipeline_metrics.span('embedding'):
+            computed = embed([texts[i] for i in missing], EMBEDDING_MODEL_NAME)
+        for i, embedding in zip(missing, computed):
+            cached[i] = embedding
+        if embedding_cache is not None:
+            embedding_cache.store([texts[i] for i in missing], computed)
+
+    return [embedding.tolist() for embedding in cached]
+
+def load_json_data(file_path: str) -> List[Dict]:
+    """Load all data items from a JSON or JSONL file into a list.
+
+    Prefer iter_json_data for large files, this keeps the whole corpus in memory.
+    """
+    try:
+        result = list(iter_json_data(file_path))
 
         print(f"Successfully loaded {len(result)} items from {file_path}")
         return result
@@ -69,54 +333,77 @@ def load_json_data(file_path: str) -> List[Dict]:
         print(f"Error loading json data: {e}")
         return []
 
+def get_collection_configuration(hnsw: dict = None) -> dict:
+    """Configuration used when creating similarity search collections, hnsw overrides the configured parameters"""
+    return {
+        "hnsw": {"space": "cosine", **hnsw_settings, **(hnsw or {})}
+    }
+
+def apply_search_settings(collection):
+    """Bring the stored ef_search of an existing Chroma collection in line with the configured one.
+
+    Chroma applies it when it next loads the index, e.g. after a server restart.
+    """
+    configuration = getattr(collection, 'configuration', None)
+    if not isinstance(configuration, dict) or not configuration.get('hnsw'):
+        return
+    if configuration['hnsw'].get('ef_search') != hnsw_settings['ef_search']:
+        client_manager.call_vector_store(lambda: collection.modify(
+            configuration={'hnsw': {'ef_search': hnsw_settings['ef_search']}}
+        ))
+
 def create_similarity_search_collection(collection_name: str, collection_metadata: dict = None):
     """Create ChromaDB collection with sentence transformer embeddings"""
     try:
         # Try to delete existing collection to start fresh
-        chroma_client.delete_collection(collection_name)
+        get_vector_store().delete_collection(collection_name)
     except:
         pass
     
-    # Create embedding function
-    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="all-MiniLM-L6-v2"
-    )
-    
     # Create new collection
-    return chroma_client.create_collection(
+    return get_vector_store().create_collection(
         name=collection_name,
-        metadata=collection_metadata,
-        configuration={
-            "hnsw": {"space": "cosine"},
-            "embedding_function": sentence_transformer_ef
-        }
+        metadata=get_collection_metadata(collection_metadata),
+        configuration=get_collection_configuration()
     )
 
+def get_collection_metadata(collection_metadata: dict = None) -> dict:
+    """Collection metadata recording which embedding model its vectors come from"""
+    metadata = dict(collection_metadata or {})
+    metadata['embedding_model'] = get_model_tag(EMBEDDING_MODEL_NAME)
+    return metadata
+
 def get_similarity_search_collection(collection_name: str):
     """Retrieve ChromaDB collection"""
     try:
-        return chroma_client.get_collection(name=collection_name)
+        collection = client_manager.call_vector_store(lambda: get_vector_store().get_collection(collection_name))
+
+        indexed_with = (collection.metadata or {}).get('embedding_model')
+        if indexed_with and indexed_with != get_model_tag(EMBEDDING_MODEL_NAME):
+            print(f"Warning: collection {collection_name} was built with {indexed_with} but queries use "
+                  f"{get_model_tag(EMBEDDING_MODEL_NAME)}, rebuild it for correct results")
+
+        return collection
     except Exception as e:
         print(f"Error retrieving collection {collection_name}: {e}")
         return None
 
-def populate_similarity_collection(collection, data_items: List[Dict]):
-    """Populate collection with data and generate embeddings"""
-    documents = []
-    metadatas = []
-    ids = []
-    
+def format_document_text(section: str, content: str) -> str:
+    """Text stored and embedded for a section or a chunk of it"""
+    return f"{section}: {content}. "
+
+def iter_collection_documents(data_items: Iterable[Dict]):
+    """Turn data items into (id, document text, metadata) tuples ready for the collection.
+
+    With chunking enabled long sections are split into several chunks, see chunker.chunk_section.
+    """
     # Create unique IDs to avoid duplicates
     used_ids = set()
-    
+
     for i, data in enumerate(data_items):
         if data.get("content", '') == '':
             continue
-        
-        # Create comprehensive text for embedding using rich JSON structure
-        text = f"{data['section']}: "
-        text += f"{data.get('content', '')}. "
-        
+
         # Generate unique ID to avoid duplicates
         base_id = str(data.get('doc_id', i))
         unique_id = base_id
@@ -125,96 +412,611 @@ def populate_similarity_collection(collection, data_items: List[Dict]):
             unique_id = f"{base_id}_{counter}"
             counter += 1
         used_ids.add(unique_id)
-        
-        documents.append(text)
-        ids.append(unique_id)
-        metadatas.append({
-            "section": data["section"]
-        })
-    
-    # Add all data to collection
-    collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids
+
+        metadata = {"section": data["section"], **get_hierarchy_metadata(unique_id)}
+        if chunking['max_tokens'] <= 0:
+            # Create comprehensive text for embedding using rich JSON structure
+            yield unique_id, format_document_text(data['section'], data['content']), metadata
+            continue
+
+        for chunk_id, chunk_content, chunk_metadata in chunk_section(unique_id, data['content'], metadata,
+                                                                     chunking['max_tokens'], chunking['overlap']):
+            yield chunk_id, format_document_text(data['section'], chunk_content), chunk_metadata
+
+def get_ingest_batch_size(batch_size: int) -> int:
+    """Clamp the ingest batch size to the largest batch the vector store accepts"""
+    try:
+        return max(1, min(batch_size, get_vector_store().get_max_batch_size()))
+    except Exception:
+        return max(1, batch_size)
+
+def add_to_bm25_builder(documents: Iterable[tuple], bm25_builder: Optional[BM25IndexBuilder]):
+    """Pass (id, document, metadata) tuples through, adding each document to the BM25 builder on the way"""
+    for document in documents:
+        if bm25_builder is not None:
+            bm25_builder.add(document[0], document[1])
+        yield document
+
+def populate_similarity_collection(collection, data_items: Iterable[Dict], batch_size: int = DEFAULT_INGEST_BATCH_SIZE,
+                                   num_workers: int = 0, verbose_mode: bool = False, manifest: Dict[str, str] = None,
+                                   bm25_builder: BM25IndexBuilder = None) -> int:
+    """Populate collection with data and generate embeddings.
+
+    data_items may be any iterable (e.g. the iter_json_data generator), it is
+    consumed batch_size items at a time. Batches are embedded in parallel by
+    num_workers processes (0 uses every CPU core) while earlier batches are
+    written to the collection. If manifest is given it is filled with the
+    content hash of every added item, if bm25_builder is given every item is
+    added to it.
+    """
+    documents = add_to_bm25_builder(iter_collection_documents(data_items), bm25_builder)
+    if manifest is not None:
+        documents = (item[:3] for item in track_hashes(documents, manifest, get_model_tag(EMBEDDING_MODEL_NAME)))
+
+    batches = (
+        tuple(list(column) for column in zip(*batch))
+        for batch in batched(documents, get_ingest_batch_size(batch_size))
     )
-    
-    print(f"Added {len(documents)} items to collection")
 
-def perform_similarity_search(collection, query: str, n_results: int = 5) -> List[Dict]:
-    """Perform similarity search and return formatted results"""
+    total_added = ingest_batches(collection, batches, EMBEDDING_MODEL_NAME, num_workers, verbose_mode=verbose_mode,
+                                 embedding_cache=embedding_cache)
+    get_vector_store().persist(collection)
+
+    print(f"Added {total_added} items to collection")
+    return total_added
+
+def read_collection_items(collection, include: Iterable[str] = ('embeddings', 'documents', 'metadatas'),
+                          page_size: int = DEFAULT_INGEST_BATCH_SIZE) -> Dict[str, Any]:
+    """Read every item of a collection page by page.
+
+    Returns the ids and the included fields as lists, the embeddings (if
+    included) as one float32 matrix.
+    """
+    include = list(include)
+    items = {key: [] for key in ['ids'] + include}
+    offset = 0
+    while True:
+        page = client_manager.call_vector_store(lambda: collection.get(include=include, limit=page_size, offset=offset))
+        if not page['ids']:
+            break
+        for key in items:
+            if key == 'embeddings':
+                items[key].append(np.asarray(page[key], dtype=np.float32))
+            else:
+                items[key].extend(page[key])
+        offset += len(page['ids'])
+
+    if 'embeddings' in items:
+        items['embeddings'] = np.vstack(items['embeddings']) if items['embeddings'] else np.zeros((0, 0), dtype=np.float32)
+    return items
+
+def get_collection_ids(collection, page_size: int = DEFAULT_INGEST_BATCH_SIZE) -> List[str]:
+    """Return the ids of every item stored in the collection"""
+    return read_collection_items(collection, [], page_size)['ids']
+
+def sync_similarity_collection(collection, data_items: Iterable[Dict], manifest: Optional[Dict[str, str]],
+                               batch_size: int = DEFAULT_INGEST_BATCH_SIZE, num_workers: int = 0,
+                               verbose_mode: bool = False, bm25_builder: BM25IndexBuilder = None):
+    """Bring the collection in line with data_items, only touching what changed.
+
+    manifest maps doc_id -> content hash of what is currently stored, None if
+    unknown (then every item is re-embedded). Changed and new items are upserted,
+    items missing from data_items are deleted. Returns (new manifest, stats).
+    If bm25_builder is given every item, changed or not, is added to it.
+    """
+    old_manifest = manifest or {}
+    new_manifest = {}
+
+    if manifest is None:
+        # Without a manifest the stored ids are the only reference for deletions
+        old_manifest = dict.fromkeys(get_collection_ids(collection), '')
+
+    documents = add_to_bm25_builder(iter_collection_documents(data_items), bm25_builder)
+    changed = (
+        (doc_id, document, metadata)
+        for doc_id, document, metadata, digest in track_hashes(documents, new_manifest,
+                                                             get_model_tag(EMBEDDING_MODEL_NAME))
+        if old_manifest.get(doc_id) != digest
+    )
+    batches = (
+        tuple(list(column) for column in zip(*batch))
+        for batch in batched(changed, get_ingest_batch_size(batch_size))
+    )
+
+    upserted = ingest_batches(collection, batches, EMBEDDING_MODEL_NAME, num_workers,
+                              write_method='upsert', verbose_mode=verbose_mode, embedding_cache=embedding_cache)
+
+    removed_ids = [doc_id for doc_id in old_manifest if doc_id not in new_manifest]
+    for ids in batched(removed_ids, get_ingest_batch_size(batch_size)):
+        collection.delete(ids=ids)
+    get_vector_store().persist(collection)
+
+    stats = {
+        'total': len(new_manifest),
+        'upserted': upserted,
+        'deleted': len(removed_ids),
+        'unchanged': len(new_manifest) - upserted,
+    }
+    print(f"Synced collection: {stats['upserted']} upserted, {stats['deleted']} deleted, "
+          f"{stats['unchanged']} unchanged")
+    return new_manifest, stats
+
+def get_bm25_index(collection) -> Optional[BM25Index]:
+    """Return the keyword index of a collection.
+
+    The index is loaded from the index directory on first use, or built from
+    the documents stored in the collection if it was never saved.
+    """
+    if hybrid_search is None:
+        return None
+
+    with bm25_indexes_lock:
+        index = bm25_indexes.get(collection.name)
+        if index is not None:
+            return index
+
+        path = get_bm25_index_path(hybrid_search['index_dir'], collection.name)
+        try:
+            index = BM25Index.load(path, hybrid_search['k1'], hybrid_search['b'])
+        except FileNotFoundError:
+            index = None
+        except Exception as e:
+            print(f"Error loading BM25 index {path}, rebuilding it: {e}")
+            index = None
+
+        if index is None:
+            try:
+                index = build_bm25_index_from_collection(collection)
+                index.save(path)
+            except Exception as e:
+                print(f"Error building BM25 index for collection {collection.name}: {e}")
+                return None
+
+        bm25_indexes[collection.name] = index
+        return index
+
+def build_bm25_index_from_collection(collection, page_size: int = DEFAULT_INGEST_BATCH_SIZE) -> BM25Index:
+    """Build the keyword index from the documents already stored in the collection"""
+    builder = BM25IndexBuilder()
+    items = read_collection_items(collection, ['documents'], page_size)
+    for doc_id, document in zip(items['ids'], items['documents']):
+        builder.add(doc_id, document or '')
+    return builder.build(hybrid_search['k1'], hybrid_search['b'])
+
+def get_bm25_builder() -> Optional[BM25IndexBuilder]:
+    """Builder for the keyword index of a collection being loaded, None when hybrid search is off"""
+    return BM25IndexBuilder() if hybrid_search is not None else None
+
+def save_bm25_index(collection_name: str, bm25_builder: Optional[BM25IndexBuilder]):
+    """Finish a keyword index built during ingestion and make it the live index of the collection"""
+    if bm25_builder is None or hybrid_search is None:
+        return
+
+    with pipeline_metrics.span('bm25_build'):
+        index = bm25_builder.build(hybrid_search['k1'], hybrid_search['b'])
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
-        
-        if not results or not results['ids'] or len(results['ids'][0]) == 0:
-            return []
-        
-        formatted_results = []
-        for i in range(len(results['ids'][0])):
-            # Calculate similarity score (1 - distance)
-            similarity_score = 1 - results['distances'][0][i]
-            
-            result = {
-                'doc_id': results['ids'][0][i],
-                'section': results['metadatas'][0][i]['section'],
-                'content': results['documents'][0][i],
-                'similarity_score': similarity_score,
-                'distance': results['distances'][0][i]
-            }
-            formatted_results.append(result)
-        
-        return formatted_results
-        
+        index.save(get_bm25_index_path(hybrid_search['index_dir'], collection_name))
     except Exception as e:
-        print(f"Error in similarity search: {e}")
+        print(f"Error saving BM25 index for collection {collection_name}: {e}")
+
+    with bm25_indexes_lock:
+        bm25_indexes[collection_name] = index
+
+def add_chunk_fields(result: Dict, metadata: Dict):
+    """Copy where a search result was cut from into the result, a whole section is its own source"""
+    result['source_id'] = metadata.get('source_id', result['doc_id'])
+    for key in ('chunk_index', 'chunk_count', 'char_start', 'char_end'):
+        if key in metadata:
+            result[key] = metadata[key]
+
+def format_search_results(results: Dict, query_index: int = 0) -> List[Dict]:
+    """Format the results of one query from a collection.query response"""
+    if not results or not results['ids'] or len(results['ids'][query_index]) == 0:
         return []
 
-def perform_filtered_similarity_search(collection, query: str, section_filter: str = None, 
-                                     n_results: int = 5) -> List[Dict]:
-    """Perform filtered similarity search with metadata constraints"""
-    where_clause = None
-    
+    formatted_results = []
+    for i in range(len(results['ids'][query_index])):
+        # Calculate similarity score (1 - distance)
+        similarity_score = 1 - results['distances'][query_index][i]
+
+        result = {
+            'doc_id': results['ids'][query_index][i],
+            'section': results['metadatas'][query_index][i]['section'],
+            'content': results['documents'][query_index][i],
+            'similarity_score': similarity_score,
+            'distance': results['distances'][query_index][i]
+        }
+        add_chunk_fields(result, results['metadatas'][query_index][i])
+        if results.get('embeddings') is not None:
+            result['embedding'] = results['embeddings'][query_index][i]
+        formatted_results.append(result)
+
+    return formatted_results
+
+def build_where_clause(section_filter: str = None, parent_id: str = None, max_depth: int = None) -> Optional[dict]:
+    """Build a collection where clause from metadata constraints.
+
+    parent_id keeps the direct subsections of a section ('' for top level
+    sections), max_depth the sections at most that deep (0 is top level).
+    """
     # Build filters list
     filters = []
     if section_filter:
         filters.append({"section": section_filter})
-    
+    if parent_id is not None:
+        filters.append({"parent_id": parent_id})
+    if max_depth is not None:
+        filters.append({"depth": {"$lte": max_depth}})
+
     # Construct where clause based on number of filters
     if len(filters) == 1:
-        where_clause = filters[0]
+        return filters[0]
     elif len(filters) > 1:
-        where_clause = {"$and": filters}
-    
+        return {"$and": filters}
+    return None
+
+def perform_batch_similarity_search(collection, queries: List[str], n_results: int = 5,
+                                    where_clauses: List[Optional[dict]] = None,
+                                    query_embeddings: List[List[float]] = None,
+                                    include_embeddings: bool = False) -> List[List[Dict]]:
+    """Search for several queries at once and return the formatted results of each query.
+
+    All queries are embedded in one forward pass, unless their query_embeddings
+    are passed in. Queries sharing the same where clause (or none) are sent in a
+    single collection.query call, since a where clause applies to every query
+    embedding of a call. With include_embeddings every result also carries its
+    document 'embedding'.
+    """
+    include = ['documents', 'metadatas', 'distances'] + (['embeddings'] if include_embeddings else [])
+    if not queries:
+        return []
+    if where_clauses is None:
+        where_clauses = [None] * len(queries)
+
+    batch_results = [[] for _ in queries]
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            where=where_clause
-        )
-        
-        if not results or not results['ids'] or len(results['ids'][0]) == 0:
+        if query_embeddings is None:
+            query_embeddings = embed_texts(queries)
+
+        # Group query positions by their where clause
+        groups = {}
+        for i, where in enumerate(where_clauses):
+            key = json.dumps(where, sort_keys=True)
+            groups.setdefault(key, (where, []))[1].append(i)
+
+        for where, positions in groups.values():
+            with pipeline_metrics.span('vector_search'):
+                results = client_manager.call_vector_store(lambda: collection.query(
+                    query_embeddings=[query_embeddings[i] for i in positions],
+                    n_results=n_results,
+                    where=where,
+                    include=include
+                ))
+            for query_index, position in enumerate(positions):
+                batch_results[position] = format_search_results(results, query_index)
+
+        return batch_results
+
+    except Exception as e:
+        print(f"Error in batch similarity search: {e}")
+        return [[] for _ in queries]
+
+def fetch_search_results(collection, ids: List[str], query_embedding: List[float], where: dict = None) -> Dict[str, Dict]:
+    """Fetch documents found by keyword search only, formatted like vector search results"""
+    results = client_manager.call_vector_store(lambda: collection.get(
+        ids=ids, where=where, include=['documents', 'metadatas', 'embeddings']
+    ))
+    if not results['ids']:
+        return {}
+
+    embeddings = np.asarray(results['embeddings'], dtype=np.float32)
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+    similarities = embeddings @ query_vector / np.maximum(
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_vector), 1e-12
+    )
+
+    fetched = {}
+    for doc_id, document, metadata, embedding, similarity in zip(results['ids'], results['documents'],
+                                                                 results['metadatas'], embeddings, similarities):
+        fetched[doc_id] = {
+            'doc_id': doc_id,
+            'section': metadata['section'],
+            'content': document,
+            'similarity_score': float(similarity),
+            'distance': 1 - float(similarity),
+            'embedding': embedding
+        }
+        add_chunk_fields(fetched[doc_id], metadata)
+    return fetched
+
+def perform_batch_hybrid_search(collection, queries: List[str], n_results: int = 5,
+                                where_clauses: List[Optional[dict]] = None,
+                                query_embeddings: List[List[float]] = None,
+                                include_embeddings: bool = False) -> List[List[Dict]]:
+    """Search with vector and BM25 keyword search and fuse both rankings with reciprocal rank fusion.
+
+    Each retriever contributes its top candidates (hybridCandidates), the best
+    n_results of the fused ranking are returned. Falls back to plain vector
+    search when hybrid search is disabled or the collection has no keyword index.
+    """
+    if hybrid_search is None or not queries:
+        return perform_batch_similarity_search(collection, queries, n_results, where_clauses, query_embeddings,
+                                               include_embeddings)
+    if where_clauses is None:
+        where_clauses = [None] * len(queries)
+
+    try:
+        if query_embeddings is None:
+            query_embeddings = embed_texts(queries)
+
+        candidates = max(n_results, hybrid_search['candidates'])
+        vector_results = perform_batch_similarity_search(collection, queries, candidates, where_clauses,
+                                                         query_embeddings, include_embeddings)
+
+        index = get_bm25_index(collection)
+        if index is None:
+            return [results[:n_results] for results in vector_results]
+        with pipeline_metrics.span('keyword_search'):
+            keyword_results = index.batch_search(queries, candidates)
+
+        batch_results = []
+        for i, query in enumerate(queries):
+            by_id = {result['doc_id']: result for result in vector_results[i]}
+            fused = reciprocal_rank_fusion(
+                [list(by_id), [doc_id for doc_id, _ in keyword_results[i]]], hybrid_search['rrf_k']
+            )[:n_results]
+
+            missing = [doc_id for doc_id, _ in fused if doc_id not in by_id]
+            if missing:
+                # Keyword-only hits, the where clause is applied here since BM25 ignores metadata
+                by_id.update(fetch_search_results(collection, missing, query_embeddings[i], where_clauses[i]))
+
+            fused_results = [dict(by_id[doc_id], fusion_score=score) for doc_id, score in fused if doc_id in by_id]
+            if not include_embeddings:
+                for result in fused_results:
+                    result.pop('embedding', None)
+            batch_results.append(fused_results)
+
+        return batch_results
+
+    except Exception as e:
+        print(f"Error in hybrid search: {e}")
+        return [[] for _ in queries]
+
+def perform_hybrid_search(collection, query: str, n_results: int = 5, query_embedding: List[float] = None) -> List[Dict]:
+    """Perform hybrid search for one query, see perform_batch_hybrid_search"""
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return perform_batch_hybrid_search(collection, [query], n_results, query_embeddings=query_embeddings)[0]
+
+def diversify_search_results(query_embedding: List[float], search_results: List[Dict], n_results: int,
+                             lambda_mult: float = DEFAULT_MMR_LAMBDA) -> List[Dict]:
+    """Keep n_results of the search results chosen by maximal marginal relevance, dropping their embeddings"""
+    if not search_results:
+        return []
+
+    selected = maximal_marginal_relevance(query_embedding, [result['embedding'] for result in search_results],
+                                          n_results, lambda_mult)
+    diversified = []
+    for i in selected:
+        result = dict(search_results[i])
+        del result['embedding']
+        diversified.append(result)
+    return diversified
+
+def get_section_contents(collection, source_ids: List[str]) -> Dict[str, str]:
+    """Rebuild the full content of chunked sections from their stored chunks"""
+    results = client_manager.call_vector_store(lambda: collection.get(
+        where={'source_id': {'$in': source_ids}}, include=['documents', 'metadatas']
+    ))
+
+    chunks = {}
+    for document, metadata in zip(results['documents'], results['metadatas']):
+        # Stored documents are formatted as "section: chunk. ", the span length locates the chunk in it
+        prefix_length = len(format_document_text(metadata['section'], '')) - 2
+        chunk_length = metadata['char_end'] - metadata['char_start']
+        chunk = document[prefix_length:prefix_length + chunk_length]
+        chunks.setdefault(metadata['source_id'], []).append((metadata['char_start'], metadata['char_end'], chunk))
+
+    return {source_id: stitch_chunks(source_chunks) for source_id, source_chunks in chunks.items()}
+
+def expand_chunk_results(collection, search_results: List[Dict]) -> List[Dict]:
+    """Replace retrieved chunks by the whole section they were cut from.
+
+    Only the best ranked chunk of a section is kept, it takes over the id and
+    the full content of its section.
+    """
+    expanded = []
+    seen_sources = set()
+    for result in search_results:
+        source_id = result.get('source_id', result['doc_id'])
+        if source_id in seen_sources:
+            continue
+        seen_sources.add(source_id)
+        expanded.append(result)
+
+    chunked = [result['source_id'] for result in expanded if result.get('chunk_count', 1) > 1]
+    if not chunked:
+        return expanded
+
+    try:
+        contents = get_section_contents(collection, chunked)
+    except Exception as e:
+        print(f"Error expanding chunks to their sections: {e}")
+        return search_results
+
+    for i, result in enumerate(expanded):
+        if result['source_id'] in contents:
+            expanded[i] = dict(result, doc_id=result['source_id'],
+                               content=format_document_text(result['section'], contents[result['source_id']]))
+    return expanded
+
+def perform_batch_rag_search(collection, queries: List[str], n_results: int = 5,
+                             query_embeddings: List[List[float]] = None) -> List[List[Dict]]:
+    """Retrieve the documents handed to the LLM for several queries.
+
+    Runs hybrid (or plain vector) search, and with MMR enabled draws a larger
+    candidate pool (mmrCandidatePool) and keeps a diverse n_results of it, so
+    a parent section and its near-identical subsections do not all end up in the prompt.
+    With chunkParentExpansion retrieved chunks are replaced by their whole section.
+    """
+    if mmr_search is None or not queries:
+        batch_results = perform_batch_hybrid_search(collection, queries, n_results, query_embeddings=query_embeddings)
+    else:
+        if query_embeddings is None:
+            query_embeddings = embed_texts(queries)
+
+        candidates = max(n_results, mmr_search['candidates'])
+        batch_candidates = perform_batch_hybrid_search(collection, queries, candidates,
+                                                       query_embeddings=query_embeddings, include_embeddings=True)
+        with pipeline_metrics.span('mmr'):
+            batch_results = [
+                diversify_search_results(query_embedding, search_results, n_results, mmr_search['lambda'])
+                for query_embedding, search_results in zip(query_embeddings, batch_candidates)
+            ]
+
+    if chunking['expand_parents']:
+        with pipeline_metrics.span('chunk_expansion'):
+            batch_results = [expand_chunk_results(collection, search_results) for search_results in batch_results]
+    return batch_results
+
+def perform_rag_search(collection, query: str, n_results: int = 5, query_embedding: List[float] = None) -> List[Dict]:
+    """Retrieve the documents handed to the LLM for one query, see perform_batch_rag_search"""
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return perform_batch_rag_search(collection, [query], n_results, query_embeddings)[0]
+
+def retrieve_for_queries(collection, queries: List[str], n_results: int = 5) -> List[Tuple[List[float], Optional[str], List[Dict]]]:
+    """Embed queries together, look them up in the response cache and run one batched search for the misses.
+
+    Returns (query_embedding, cached_response, search_results) for every query,
+    cached_response is None on a miss and search_results empty on a hit. If the
+    queries cannot be embedded every query gets (None, None, []), which is answered
+    like a query without matches.
+    """
+    try:
+        query_embeddings = embed_texts(queries)
+
+        cached_responses = [None] * len(queries)
+        if response_cache is not None:
+            with pipeline_metrics.span('response_cache_lookup'):
+                cached_responses = [response_cache.lookup(collection.name, query, query_embedding)
+                                    for query, query_embedding in zip(queries, query_embeddings)]
+            hits = sum(1 for response in cached_responses if response is not None)
+            pipeline_metrics.increment('response_cache_hits', hits)
+            pipeline_metrics.increment('response_cache_misses', len(queries) - hits)
+
+        batch_results = [[] for _ in queries]
+        misses = [i for i, response in enumerate(cached_responses) if response is None]
+        if misses:
+            with pipeline_metrics.span('retrieval'):
+                found = perform_batch_rag_search(collection, [queries[i] for i in misses], n_results,
+                                                 [query_embeddings[i] for i in misses])
+            for i, search_results in zip(misses, found):
+                batch_results[i] = search_results
+
+        pipeline_metrics.increment('retrieval_batches')
+        pipeline_metrics.increment('retrieval_batch_queries', len(queries))
+        return list(zip(query_embeddings, cached_responses, batch_results))
+
+    except Exception as e:
+        print(f"Error retrieving documents: {e}")
+        return [(None, None, []) for _ in queries]
+
+def retrieve_coalesced_queries(items: List[Tuple[Any, str, int]]) -> List[Tuple[List[float], Optional[str], List[Dict]]]:
+    """Batch function of the request coalescer, items are (collection, query, n_results) of one collection"""
+    collection, _, n_results = items[0]
+    return retrieve_for_queries(collection, [query for _, query, _ in items], n_results)
+
+def perform_similarity_search(collection, query: str, n_results: int = 5, query_embedding: List[float] = None) -> List[Dict]:
+    """Perform similarity search and return formatted results"""
+    query_embeddings = [query_embedding] if query_embedding is not None else None
+    return perform_batch_similarity_search(collection, [query], n_results, query_embeddings=query_embeddings)[0]
+
+def perform_filtered_similarity_search(collection, query: str, section_filter: str = None, 
+                                     n_results: int = 5, subtree: str = None) -> List[Dict]:
+    """Perform filtered similarity search with metadata constraints, within the subtree of a section if given"""
+    if subtree is not None:
+        return perform_subtree_search(collection, query, subtree, n_results, where=build_where_clause(section_filter))
+    return perform_batch_similarity_search(collection, [query], n_results, [build_where_clause(section_filter)])[0]
+
+def get_section_hierarchy(collection, page_size: int = DEFAULT_INGEST_BATCH_SIZE) -> SectionHierarchy:
+    """Return the section tree of a collection, read from its document ids on first use"""
+    with section_hierarchies_lock:
+        hierarchy = section_hierarchies.get(collection.name)
+    if hierarchy is not None:
+        return hierarchy
+
+    hierarchy = SectionHierarchy(get_collection_ids(collection, page_size))
+
+    with section_hierarchies_lock:
+        return section_hierarchies.setdefault(collection.name, hierarchy)
+
+def invalidate_section_hierarchy(collection_name: str):
+    """Forget the section tree of a collection whose documents changed"""
+    with section_hierarchies_lock:
+        section_hierarchies.pop(collection_name, None)
+
+def get_sections(collection, hierarchy: SectionHierarchy, section_ids: List[str]) -> List[Dict]:
+    """Fetch whole sections, chunked ones are stitched back together, in the order of section_ids"""
+    doc_ids = hierarchy.document_ids(section_ids)
+    if not doc_ids:
+        return []
+    results = client_manager.call_vector_store(lambda: collection.get(ids=doc_ids, include=['documents', 'metadatas']))
+
+    sections = {}
+    chunked = []
+    for doc_id, document, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+        section_id = metadata.get('source_id', doc_id)
+        sections[section_id] = {'doc_id': section_id, 'section': metadata['section'], 'content': document}
+        if metadata.get('chunk_count', 1) > 1:
+            chunked.append(section_id)
+
+    if chunked:
+        for section_id, content in get_section_contents(collection, list(set(chunked))).items():
+            sections[section_id]['content'] = format_document_text(sections[section_id]['section'], content)
+    return [sections[section_id] for section_id in section_ids if section_id in sections]
+
+def perform_subtree_search(collection, query: str, section_id: str, n_results: int = 5, context: str = None,
+                           max_depth: int = None, where: dict = None) -> List[Dict]:
+    """Similarity search restricted to a section and its subsections.
+
+    Only the documents of the subtree (down to max_depth levels) are scored,
+    found through the in-memory section tree, so scoped queries scan a
+    fraction of the collection. With context 'ancestors' or 'siblings' every
+    result also carries those sections, fetched together in one request.
+    """
+    try:
+        hierarchy = get_section_hierarchy(collection)
+        doc_ids = hierarchy.document_ids(hierarchy.subtree(str(section_id), max_depth))
+        if not doc_ids:
             return []
-        
-        formatted_results = []
-        for i in range(len(results['ids'][0])):
-            similarity_score = 1 - results['distances'][0][i]
-            
-            result = {
-                'doc_id': results['ids'][0][i],
-                'section': results['metadatas'][0][i]['section'],
-                'content': results['documents'][0][i],
-                'similarity_score': similarity_score,
-                'distance': results['distances'][0][i]
-            }
-            formatted_results.append(result)
-        
-        return formatted_results
-        
+
+        query_embeddings = embed_texts([query])
+        with pipeline_metrics.span('vector_search'):
+            results = client_manager.call_vector_store(lambda: collection.query(
+                query_embeddings=query_embeddings,
+                n_results=min(n_results, len(doc_ids)),
+                where=where,
+                ids=doc_ids,
+                include=['documents', 'metadatas', 'distances']
+            ))
+        search_results = format_search_results(results, 0)
+
+        if context in ('ancestors', 'siblings'):
+            related = {}
+            for result in search_results:
+                result_section = result.get('source_id', result['doc_id'])
+                related[result['doc_id']] = (hierarchy.ancestors(result_section) if context == 'ancestors'
+                                             else hierarchy.siblings(result_section))
+            sections = {section['doc_id']: section for section in
+                        get_sections(collection, hierarchy, list(dict.fromkeys(related_id for ids in related.values() for related_id in ids)))}
+            for result in search_results:
+                result[context] = [sections[related_id] for related_id in related[result['doc_id']]
+                                   if related_id in sections]
+
+        return search_results
+
     except Exception as e:
-        print(f"Error in filtered search: {e}")
+        print(f"Error in subtree search: {e}")
         return []
 
 def clear_collection(collection):
@@ -228,7 +1030,7 @@ def clear_collection(collection):
 def delete_collection(collection_name: str):
     """Delete the entire collection"""
     try:
-        chroma_client.delete_collection(collection_name)
+        get_vector_store().delete_collection(collection_name)
         print(f"Collection '{collection_name}' deleted successfully")
     except Exception as e:
         print(f"Error deleting collection '{collection_name}': {e}")
@@ -236,7 +1038,7 @@ def delete_collection(collection_name: str):
 def list_collections() -> List[str]:
     """List all existing collections"""
     try:
-        collections = chroma_client.list_collections()
+        collections = get_vector_store().list_collections()
         return [col.name for col in collections]
     except Exception as e:
         print(f"Error listing collections: {e}")
@@ -260,8 +1062,30 @@ def read_config(file_path):
                 config[key] = value.strip()
     return config
 
-def create_collection_and_load_data(name: str, description: str, data_file_path: str, verbose_mode: bool = False):
-    """Create collection and load data from config file"""
+def update_config(file_path, values: Dict[str, Any]):
+    """Set keys in a config file read by read_config, keeping the other lines and their order"""
+    with open(file_path, 'r') as file:
+        lines = file.read().splitlines()
+
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split(' ', 1)[0]
+        if line.strip() and not line.startswith('#') and key in remaining:
+            lines[i] = f"{key} {remaining.pop(key)}"
+    lines.extend(f"{key} {value}" for key, value in remaining.items())
+
+    with open(file_path, 'w') as file:
+        file.write('\n'.join(lines))
+
+@pipeline_metrics.timed('create_collection')
+def create_collection_and_load_data(name: str, description: str, data_file_path: str, verbose_mode: bool = False,
+                                    batch_size: int = DEFAULT_INGEST_BATCH_SIZE, num_workers: int = 0,
+                                    manifest_dir: str = None):
+    """Create collection and load data from config file.
+
+    If manifest_dir is given the content hashes of the loaded items are saved
+    there, so later updates can use sync_collection_with_data.
+    """
     try:
         # config = read_config(parent_dir / 'config' / 'ragSystem.ini')
         # data_file_path = config.get('dataFilePath', '')
@@ -275,18 +1099,39 @@ def create_collection_and_load_data(name: str, description: str, data_file_path:
         if verbose_mode:
             print(f"Loading data from: {data_file_path}")
         
-        data_items = load_json_data(data_file_path)
-        
-        if verbose_mode:
-            print(f"Loaded {len(data_items)} items from data file.")
+        # Items are streamed from the file and ingested batch by batch so memory
+        # use does not grow with the size of the corpus
+        data_items = iter_json_data(data_file_path)
+
+        if manifest_dir:
+            delete_manifest(get_manifest_path(manifest_dir, name))
         
+        # Build under a staging name so the current collection keeps serving
+        # queries until the new one is complete
+        staging_name = f"{name}{STAGING_COLLECTION_SUFFIX}"
         collection = create_similarity_search_collection(
-            name,
+            staging_name,
             {'description': description}
         )
         
-        populate_similarity_collection(collection, data_items)
+        manifest = {} if manifest_dir else None
+        bm25_builder = get_bm25_builder()
+        with pipeline_metrics.span('populate_collection'):
+            added = populate_similarity_collection(collection, data_items, batch_size, num_workers, verbose_mode,
+                                                   manifest, bm25_builder)
+
+        collection = get_vector_store().replace_collection(staging_name, name)
+
+        if manifest_dir:
+            save_manifest(get_manifest_path(manifest_dir, name), manifest)
+        save_bm25_index(name, bm25_builder)
         
+        if verbose_mode:
+            print(f"Loaded {added} items from data file.")
+        
+        invalidate_response_cache(name)
+        invalidate_section_hierarchy(name)
+
         if verbose_mode:
             print("Collection created and populated successfully.")
         
@@ -297,57 +1142,243 @@ def create_collection_and_load_data(name: str, description: str, data_file_path:
         return None
 
 
-def prepare_context_for_llm(query: str, search_results: List[Dict]) -> str:
-    """Prepare structured context from search results for LLM"""
+@pipeline_metrics.timed('sync_collection')
+def sync_collection_with_data(name: str, description: str, data_file_path: str, manifest_dir: str,
+                              verbose_mode: bool = False, batch_size: int = DEFAULT_INGEST_BATCH_SIZE,
+                              num_workers: int = 0):
+    """Incrementally update a collection from the data file.
+
+    Only items whose content hash differs from the collection's manifest are
+    re-embedded and items that disappeared from the file are deleted. The
+    collection is created if it does not exist yet.
+    Returns (collection, stats), collection is None on failure.
+    """
+    try:
+        if verbose_mode:
+            print(f"Syncing collection '{name}' with: {data_file_path}")
+
+        manifest_path = get_manifest_path(manifest_dir, name)
+
+        collection = get_vector_store().get_or_create_collection(
+            name,
+            metadata=get_collection_metadata({'description': description}),
+            configuration=get_collection_configuration()
+        )
+
+        manifest = load_manifest(manifest_path)
+        if manifest is not None:
+            # A wiped or recreated collection would otherwise look unchanged and stay empty
+            stored = client_manager.call_vector_store(collection.count)
+            if stored != len(manifest):
+                print(f"Collection '{name}' holds {stored} items but its manifest lists {len(manifest)}, "
+                      "all items will be re-embedded.")
+                manifest = None
+        elif verbose_mode:
+            print("No manifest found for the collection, all items will be re-embedded.")
+
+        # Drop the manifest while the collection is being modified so an
+        # interrupted sync falls back to a full comparison next time
+        delete_manifest(manifest_path)
+
+        bm25_builder = get_bm25_builder()
+        new_manifest, stats = sync_similarity_collection(collection, iter_json_data(data_file_path), manifest,
+                                                         batch_size, num_workers, verbose_mode, bm25_builder)
+        save_manifest(manifest_path, new_manifest)
+        save_bm25_index(name, bm25_builder)
+
+        if stats['upserted'] or stats['deleted']:
+            invalidate_response_cache(name)
+            invalidate_section_hierarchy(name)
+
+        if verbose_mode:
+            print("Collection synced successfully.")
+
+        return collection, stats
+
+    except Exception as e:
+        print(f"Error in syncing collection with data: {e}")
+        return None, {}
+
+@pipeline_metrics.timed('snapshot_collection')
+def export_collection_snapshot(collection, snapshot_path: str, page_size: int = DEFAULT_INGEST_BATCH_SIZE) -> Optional[int]:
+    """Write the embeddings, documents and metadata of a collection to a snapshot file.
+
+    Returns the number of items written, None on failure.
+    """
+    try:
+        items = read_collection_items(collection, page_size=page_size)
+        collection_metadata = dict(collection.metadata or {})
+        model_tag = collection_metadata.get('embedding_model', get_model_tag(EMBEDDING_MODEL_NAME))
+        ids = items['ids']
+        write_snapshot(snapshot_path, ids, items['embeddings'], items['documents'], items['metadatas'],
+                       collection_metadata, model_tag)
+        return len(ids)
+
+    except Exception as e:
+        print(f"Error in writing snapshot of collection {collection.name}: {e}")
+        return None
+
+@pipeline_metrics.timed('restore_collection')
+def restore_collection_snapshot(name: str, snapshot_path: str, verbose_mode: bool = False, manifest_dir: str = None):
+    """Recreate a collection from a snapshot file without embedding anything.
+
+    The snapshot must come from the embedding model queries use. It is loaded
+    under a staging name and swapped in when complete, like a rebuild. The
+    numpy vector store keeps the snapshot's embedding matrix memory-mapped.
+    The keyword index and, if manifest_dir is given, the manifest are rebuilt
+    from the snapshot so hybrid search and incremental syncs keep working.
+    """
+    try:
+        snapshot = read_snapshot(snapshot_path)
+        model_tag = get_model_tag(EMBEDDING_MODEL_NAME)
+        if snapshot['model_tag'] != model_tag:
+            print(f"Snapshot {snapshot_path} was built with {snapshot['model_tag']} but queries use {model_tag}, "
+                  "rebuild the collection with create_collection instead")
+            return None
+
+        if verbose_mode:
+            print(f"Restoring {snapshot['count']} items into collection '{name}' from: {snapshot_path}")
+
+        staging_name = f"{name}{STAGING_COLLECTION_SUFFIX}"
+        collection = create_similarity_search_collection(staging_name, snapshot['collection_metadata'])
+        client_manager.call_vector_store(lambda: get_vector_store().bulk_load(
+            collection, snapshot['ids'], snapshot['embeddings'], snapshot['documents'], snapshot['metadatas']
+        ), deadline=False)
+        collection = get_vector_store().replace_collection(staging_name, name)
+
+        bm25_builder = get_bm25_builder()
+        if bm25_builder is not None:
+            for doc_id, document in zip(snapshot['ids'], snapshot['documents']):
+                bm25_builder.add(doc_id, document or '')
+        save_bm25_index(name, bm25_builder)
+
+        if manifest_dir:
+            save_manifest(get_manifest_path(manifest_dir, name), {
+                doc_id: content_hash(document, metadata, model_tag)
+                for doc_id, document, metadata in zip(snapshot['ids'], snapshot['documents'], snapshot['metadatas'])
+            })
+
+        invalidate_response_cache(name)
+        invalidate_section_hierarchy(name)
+
+        if verbose_mode:
+            print("Collection restored successfully.")
+
+        return collection
+
+    except Exception as e:
+        print(f"Error in restoring collection from snapshot: {e}")
+        return None
+
+
+def format_context_document(number: int, result: Dict, content: str) -> str:
+    """Format one retrieved document for the LLM context"""
+    doc_context = []
+    doc_context.append(f"Option {number}: {result['section']}")
+    doc_context.append(f"  - Content: {content}")
+
+    doc_context.append(f"  - Similarity score: {result['similarity_score']*100:.1f}%")
+    doc_context.append("")
+
+    return "\n".join(doc_context)
+
+def prepare_context_for_llm(query: str, search_results: List[Dict], metrics: Dict[str, float] = None) -> str:
+    """Prepare structured context from search results for LLM.
+
+    The documents are packed into the configured token budget, see contextPacker.pack_context.
+    If metrics is given it receives the prompt tokens used and saved and the
+    number of documents packed and considered.
+    """
     if not search_results:
         return "No relevant document found in the database."
     
     context_parts = []
     context_parts.append("Based on your query, here are the most relevant documents from our database:")
     context_parts.append("")
-    
-    for i, result in enumerate(search_results[:3], 1):
-        doc_context = []
-        doc_context.append(f"Option {i}: {result['section']}")
-        doc_context.append(f"  - Content: {result['content']}")
-        
-        doc_context.append(f"  - Similarity score: {result['similarity_score']*100:.1f}%")
-        doc_context.append("")
-        
-        context_parts.extend(doc_context)
-    
+
+    token_budget = context_packing['token_budget'] if context_packing['token_budget'] > 0 else float('inf')
+    with pipeline_metrics.span('context_build'):
+        documents, stats = pack_context(search_results, format_context_document, token_budget, token_counter.count,
+                                        context_packing['max_documents'])
+    pipeline_metrics.increment('context_tokens_used', stats['used'])
+    pipeline_metrics.increment('context_tokens_saved', stats['saved'])
+    context_parts.extend(documents)
+
+    if metrics is not None:
+        metrics['context_tokens_used'] = stats['used']
+        metrics['context_tokens_saved'] = stats['saved']
+        metrics['context_documents'] = len(documents)
+        metrics['context_candidates'] = min(len(search_results), context_packing['max_documents'])
+
     return "\n".join(context_parts)
 
-def generate_llm_rag_response(query: str, search_results: List[Dict], conversation_history: List[str]) -> str:
-    """Generate response using llama.cpp with retrieved context"""
-    try:
-        # Prepare context from search results
-        context = prepare_context_for_llm(query, search_results)
-        
-        # Build the prompt for the LLM
-        prompt = f'''You are a helpful upanzi lab assistant. A user is asking questions about the Upanzi, and I've retrieved relevant options from a document database.
+def trim_conversation_history(conversation_history: List[Dict]):
+    """Drop old turns in place, in chunks so consecutive prompts share their history.
 
-User Query: "{query}"
+    Turns are appended until the history holds twice historyTurns, then it is
+    cut back to the last historyTurns. Between cuts the history block of the
+    prompt only grows at its end, so the LLM server keeps reusing the cached
+    prompt prefix, only a cut invalidates it.
+    """
+    history_turns = prompt_settings['history_turns']
+    if history_turns <= 0:
+        conversation_history.clear()
+    elif len(conversation_history) > 2 * history_turns:
+        del conversation_history[:-history_turns]
+
+def format_conversation_history(conversation_history: List[Dict], max_turns: int = None) -> str:
+    """Format the most recent turns of the conversation, oldest first.
+
+    By default every turn trim_conversation_history keeps is shown.
+    """
+    if max_turns is None:
+        max_turns = 2 * prompt_settings['history_turns']
+    if not conversation_history or max_turns <= 0:
+        return ''
+
+    lines = ["Conversation so far:"]
+    for turn in conversation_history[-max_turns:]:
+        lines.append(f"User: {turn['content']}")
+        lines.append(f"Assistant: {turn['response']}")
+    return "\n".join(lines) + "\n\n"
+
+def build_rag_prompt(query: str, search_results: List[Dict], conversation_history: List[str],
+                     metrics: Dict[str, float] = None) -> str:
+    """Build the completion prompt for a query and its retrieved documents.
+
+    The static instructions come first and the conversation only grows at its
+    end, so consecutive prompts share a long prefix the llama.cpp server can
+    reuse from its KV cache. Only the retrieved documents and the query, which
+    change with every request, are evaluated from scratch.
+    metrics receives the context packing stats, see prepare_context_for_llm.
+    """
+    # Prepare context from search results
+    context = prepare_context_for_llm(query, search_results, metrics)
+    history = format_conversation_history(conversation_history)
 
-Retrieved Document Information:
+    # Build the prompt for the LLM
+    return f'''{RAG_SYSTEM_PROMPT}
+{history}Retrieved Document Information:
 {context}
 
-Please provide a helpful, short response that:
-1. Acknowledges the user's request
-2. Answers the question or comment from the retrieved options
-3. Explains why these answers match their request
-4. Includes relevant details
-5. Uses a friendly, conversational tone
-6. Keeps the response concise but informative
+User Query: "{query}"
 
 Response:'''
 
+def generate_llm_rag_response(query: str, search_results: List[Dict], conversation_history: List[str],
+                              metrics: Dict[str, float] = None) -> str:
+    """Generate response using llama.cpp with retrieved context"""
+    try:
+        prompt = build_rag_prompt(query, search_results, conversation_history, metrics)
+
         # Generate response using IBM Granite
-        generated_response = client.completions.create(
-            model="davinci-002",
-            prompt=prompt,
-            max_tokens=512
-        )
+        with pipeline_metrics.span('llm'):
+            generated_response = client_manager.call_llm(lambda llm_client: llm_client.completions.create(
+                model=client_manager.settings['llmModel'],
+                prompt=prompt,
+                max_tokens=512,
+                extra_body=client_manager.get_completion_options()
+            ))
 
         # print(f'Generated Response: {type(generated_response)}')
 
@@ -368,33 +1399,252 @@ Response:'''
             
     except Exception as e:
         print(f"❌ LLM Error: {e}")
+        pipeline_metrics.increment('llm_errors')
         return generate_fallback_response(query, search_results)
 
+class SentenceSplitter:
+    """Accumulate streamed text and hand out complete sentences as soon as they end"""
+
+    def __init__(self, on_sentence: Callable[[str], None], min_chars: int = MIN_STREAM_SENTENCE_CHARS):
+        self.on_sentence = on_sentence
+        self.min_chars = min_chars
+        self.buffer = ''
+        self.sentence_count = 0
+
+    def _emit(self, sentence: str):
+        sentence = sentence.strip()
+        if sentence:
+            self.sentence_count += 1
+            self.on_sentence(sentence)
+
+    def feed(self, text: str):
+        self.buffer += text
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self.buffer):
+            # Abbreviations and very short pieces are joined with the next sentence
+            last_word = self.buffer[start:match.start()].rsplit(None, 1)[-1].lower()
+            if match.start() - start >= self.min_chars and last_word not in NON_SENTENCE_ENDINGS:
+                self._emit(self.buffer[start:match.start()])
+                start = match.end()
+        self.buffer = self.buffer[start:]
+
+    def flush(self):
+        self._emit(self.buffer)
+        self.buffer = ''
+
+def stream_llm_rag_response(query: str, search_results: List[Dict], conversation_history: List[str],
+                            on_sentence: Callable[[str], None], metrics: Dict[str, float] = None) -> str:
+    """Generate a response with a streaming completion, calling on_sentence for each finished sentence.
+
+    Returns the full response text. If metrics is given it receives the time to
+    first token, time to first sentence and total time in seconds, and the
+    context packing stats.
+    """
+    start_time = time.perf_counter()
+    first_token_time = None
+    first_sentence_time = None
+    parts = []
+
+    def publish(sentence: str):
+        nonlocal first_sentence_time
+        if first_sentence_time is None:
+            first_sentence_time = time.perf_counter() - start_time
+        on_sentence(sentence)
+
+    splitter = SentenceSplitter(publish)
+
+    try:
+        prompt = build_rag_prompt(query, search_results, conversation_history, metrics)
+
+        # Retries only cover opening the stream, a stream that breaks off falls back
+        stream = client_manager.call_llm(lambda llm_client: llm_client.completions.create(
+            model=client_manager.settings['llmModel'],
+            prompt=prompt,
+            max_tokens=512,
+            stream=True,
+            extra_body=client_manager.get_completion_options()
+        ))
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].text or ''
+            if not text:
+                continue
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start_time
+            parts.append(text)
+            splitter.feed(text)
+
+        response_text = ''.join(parts).strip()
+
+        # If response is too short, provide a fallback instead of the unfinished sentence
+        if len(response_text) < 50:
+            response_text = generate_fallback_response(query, search_results)
+            if splitter.sentence_count == 0:
+                publish(response_text)
+        else:
+            splitter.flush()
+
+    except Exception as e:
+        print(f"❌ LLM Error: {e}")
+        pipeline_metrics.increment('llm_errors')
+        response_text = generate_fallback_response(query, search_results)
+        if splitter.sentence_count == 0:
+            publish(response_text)
+
+    total_time = time.perf_counter() - start_time
+    pipeline_metrics.observe('llm', total_time)
+    if first_token_time is not None:
+        pipeline_metrics.observe('llm_first_token', first_token_time)
+
+    if metrics is not None:
+        metrics['time_to_first_token'] = first_token_time if first_token_time is not None else -1.0
+        metrics['time_to_first_sentence'] = first_sentence_time if first_sentence_time is not None else -1.0
+        metrics['total_time'] = total_time
+
+    return response_text
+
 def generate_fallback_response(query: str, search_results: List[Dict]) -> str:
     """Generate fallback response when LLM fails"""
 
-    return "I don't understand what you mean. Try rephrasing your question!"
+    return FALLBACK_RESPONSE
+
+def open_collection(collection_name: str):
+    """Open a collection for serving prompts: load its vector index and, with hybrid search, its keyword index.
+
+    Returns None if the collection does not exist.
+    """
+    collection = get_similarity_search_collection(collection_name)
+    if collection is None:
+        return None
+
+    try:
+        apply_search_settings(collection)
+    except Exception as e:
+        print(f"Error applying search settings to collection {collection_name}: {e}")
+
+    try:
+        # The first query pulls the vector index into memory, pay for it now instead of in a prompt
+        client_manager.call_vector_store(lambda: collection.query(query_embeddings=embed_texts([WARM_UP_QUERY]),
+                                                                  n_results=1))
+    except Exception as e:
+        print(f"Error warming up collection {collection_name}: {e}")
+
+    if hybrid_search is not None:
+        get_bm25_index(collection)
+    return collection
+
+def release_collection(collection_name: str):
+    """Free what open_collection loaded for a collection that is no longer served"""
+    with bm25_indexes_lock:
+        bm25_indexes.pop(collection_name, None)
+    invalidate_section_hierarchy(collection_name)
+
+def warm_up_rag_system(collection, verbose_mode: bool = False) -> Dict[str, float]:
+    """Load the embedding model, connect to the vector store and prime the LLM before the first prompt.
+
+    Returns the seconds spent in each step. A failing step is reported and skipped
+    so the node can still start, the work is then paid by the first prompt instead.
+    """
+    timings = {}
+
+    def timed(step: str, func: Callable[[], Any]):
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            print(f"Warm-up step '{step}' failed: {e}")
+        timings[step] = time.perf_counter() - start
+        if verbose_mode:
+            print(f"Warm-up step '{step}' took {timings[step]:.2f}s")
+
+    query_embedding = []
 
-def handle_rag_query(collection, query: str, conversation_history: List[str], verbose_mode: bool = False, top_k: int = 3) -> str:
-    """Handle user query with enhanced RAG approach"""
+    def load_embedding_model():
+        # Bypass the embedding cache so the model really runs once
+        query_embedding.append(embed([WARM_UP_QUERY], EMBEDDING_MODEL_NAME)[0].tolist())
+
+    def query_vector_store():
+        if collection is None or not query_embedding:
+            client_manager.call_vector_store(lambda: get_vector_store().list_collections())
+            return
+        client_manager.call_vector_store(lambda: collection.query(query_embeddings=query_embedding, n_results=1))
+
+    def prime_llm():
+        # Evaluating the prompt once warms up the llama.cpp server and caches the shared system prefix
+        client_manager.call_llm(lambda llm_client: llm_client.completions.create(
+            model=client_manager.settings['llmModel'],
+            prompt=build_rag_prompt(WARM_UP_QUERY, [], []),
+            max_tokens=1,
+            extra_body=client_manager.get_completion_options()
+        ))
+
+    timed('embedding_model', load_embedding_model)
+    timed('vector_store', query_vector_store)
+    timed('llm', prime_llm)
+    return timings
+
+@pipeline_metrics.timed('handle_rag_query')
+def handle_rag_query(collection, query: str, conversation_history: List[str], verbose_mode: bool = False, top_k: int = 3,
+                     on_sentence: Callable[[str], None] = None, metrics: Dict[str, float] = None) -> str:
+    """Handle user query with enhanced RAG approach.
+
+    If on_sentence is given the answer is streamed from the LLM and passed on
+    sentence by sentence while it is generated. If metrics is given it receives
+    the context packing stats of the prompt (see prepare_context_for_llm) and,
+    when streaming, the streaming latencies (see stream_llm_rag_response).
+    """
     if verbose_mode:
         print(f"\n🔍 Searching vector database for: '{query}'...")
-    
-    # Perform similarity search with more results for better context
-    search_results = perform_similarity_search(collection, query, top_k)
+
+    # Perform similarity search with more results for better context, fused
+    # with keyword search and diversified when enabled. Queries arriving
+    # together are embedded and searched as one batch, the LLM calls stay per query
+    if request_coalescer is not None:
+        query_embedding, cached_response, search_results = request_coalescer.submit(
+            (collection, query, top_k), key=(id(collection), top_k))
+    else:
+        query_embedding, cached_response, search_results = retrieve_for_queries(collection, [query], top_k)[0]
+
+    if cached_response is not None:
+        if verbose_mode:
+            print(f"\n⚡ Answered from response cache: {cached_response}")
+        if on_sentence is not None:
+            splitter = SentenceSplitter(on_sentence)
+            splitter.feed(cached_response)
+            splitter.flush()
+        return cached_response
 
     if not search_results:
+        pipeline_metrics.increment('no_match_responses')
         if verbose_mode:
             print("🤖 Bot: I couldn't find any documents matching your request.")
             print("      Try rephrasing your question!")
-        return "I couldn't find any documents matching your request. Try rephrasing your question!"
+        if on_sentence is not None:
+            on_sentence(NO_MATCH_RESPONSE)
+        return NO_MATCH_RESPONSE
 
     if verbose_mode:
         print(f"✅ Found {len(search_results)} relevant matches")
         print("🧠 Generating AI-powered response...")
     
     # Generate enhanced RAG response using IBM Granite
-    ai_response = generate_llm_rag_response(query, search_results, conversation_history)
+    if on_sentence is not None:
+        ai_response = stream_llm_rag_response(query, search_results, conversation_history, on_sentence, metrics)
+        if verbose_mode and metrics is not None:
+            print(f"⏱️  First token after {metrics['time_to_first_token']:.2f}s, "
+                  f"first sentence after {metrics['time_to_first_sentence']:.2f}s")
+    else:
+        ai_response = generate_llm_rag_response(query, search_results, conversation_history, metrics)
+
+    is_fallback = ai_response == generate_fallback_response(query, search_results)
+    if is_fallback:
+        pipeline_metrics.increment('fallback_responses')
+
+    # Fallback answers are not cached so the next visitor gets another chance at a real answer
+    if response_cache is not None and not is_fallback:
+        response_cache.store(collection.name, query, query_embedding, ai_response)
 
     if verbose_mode:
         print(f"\n🤖 Bot: {ai_response}")
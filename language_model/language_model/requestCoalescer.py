@@ -0,0 +1,76 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# How long the first request of a batch waits for others, and the largest batch
+DEFAULT_COALESCE_WINDOW = 0.005
+DEFAULT_MAX_BATCH_SIZE = 8
+
+
+class _Batch:
+    __slots__ = ('items', 'results', 'error', 'full', 'done')
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class RequestCoalescer:
+    """Gather concurrent calls into batches for a function that handles many items at once.
+
+    Callers block in submit(). The first caller of a batch leads it: it waits
+    up to window seconds for more items, or until max_batch_size arrived, then
+    runs process_batch(items) in its own thread and every caller gets the
+    result at its position. The leader only waits while other calls are in
+    flight, so a lone request is never delayed. Only items with the same key
+    are batched together.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], window: float = DEFAULT_COALESCE_WINDOW,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._lock = threading.Lock()
+        self._open_batches: Dict[Hashable, _Batch] = {}
+        self._in_flight = 0
+
+    def submit(self, item: Any, key: Hashable = None) -> Any:
+        with self._lock:
+            self._in_flight += 1
+            batch = self._open_batches.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open_batches[key] = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                del self._open_batches[key]
+                batch.full.set()
+            others_in_flight = self._in_flight > 1
+
+        try:
+            if is_leader:
+                if others_in_flight and self.window > 0:
+                    batch.full.wait(self.window)
+                with self._lock:
+                    # Close the batch, later callers start a new one
+                    if self._open_batches.get(key) is batch:
+                        del self._open_batches[key]
+                try:
+                    batch.results = self.process_batch(batch.items)
+                except BaseException as e:
+                    batch.error = e
+                finally:
+                    batch.done.set()
+            else:
+                batch.done.wait()
+
+            if batch.error is not None:
+                raise batch.error
+            return batch.results[index]
+        finally:
+            with self._lock:
+                self._in_flight -= 1
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from embeddingCache import normalize_text
+
+
+class ResponseCache:
+    """LRU cache of generated answers matched on exact text or query-embedding similarity.
+
+    A query hits when its normalized text was seen before, or when the cosine
+    similarity between its embedding and a cached query's embedding is at least
+    threshold. Entries expire after ttl_seconds (0 keeps them until evicted) and
+    are scoped per collection so a rebuilt collection can be invalidated alone.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # (collection name, normalized query) -> (unit embedding, response, time stored)
+        self._entries = OrderedDict()
+        # Stacked embeddings of _entries for vectorized similarity, rebuilt when stale
+        self._matrix = None
+        self._matrix_keys = []
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def _rebuild_matrix(self):
+        self._matrix_keys = list(self._entries)
+        if self._matrix_keys:
+            self._matrix = np.stack([self._entries[key][0] for key in self._matrix_keys])
+        else:
+            self._matrix = None
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._matrix = None
+
+    def lookup(self, collection_name: str, query: str, embedding) -> Optional[str]:
+        """Return a cached response for the query, None on a miss"""
+        key = (collection_name, normalize_text(query))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                key = self._find_similar(collection_name, embedding)
+                entry = self._entries.get(key) if key is not None else None
+
+            if entry is not None and self._expired(entry[2], now):
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _find_similar(self, collection_name: str, embedding):
+        """Return the key of the most similar cached query in the collection above the threshold"""
+        if embedding is None or not self._entries:
+            return None
+        if self._matrix is None:
+            self._rebuild_matrix()
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+
+        similarities = self._matrix @ (query / norm)
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.threshold:
+                return None
+            key = self._matrix_keys[index]
+            if key[0] == collection_name:
+                return key
+        return None
+
+    def store(self, collection_name: str, query: str, embedding, response: str):
+        """Cache the response generated for a query"""
+        if self.max_entries <= 0:
+            return
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        key = (collection_name, normalize_text(query))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (vector, response, time.monotonic())
+            self._matrix = None
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, collection_name: str = None):
+        """Drop cached responses of a collection, or of every collection if no name is given"""
+        with self._lock:
+            if collection_name is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == collection_name]:
+                    del self._entries[key]
+            self._matrix = None
+
+    def __len__(self):
+        return len(self._entries)
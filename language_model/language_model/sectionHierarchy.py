@@ -0,0 +1,88 @@
+from typing import Dict, Iterable, List, Optional
+
+from chunker import get_source_id
+from contextPacker import get_ancestor_ids
+
+# Joins the ancestor ids of a section in its parent_path metadata, e.g. 1/1_2
+PATH_SEPARATOR = '/'
+
+
+def get_parent_id(section_id: str) -> str:
+    """Id of the parent section, '' for a top level section"""
+    ancestors = get_ancestor_ids(section_id)
+    return ancestors[-1] if ancestors else ''
+
+
+def get_hierarchy_metadata(section_id: str) -> Dict:
+    """Where a section sits in the tree encoded by its id: 1_2_3 -> parent 1_2, path 1/1_2, depth 2"""
+    ancestors = get_ancestor_ids(section_id)
+    return {
+        'parent_id': ancestors[-1] if ancestors else '',
+        'parent_path': PATH_SEPARATOR.join(ancestors),
+        'depth': len(ancestors),
+    }
+
+
+class SectionHierarchy:
+    """In-memory tree of the sections of a collection and the documents stored for each.
+
+    Built from document ids alone (a chunk belongs to the section it was cut
+    from), so it also works for collections indexed before hierarchy metadata
+    was stored. A section without content of its own is still a node of the
+    tree when it has subsections.
+    """
+
+    def __init__(self, doc_ids: Iterable[str] = ()):
+        self._documents: Dict[str, List[str]] = {}
+        self._children: Dict[str, List[str]] = {}
+        self._sections = set()
+        for doc_id in doc_ids:
+            self.add(doc_id)
+
+    def add(self, doc_id: str):
+        section_id = get_source_id(doc_id)
+        documents = self._documents.get(section_id)
+        if documents is None:
+            documents = self._documents[section_id] = []
+            # Register the whole path so sections without content still link their subsections
+            child = section_id
+            for ancestor in reversed([''] + get_ancestor_ids(section_id)):
+                if child in self._sections:
+                    break
+                self._sections.add(child)
+                self._children.setdefault(ancestor, []).append(child)
+                child = ancestor
+        documents.append(doc_id)
+
+    def __contains__(self, section_id: str) -> bool:
+        return section_id in self._sections
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def children(self, section_id: str) -> List[str]:
+        return list(self._children.get(section_id, []))
+
+    def ancestors(self, section_id: str) -> List[str]:
+        """Ancestors with content of their own, top level first"""
+        return [ancestor for ancestor in get_ancestor_ids(section_id) if ancestor in self._documents]
+
+    def siblings(self, section_id: str) -> List[str]:
+        return [sibling for sibling in self._children.get(get_parent_id(section_id), []) if sibling != section_id]
+
+    def subtree(self, section_id: str, max_depth: Optional[int] = None) -> List[str]:
+        """The section and its descendants down to max_depth levels below it, in document order"""
+        if section_id not in self:
+            return []
+        sections = []
+        stack = [(section_id, 0)]
+        while stack:
+            current, level = stack.pop()
+            sections.append(current)
+            if max_depth is None or level < max_depth:
+                stack.extend((child, level + 1) for child in reversed(self._children.get(current, [])))
+        return sections
+
+    def document_ids(self, section_ids: Iterable[str]) -> List[str]:
+        """Ids of the documents (whole sections or chunks) stored for the sections"""
+        return [doc_id for section_id in section_ids for doc_id in self._documents.get(section_id, [])]
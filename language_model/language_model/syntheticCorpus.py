@@ -0,0 +1,72 @@
+import json
+import random
+from typing import Dict, List
+
+# Vocabulary of the generated text, with the kind of names, acronyms and
+# codes real questions ask about
+COMMON_WORDS = [
+    'the', 'lab', 'research', 'project', 'students', 'team', 'digital', 'public', 'infrastructure', 'network',
+    'africa', 'university', 'program', 'data', 'security', 'privacy', 'identity', 'payments', 'exchange',
+    'open', 'source', 'software', 'partners', 'government', 'workshop', 'funding', 'robot', 'assistant',
+    'visitors', 'events', 'courses', 'faculty', 'builds', 'supports', 'develops', 'studies', 'with', 'and',
+    'for', 'in', 'of', 'to', 'on', 'new', 'local', 'regional', 'mobile', 'systems', 'policy', 'training',
+]
+NAMES = ['Upanzi', 'Kigali', 'CMU-Africa', 'Pepper', 'MOSIP', 'DPI', 'Mastercard', 'Rwanda', 'Nairobi', 'Accra']
+CODES = ['CS101', 'EE402', 'DPI-7', 'ID-21', 'PAY-3', 'X2025']
+
+
+def _sentence(rng: random.Random, min_words: int = 6, max_words: int = 18) -> str:
+    words = rng.choices(COMMON_WORDS, k=rng.randint(min_words, max_words))
+    for _ in range(rng.randint(0, 2)):
+        words.insert(rng.randrange(len(words)), rng.choice(NAMES + CODES))
+    return ' '.join(words).capitalize() + '.'
+
+
+def _content(rng: random.Random, sentences: int) -> str:
+    return ' '.join(_sentence(rng) for _ in range(max(1, sentences)))
+
+
+def _section(rng: random.Random, depth: int, fanout: int, sentences: int) -> Dict:
+    section = {
+        'section': ' '.join(rng.choices(COMMON_WORDS + NAMES, k=rng.randint(1, 3))).title(),
+        'content': _content(rng, rng.randint(1, sentences)),
+    }
+    if depth > 0:
+        section['subsections'] = [_section(rng, depth - 1, fanout, sentences) for _ in range(rng.randint(0, fanout))]
+    return section
+
+
+def generate_corpus(num_documents: int = 200, depth: int = 2, fanout: int = 3, sentences: int = 6,
+                    seed: int = 0) -> List[Dict]:
+    """Nested sections shaped like the RAG data file.
+
+    Each top level document has a doc_id, section, content and up to depth
+    levels of subsections with at most fanout children each. The same seed
+    always gives the same corpus.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for doc_id in range(1, num_documents + 1):
+        document = {'doc_id': doc_id}
+        document.update(_section(rng, depth, fanout, sentences))
+        corpus.append(document)
+    return corpus
+
+
+def generate_queries(num_queries: int = 100, seed: int = 1) -> List[str]:
+    """Short questions over the corpus vocabulary"""
+    rng = random.Random(seed)
+    templates = ['What is {}?', 'Who works on {}?', 'Tell me about {} and {}.', 'Where can I find {}?']
+    queries = []
+    for _ in range(num_queries):
+        template = rng.choice(templates)
+        queries.append(template.format(*(rng.choice(COMMON_WORDS + NAMES + CODES) for _ in range(template.count('{}')))))
+    return queries
+
+
+def write_corpus(file_path: str, **options) -> int:
+    """Generate a corpus (see generate_corpus) and write it as a JSON data file, returns the number of documents"""
+    corpus = generate_corpus(**options)
+    with open(file_path, 'w') as file:
+        json.dump(corpus, file)
+    return len(corpus)
@@ -0,0 +1,538 @@
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from embeddingRegistry import get_chroma_embedding_function
+
+DEFAULT_QUERY_INCLUDE = ('metadatas', 'documents', 'distances')
+DEFAULT_GET_INCLUDE = ('metadatas', 'documents')
+
+
+class VectorStore(ABC):
+    """Collection management interface shared by the vector search backends.
+
+    Collections returned by a store follow the chromadb Collection API
+    (add, upsert, delete, get, query, count) so the RAG code works with any backend.
+    """
+
+    # False when the store's requests can hang without a timeout, the client
+    # manager then bounds every call to it instead
+    bounds_requests = True
+
+    @abstractmethod
+    def get_collection(self, name: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_collection(self, name: str, metadata: dict = None, configuration: dict = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_or_create_collection(self, name: str, metadata: dict = None, configuration: dict = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_collection(self, name: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_collections(self) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def rename_collection(self, name: str, new_name: str):
+        """Rename a collection and return its handle, new_name must not exist"""
+        raise NotImplementedError
+
+    def replace_collection(self, source_name: str, target_name: str):
+        """Replace target_name with the collection source_name and return the renamed handle.
+
+        Used to swap in a collection that was built under a temporary name, so the
+        old one keeps answering queries until the new one is complete.
+        """
+        try:
+            self.delete_collection(target_name)
+        except Exception:
+            pass
+        return self.rename_collection(source_name, target_name)
+
+    def get_max_batch_size(self) -> int:
+        """Largest number of items accepted by a single add/upsert call"""
+        return 1 << 30
+
+    def bulk_load(self, collection, ids: List[str], embeddings, documents: List[Optional[str]],
+                  metadatas: List[Optional[dict]]):
+        """Add precomputed items to an empty collection, in batches the store accepts"""
+        batch_size = self.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(ids=ids[start:end], embeddings=np.asarray(embeddings[start:end]),
+                           documents=documents[start:end], metadatas=metadatas[start:end])
+
+    def persist(self, collection):
+        """Make sure changes to the collection are stored durably"""
+        pass
+
+
+class ChromaVectorStore(VectorStore):
+    """Vector store backed by a chromadb server"""
+
+    def __init__(self, host: str = 'localhost', port: int = 8000, embedding_model_name: str = 'all-MiniLM-L6-v2',
+                 timeout=None, limits=None):
+        import chromadb
+
+        settings = None
+        if limits is not None:
+            try:
+                from chromadb.config import Settings
+
+                settings = Settings(
+                    chroma_http_keepalive_secs=limits.keepalive_expiry,
+                    chroma_http_max_connections=limits.max_connections,
+                    chroma_http_max_keepalive_connections=limits.max_keepalive_connections,
+                )
+            except Exception:
+                # Older chromadb versions have no connection pool settings
+                settings = None
+
+        if settings is not None:
+            self.client = chromadb.HttpClient(host=host, port=port, settings=settings)
+        else:
+            self.client = chromadb.HttpClient(host=host, port=port)
+        self.embedding_model_name = embedding_model_name
+
+        # chromadb's HttpClient and Settings have no client side timeout (as of chromadb 1.5).
+        # Its FastAPI client keeps an httpx session without a timeout in the private
+        # client._server._session, the timeout is set there while that attribute exists.
+        # Otherwise the client manager puts a deadline on every call instead
+        self.bounds_requests = timeout is None
+        if timeout is not None:
+            session = getattr(getattr(self.client, '_server', None), '_session', None)
+            if session is not None and hasattr(session, 'timeout'):
+                session.timeout = timeout
+                self.bounds_requests = True
+            else:
+                print("WARNING: this chromadb client has no httpx session to set the request timeout on, "
+                      "vector store calls are bounded by a deadline in the client manager instead.")
+
+    def _chroma_configuration(self, configuration: dict = None) -> dict:
+        """Add the embedding function to a collection configuration"""
+        configuration = dict(configuration or {})
+        configuration['embedding_function'] = get_chroma_embedding_function(self.embedding_model_name)
+        return configuration
+
+    def get_collection(self, name: str):
+        # Same embedding function as at creation, so text queries embed with the ingestion model
+        return self.client.get_collection(name=name,
+                                          embedding_function=get_chroma_embedding_function(self.embedding_model_name))
+
+    def create_collection(self, name: str, metadata: dict = None, configuration: dict = None):
+        return self.client.create_collection(name=name, metadata=metadata,
+                                             configuration=self._chroma_configuration(configuration))
+
+    def get_or_create_collection(self, name: str, metadata: dict = None, configuration: dict = None):
+        return self.client.get_or_create_collection(name=name, metadata=metadata,
+                                                    configuration=self._chroma_configuration(configuration))
+
+    def delete_collection(self, name: str):
+        self.client.delete_collection(name)
+
+    def list_collections(self) -> list:
+        return self.client.list_collections()
+
+    def rename_collection(self, name: str, new_name: str):
+        self.get_collection(name).modify(name=new_name)
+        return self.get_collection(new_name)
+
+    def get_max_batch_size(self) -> int:
+        return self.client.get_max_batch_size()
+
+
+def _matches_condition(value, condition) -> bool:
+    """Evaluate one metadata field condition using the chromadb where operators"""
+    if not isinstance(condition, dict):
+        return value == condition
+
+    for operator, operand in condition.items():
+        if operator == '$eq':
+            result = value == operand
+        elif operator == '$ne':
+            result = value != operand
+        elif operator == '$in':
+            result = value in operand
+        elif operator == '$nin':
+            result = value not in operand
+        elif value is None:
+            result = False
+        elif operator == '$gt':
+            result = value > operand
+        elif operator == '$gte':
+            result = value >= operand
+        elif operator == '$lt':
+            result = value < operand
+        elif operator == '$lte':
+            result = value <= operand
+        else:
+            raise ValueError(f"Unsupported where operator: {operator}")
+        if not result:
+            return False
+    return True
+
+
+def matches_where(metadata: Optional[dict], where: Optional[dict]) -> bool:
+    """Return True if metadata satisfies a chromadb style where filter"""
+    if not where:
+        return True
+    metadata = metadata or {}
+
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif not _matches_condition(metadata.get(key), condition):
+            return False
+    return True
+
+
+class NumpyCollection:
+    """In-process collection answering cosine top-k queries with a NumPy matmul.
+
+    Embeddings are kept L2-normalized in a float32 matrix so a query is a single
+    matrix-vector product followed by argpartition. Only precomputed embeddings
+    are accepted, texts have to be embedded by the caller.
+    """
+
+    def __init__(self, name: str, metadata: dict = None, directory: Path = None):
+        self.name = name
+        self.metadata = metadata or {}
+        self.directory = directory
+
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[dict]] = []
+        self._rows: Dict[str, int] = {}
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+        self._dirty = False
+
+    @staticmethod
+    def _normalize(embeddings) -> np.ndarray:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _reserve(self, rows: int, dim: int):
+        """Grow the embedding matrix geometrically so appends stay amortized O(1)"""
+        if self._embeddings.shape[1] not in (0, dim) and self._size:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimension {self._embeddings.shape[1]}")
+        if rows <= self._embeddings.shape[0] and self._embeddings.shape[1] == dim:
+            return
+        capacity = max(rows, 2 * self._embeddings.shape[0], 64)
+        grown = np.zeros((capacity, dim), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._embeddings[:self._size]
+        self._embeddings = grown
+
+    def _write(self, ids, embeddings, documents, metadatas, allow_update: bool):
+        if embeddings is None:
+            raise ValueError("NumpyCollection requires precomputed embeddings")
+        vectors = self._normalize(embeddings)
+        if len(vectors) != len(ids):
+            raise ValueError("Number of embeddings does not match number of ids")
+
+        with self._lock:
+            if not allow_update:
+                duplicates = [doc_id for doc_id in ids if doc_id in self._rows]
+                if duplicates:
+                    raise ValueError(f"IDs already exist in collection: {duplicates[:5]}")
+
+            self._reserve(self._size + len(ids), vectors.shape[1])
+            for i, doc_id in enumerate(ids):
+                row = self._rows.get(doc_id)
+                document = documents[i] if documents is not None else None
+                metadata = metadatas[i] if metadatas is not None else None
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[doc_id] = row
+                    self._ids.append(doc_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                else:
+                    if documents is not None:
+                        self._documents[row] = document
+                    if metadatas is not None:
+                        self._metadatas[row] = metadata
+                self._embeddings[row] = vectors[i]
+            self._dirty = True
+
+    def add(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write(list(ids), embeddings, documents, metadatas, allow_update=False)
+
+    def upsert(self, ids, embeddings=None, documents=None, metadatas=None):
+        self._write(list(ids), embeddings, documents, metadatas, allow_update=True)
+
+    def _select_rows(self, ids=None, where: dict = None) -> np.ndarray:
+        """Return the row numbers matching an id list and/or a where filter"""
+        if ids is not None:
+            rows = [self._rows[doc_id] for doc_id in ids if doc_id in self._rows]
+        else:
+            rows = range(self._size)
+        if where:
+            rows = [row for row in rows if matches_where(self._metadatas[row], where)]
+        return np.fromiter(rows, dtype=np.int64)
+
+    def delete(self, ids=None, where: dict = None):
+        with self._lock:
+            if ids is None and where is None:
+                return
+            remove = self._select_rows(ids, where)
+            if len(remove) == 0:
+                return
+
+            keep = np.ones(self._size, dtype=bool)
+            keep[remove] = False
+            kept_rows = np.flatnonzero(keep)
+
+            self._embeddings = self._embeddings[kept_rows].copy()
+            self._ids = [self._ids[row] for row in kept_rows]
+            self._documents = [self._documents[row] for row in kept_rows]
+            self._metadatas = [self._metadatas[row] for row in kept_rows]
+            self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._size = len(self._ids)
+            self._dirty = True
+
+    def count(self) -> int:
+        return self._size
+
+    def _collect(self, rows, include) -> Dict[str, Any]:
+        result = {'ids': [self._ids[row] for row in rows]}
+        result['documents'] = [self._documents[row] for row in rows] if 'documents' in include else None
+        result['metadatas'] = [self._metadatas[row] for row in rows] if 'metadatas' in include else None
+        result['embeddings'] = self._embeddings[rows].copy() if 'embeddings' in include else None
+        return result
+
+    def get(self, ids=None, where: dict = None, limit: int = None, offset: int = None,
+            include=DEFAULT_GET_INCLUDE) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            if offset:
+                rows = rows[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            return self._collect(rows, include)
+
+    def query(self, query_embeddings=None, n_results: int = 10, where: dict = None, query_texts=None,
+              include=DEFAULT_QUERY_INCLUDE, ids=None) -> Dict[str, Any]:
+        if query_embeddings is None:
+            raise ValueError("NumpyCollection requires query_embeddings, texts must be embedded by the caller")
+
+        queries = self._normalize(query_embeddings)
+        results = {key: [] for key in ('ids', 'distances', 'documents', 'metadatas', 'embeddings')}
+
+        with self._lock:
+            # Only the rows of the given ids (and matching where) are scored
+            candidates = self._select_rows(ids, where) if where or ids is not None else None
+            matrix = self._embeddings[:self._size] if candidates is None else self._embeddings[candidates]
+            k = min(n_results, len(matrix))
+
+            similarities = queries @ matrix.T if k else np.zeros((len(queries), 0), dtype=np.float32)
+
+            for scores in similarities:
+                if k < len(scores):
+                    top = np.argpartition(-scores, k - 1)[:k]
+                else:
+                    top = np.arange(len(scores))
+                top = top[np.argsort(-scores[top], kind='stable')]
+                rows = top if candidates is None else candidates[top]
+
+                collected = self._collect(rows, include)
+                results['ids'].append(collected['ids'])
+                results['distances'].append((1.0 - scores[top]).tolist())
+                results['documents'].append(collected['documents'])
+                results['metadatas'].append(collected['metadatas'])
+                results['embeddings'].append(collected['embeddings'])
+
+        for key in ('documents', 'metadatas', 'embeddings', 'distances'):
+            if key not in include:
+                results[key] = None
+        return results
+
+    def save(self):
+        """Write the collection to its directory if it changed since the last save"""
+        if self.directory is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            embeddings_tmp = self.directory / 'embeddings.tmp.npy'
+            np.save(embeddings_tmp, self._embeddings[:self._size])
+            os.replace(embeddings_tmp, self.directory / 'embeddings.npy')
+            self.save_records()
+            self._dirty = False
+
+    def save_records(self):
+        """Write the name, metadata, ids and documents, e.g. after a rename that left the embeddings as they are"""
+        with self._lock:
+            records_tmp = self.directory / 'records.tmp.json'
+            with open(records_tmp, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'name': self.name,
+                    'metadata': self.metadata,
+                    'ids': self._ids,
+                    'documents': self._documents,
+                    'metadatas': self._metadatas,
+                }, file)
+            os.replace(records_tmp, self.directory / 'records.json')
+
+    @classmethod
+    def load(cls, directory: Path) -> 'NumpyCollection':
+        """Load a collection previously written by save.
+
+        The embedding matrix is memory-mapped copy-on-write, pages are read as
+        queries touch them and writes never reach the file until the next save.
+        """
+        with open(directory / 'records.json', 'r', encoding='utf-8') as file:
+            records = json.load(file)
+
+        collection = cls(records['name'], records.get('metadata'), directory)
+        collection._ids = records['ids']
+        collection._documents = records['documents']
+        collection._metadatas = records['metadatas']
+        collection._rows = {doc_id: row for row, doc_id in enumerate(collection._ids)}
+        collection._embeddings = np.load(directory / 'embeddings.npy', mmap_mode='c')
+        collection._size = len(collection._ids)
+        return collection
+
+
+class NumpyVectorStore(VectorStore):
+    """Embedded vector store keeping collections in memory and persisting them under a directory"""
+
+    def __init__(self, persist_dir: str = None):
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+
+    def _collection_dir(self, name: str) -> Optional[Path]:
+        return self.persist_dir / name if self.persist_dir else None
+
+    def get_collection(self, name: str) -> NumpyCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                directory = self._collection_dir(name)
+                if directory is None or not (directory / 'records.json').exists():
+                    raise ValueError(f"Collection {name} does not exist.")
+                collection = NumpyCollection.load(directory)
+                self._collections[name] = collection
+            return collection
+
+    def create_collection(self, name: str, metadata: dict = None, configuration: dict = None) -> NumpyCollection:
+        with self._lock:
+            directory = self._collection_dir(name)
+            if name in self._collections or (directory is not None and (directory / 'records.json').exists()):
+                raise ValueError(f"Collection {name} already exists.")
+            collection = NumpyCollection(name, metadata, directory)
+            collection._dirty = True
+            collection.save()
+            self._collections[name] = collection
+            return collection
+
+    def get_or_create_collection(self, name: str, metadata: dict = None, configuration: dict = None) -> NumpyCollection:
+        try:
+            return self.get_collection(name)
+        except ValueError:
+            return self.create_collection(name, metadata, configuration)
+
+    def delete_collection(self, name: str):
+        with self._lock:
+            directory = self._collection_dir(name)
+            exists = name in self._collections or (directory is not None and directory.exists())
+            if not exists:
+                raise ValueError(f"Collection {name} does not exist.")
+            self._collections.pop(name, None)
+            if directory is not None and directory.exists():
+                shutil.rmtree(directory)
+
+    def list_collections(self) -> List[NumpyCollection]:
+        names = set(self._collections)
+        if self.persist_dir is not None and self.persist_dir.exists():
+            names.update(path.name for path in self.persist_dir.iterdir() if (path / 'records.json').exists())
+        return [self.get_collection(name) for name in sorted(names)]
+
+    def rename_collection(self, name: str, new_name: str) -> NumpyCollection:
+        collection = self.get_collection(name)
+        with self._lock:
+            new_directory = self._collection_dir(new_name)
+            if new_name in self._collections or (new_directory is not None and new_directory.exists()):
+                raise ValueError(f"Collection {new_name} already exists.")
+
+            collection.save()
+            collection.name = new_name
+            if collection.directory is not None:
+                # The embeddings move with the directory, only the records hold the name
+                os.replace(collection.directory, new_directory)
+                collection.directory = new_directory
+                collection.save_records()
+
+            del self._collections[name]
+            self._collections[new_name] = collection
+            return collection
+
+    def bulk_load(self, collection, ids: List[str], embeddings, documents: List[Optional[str]],
+                  metadatas: List[Optional[dict]]):
+        """Adopt the arrays as the collection's content without copying them.
+
+        A memory-mapped embedding matrix stays mapped (writes to it are
+        copy-on-write), it is only copied if its vectors are not unit length.
+        """
+        if not isinstance(collection, NumpyCollection):
+            return super().bulk_load(collection, ids, embeddings, documents, metadatas)
+
+        # Checking a sample of rows is enough to tell normalized snapshots from raw embeddings
+        sample = np.asarray(embeddings[:min(len(ids), 256)], dtype=np.float32)
+        if len(sample) and not np.allclose(np.linalg.norm(sample, axis=1), 1.0, atol=1e-3):
+            embeddings = NumpyCollection._normalize(embeddings)
+
+        with collection._lock:
+            if collection._size:
+                raise ValueError(f"Collection {collection.name} is not empty")
+            collection._ids = list(ids)
+            collection._documents = list(documents)
+            collection._metadatas = list(metadatas)
+            collection._rows = {doc_id: row for row, doc_id in enumerate(collection._ids)}
+            collection._embeddings = embeddings if len(ids) else np.zeros((0, 0), dtype=np.float32)
+            collection._size = len(ids)
+            collection._dirty = True
+        collection.save()
+
+    def persist(self, collection):
+        if isinstance(collection, NumpyCollection):
+            collection.save()
+
+
+def create_vector_store(backend: str = 'chroma', **options) -> VectorStore:
+    """Create the vector store selected by the vectorStore setting ('chroma' or 'numpy')"""
+    backend = backend.lower()
+    if backend == 'chroma':
+        return ChromaVectorStore(options.get('host', 'localhost'), int(options.get('port', 8000)),
+                                 options.get('embedding_model_name', 'all-MiniLM-L6-v2'),
+                                 options.get('timeout'), options.get('limits'))
+    if backend == 'numpy':
+        return NumpyVectorStore(options.get('persist_dir'))
+    raise ValueError(f"Unknown vector store backend: {backend}")
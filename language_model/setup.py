@@ -21,6 +21,10 @@ setup(
     entry_points={
         'console_scripts': [
             'service = language_model.ragApplication:main',
+            'prefix_reuse_benchmark = language_model.prefixReuseBenchmark:main',
+            'rag_benchmark = language_model.ragBenchmark:main',
+            'load_generator = language_model.loadGenerator:main',
+            'hnsw_tuner = language_model.hnswTuner:main',
         ],
     },
 )
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The node's modules import each other by their bare names
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'language_model'))
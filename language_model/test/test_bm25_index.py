@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+import pytest
+
+from bm25Index import BM25Index, build_bm25_index, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [('d1', 'Cat sat'), ('d2', 'cat, cat dog'), ('d3', 'dog')]
+
+
+def test_tokenize():
+    assert tokenize('Join CS101, today!') == ['join', 'cs101', 'today']
+
+
+def test_scores_match_hand_computed_bm25():
+    index = build_bm25_index(DOCUMENTS, k1=1.2, b=0.75)
+
+    # N = 3 documents of average length 2, "cat" occurs in 2 of them:
+    # idf = ln(1 + (3 - 2 + 0.5) / (2 + 0.5)) = ln(1.6)
+    # d1: tf 1, length 2 -> K = 1.2 * (0.25 + 0.75 * 2 / 2) = 1.2,   score = idf * 1 * 2.2 / (1 + 1.2)
+    # d2: tf 2, length 3 -> K = 1.2 * (0.25 + 0.75 * 3 / 2) = 1.65,  score = idf * 2 * 2.2 / (2 + 1.65)
+    idf = math.log(1.6)
+    expected = [idf * 2.2 / 2.2, idf * 4.4 / 3.65, 0.0]
+    np.testing.assert_allclose(index.get_scores('cat'), expected, rtol=1e-6)
+
+    results = index.search('cat', n_results=5)
+    assert [doc_id for doc_id, _ in results] == ['d2', 'd1']
+    assert results[0][1] == pytest.approx(expected[1], rel=1e-6)
+
+
+def test_query_terms_are_counted_once_and_summed():
+    index = build_bm25_index(DOCUMENTS)
+    np.testing.assert_allclose(index.get_scores('cat cat dog'),
+                               index.get_scores('cat') + index.get_scores('dog'), rtol=1e-6)
+    assert index.search('unknown') == []
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = build_bm25_index(DOCUMENTS)
+    path = str(tmp_path / 'index.bm25.npz')
+    index.save(path)
+
+    loaded = BM25Index.load(path)
+    assert loaded.ids == index.ids
+    np.testing.assert_array_equal(loaded.get_scores('cat dog'), index.get_scores('cat dog'))
+    assert BM25Index.load(path, k1=2.0).k1 == 2.0
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([['a', 'b'], ['b', 'c']], k=60)
+    assert [doc_id for doc_id, _ in fused] == ['b', 'a', 'c']
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61)
@@ -0,0 +1,51 @@
+from chunker import chunk_section, chunk_spans, get_chunk_id, get_source_id, stitch_chunks
+
+TEXT = "A b. C d. E f. G h."
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_windows_end_at_sentences_and_overlap():
+    spans = chunk_spans(TEXT, max_tokens=4, overlap_tokens=2, count_tokens=count_words)
+    assert [TEXT[start:end] for start, end in spans] == ["A b. C d.", "C d. E f.", "E f. G h."]
+
+
+def test_without_overlap_windows_are_adjacent():
+    spans = chunk_spans(TEXT, max_tokens=4, overlap_tokens=0, count_tokens=count_words)
+    assert [TEXT[start:end] for start, end in spans] == ["A b. C d.", "E f. G h."]
+
+
+def test_long_sentence_is_cut_at_words():
+    text = "one two three four five six seven."
+    spans = chunk_spans(text, max_tokens=3, overlap_tokens=0, count_tokens=count_words)
+    assert [text[start:end] for start, end in spans] == ["one two three", "four five six", "seven."]
+
+
+def test_windows_respect_the_budget():
+    text = " ".join(f"Sentence number {i} has some words." for i in range(50))
+    for start, end in chunk_spans(text, max_tokens=20, overlap_tokens=8, count_tokens=count_words):
+        assert count_words(text[start:end]) <= 20
+
+
+def test_chunk_section_ids_and_metadata():
+    chunks = chunk_section('3_1', TEXT, {'section': 'S'}, max_tokens=4, overlap_tokens=2, count_tokens=count_words)
+    assert [chunk_id for chunk_id, _, _ in chunks] == ['3_1#0', '3_1#1', '3_1#2']
+    for index, (chunk_id, content, metadata) in enumerate(chunks):
+        assert get_source_id(chunk_id) == '3_1'
+        assert metadata == dict(section='S', source_id='3_1', chunk_index=index, chunk_count=3,
+                                char_start=metadata['char_start'], char_end=metadata['char_end'])
+        assert TEXT[metadata['char_start']:metadata['char_end']] == content
+
+
+def test_short_section_keeps_its_id():
+    chunks = chunk_section('2', "Short.", {}, max_tokens=4, count_tokens=count_words)
+    assert chunks == [('2', "Short.", dict(source_id='2', chunk_index=0, chunk_count=1, char_start=0, char_end=6))]
+
+
+def test_stitch_removes_overlaps():
+    chunks = chunk_section('1', TEXT, {}, max_tokens=4, overlap_tokens=2, count_tokens=count_words)
+    parts = [(metadata['char_start'], metadata['char_end'], content) for _, content, metadata in chunks]
+    assert stitch_chunks(reversed(parts)) == TEXT
+    assert get_chunk_id('1', 2) == '1#2'
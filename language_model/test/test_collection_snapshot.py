@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from collectionSnapshot import get_snapshot_path, read_snapshot, write_snapshot
+
+IDS = ['1', '1_1', '2#0']
+DOCUMENTS = ['first', 'second', None]
+METADATAS = [{'section': 'A'}, {'section': 'B', 'page': 2}, None]
+
+
+@pytest.fixture
+def embeddings():
+    return np.random.default_rng(0).standard_normal((len(IDS), 8)).astype(np.float32)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_save_restore_round_trip(tmp_path, embeddings, mmap):
+    path = get_snapshot_path(str(tmp_path), 'docs')
+    header = write_snapshot(path, IDS, embeddings, DOCUMENTS, METADATAS, {'hnsw:space': 'cosine'}, 'model-a')
+
+    snapshot = read_snapshot(path, mmap=mmap)
+    assert snapshot['ids'] == IDS
+    assert snapshot['documents'] == DOCUMENTS
+    assert snapshot['metadatas'] == METADATAS
+    assert snapshot['collection_metadata'] == {'hnsw:space': 'cosine'}
+    assert snapshot['model_tag'] == 'model-a'
+    assert snapshot['checksum'] == header['checksum']
+    assert snapshot['embeddings'].dtype == np.float32
+    np.testing.assert_array_equal(snapshot['embeddings'], embeddings)
+    assert isinstance(snapshot['embeddings'], np.memmap) == mmap
+
+
+def test_empty_collection(tmp_path):
+    path = get_snapshot_path(str(tmp_path), 'empty')
+    write_snapshot(path, [], np.zeros((0,), dtype=np.float32), [], [])
+
+    snapshot = read_snapshot(path)
+    assert snapshot['count'] == 0
+    assert snapshot['ids'] == []
+    assert snapshot['embeddings'].shape == (0, 0)
+
+
+def test_corruption_is_detected(tmp_path, embeddings):
+    path = get_snapshot_path(str(tmp_path), 'docs')
+    write_snapshot(path, IDS, embeddings, DOCUMENTS, METADATAS)
+
+    # Flip a byte of the stored embedding matrix
+    data = bytearray(open(path, 'rb').read())
+    offset = data.find(embeddings[-1].tobytes())
+    data[offset] ^= 0xFF
+    open(path, 'wb').write(bytes(data))
+
+    with pytest.raises(ValueError, match='checksum'):
+        read_snapshot(path)
+    assert read_snapshot(path, verify=False)['ids'] == IDS
+
+
+def test_snapshot_is_replaced(tmp_path, embeddings):
+    path = get_snapshot_path(str(tmp_path), 'docs')
+    write_snapshot(path, IDS, embeddings, DOCUMENTS, METADATAS)
+    write_snapshot(path, IDS[:1], embeddings[:1], DOCUMENTS[:1], METADATAS[:1])
+
+    assert read_snapshot(path)['ids'] == IDS[:1]
+    assert [p.name for p in tmp_path.iterdir()] == ['docs.snapshot.npz']
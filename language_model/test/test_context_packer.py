@@ -0,0 +1,51 @@
+from contextPacker import (approximate_token_count, drop_covered_children, get_ancestor_ids, pack_context,
+                           truncate_to_sentences)
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def render(number, result, content):
+    return f"{number}. {content}"
+
+
+def result(doc_id, content, **fields):
+    return dict(doc_id=doc_id, content=content, **fields)
+
+
+def test_approximate_token_count():
+    assert approximate_token_count('') == 0
+    assert approximate_token_count('abcdefgh') == 2
+    assert approximate_token_count('a b c') == 3
+
+
+def test_children_of_retrieved_sections_are_dropped():
+    assert get_ancestor_ids('1_2_3') == ['1', '1_2']
+    results = [result('1_2', 'child'), result('1', 'parent'), result('2#0', 'chunk', source_id='1_4'),
+               result('3', 'other')]
+    assert [r['doc_id'] for r in drop_covered_children(results)] == ['1', '3']
+
+
+def test_documents_that_fit_are_kept_whole():
+    blocks, stats = pack_context([result('1', 'A b.'), result('2', 'C d.')], render, 100, count_words)
+    assert blocks == ['1. A b.', '2. C d.']
+    assert stats == {'used': 6, 'unpacked': 6, 'saved': 0}
+
+
+def test_first_document_over_budget_is_cut_at_a_sentence():
+    results = [result('1', 'A b. C d. E f.'), result('2', 'G h.')]
+    blocks, stats = pack_context(results, render, 5, count_words)
+    assert blocks == ['1. A b. C d.']
+    assert stats == {'used': 5, 'unpacked': 10, 'saved': 5}
+
+
+def test_max_documents():
+    results = [result(str(i), 'word') for i in range(1, 5)]
+    blocks, _ = pack_context(results, render, 100, count_words, max_documents=2)
+    assert blocks == ['1. word', '2. word']
+
+
+def test_truncate_to_sentences():
+    assert truncate_to_sentences('One two. Three four!  Five?', 4, count_words) == 'One two. Three four!'
+    assert truncate_to_sentences('One two three.', 2, count_words) == ''
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import corpusLoader
+from corpusLoader import batched, iter_json_data
+
+ITEMS = [
+    {'doc_id': 1, 'section': 'About', 'content': 'Upanzi',
+     'subsections': [{'doc_id': 2, 'section': 'People', 'content': 'Staff',
+                      'subsections': [{'section': 'Students', 'content': 'Assistants'}]}]},
+    {'section': 'Contact', 'content': 'Kigali'},
+]
+
+EXPECTED = [
+    {'doc_id': '1', 'section': 'About', 'content': 'Upanzi'},
+    {'doc_id': '1_2', 'section': 'People', 'content': 'Staff'},
+    {'doc_id': '1_2_0', 'section': 'Students', 'content': 'Assistants'},
+    {'doc_id': '2', 'section': 'Contact', 'content': 'Kigali'},
+]
+
+
+def test_json_array(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(ITEMS, indent=2))
+    assert list(iter_json_data(str(path))) == EXPECTED
+
+
+def test_jsonl(tmp_path):
+    path = tmp_path / 'data.jsonl'
+    path.write_text('\n'.join(json.dumps(item) for item in ITEMS) + '\n\n')
+    assert list(iter_json_data(str(path))) == EXPECTED
+
+
+def test_values_split_across_read_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpusLoader, 'READ_CHUNK_SIZE', 7)
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(ITEMS))
+    assert list(iter_json_data(str(path))) == EXPECTED
+
+
+def test_non_object_items_are_skipped(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(['note', 3, ITEMS[1]]))
+    assert list(iter_json_data(str(path))) == [{'doc_id': '3', 'section': 'Contact', 'content': 'Kigali'}]
+
+
+def test_malformed_jsonl_line(tmp_path):
+    path = tmp_path / 'data.jsonl'
+    path.write_text(json.dumps(ITEMS[0]) + '\n{"section": "broken",\n' + json.dumps(ITEMS[1]) + '\n')
+    items = iter_json_data(str(path))
+    assert next(items)['doc_id'] == '1'
+    with pytest.raises(json.JSONDecodeError):
+        list(items)
+
+
+def test_unclosed_array(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(ITEMS)[:-1])
+    with pytest.raises(ValueError):
+        list(iter_json_data(str(path)))
+
+
+def test_top_level_must_be_an_array(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(ITEMS[0]))
+    with pytest.raises(ValueError, match='JSON array'):
+        list(iter_json_data(str(path)))
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
@@ -0,0 +1,47 @@
+import numpy as np
+
+from embeddingCache import EmbeddingCache
+
+
+def vectors(*values):
+    return np.array([[value, 1.0, 2.0] for value in values], dtype=np.float32)
+
+
+def test_lookup_hits_normalized_text(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', 4)
+    cache.store(['What is  Upanzi?'], vectors(1))
+    hit, miss = cache.lookup(['What is Upanzi? ', 'Who leads the lab?'])
+    np.testing.assert_array_equal(hit, vectors(1)[0])
+    assert miss is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', 2)
+    cache.store(['a', 'b'], vectors(1, 2))
+    cache.lookup(['a'])
+    cache.store(['c'], vectors(3))
+    a, b, c = cache.lookup(['a', 'b', 'c'])
+    assert b is None
+    np.testing.assert_array_equal(a, vectors(1)[0])
+    np.testing.assert_array_equal(c, vectors(3)[0])
+    assert len(cache) == 2
+
+
+def test_entries_persist_across_instances(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', 4)
+    cache.store(['a', 'b'], vectors(1, 2))
+    cache.flush()
+
+    reopened = EmbeddingCache(tmp_path, 'model', 4)
+    assert len(reopened) == 2
+    np.testing.assert_array_equal(reopened.lookup(['b'])[0], vectors(2)[0])
+
+
+def test_models_and_capacities_do_not_share_entries(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', 4)
+    cache.store(['a'], vectors(1))
+    cache.flush()
+
+    assert EmbeddingCache(tmp_path, 'other/model', 4).lookup(['a']) == [None]
+    assert EmbeddingCache(tmp_path, 'model', 8).lookup(['a']) == [None]
@@ -0,0 +1,46 @@
+import numpy as np
+
+from mmrSelection import maximal_marginal_relevance
+
+QUERY = [1.0, 0.0]
+# A near duplicate of the best candidate and a less relevant but different one
+CANDIDATES = [[1.0, 0.0], [0.99, 0.01], [0.6, 0.8]]
+
+
+def naive_mmr(query, candidates, k, lambda_mult):
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    query = query / np.linalg.norm(query)
+    selected = []
+    while len(selected) < k:
+        best, best_score = None, -np.inf
+        for i in range(len(candidates)):
+            if i in selected:
+                continue
+            redundancy = max((candidates[i] @ candidates[j] for j in selected), default=0.0)
+            score = lambda_mult * (candidates[i] @ query) - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def test_relevance_only():
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, 3, lambda_mult=1.0) == [0, 1, 2]
+
+
+def test_diversity_skips_near_duplicates():
+    assert maximal_marginal_relevance(QUERY, CANDIDATES, 2, lambda_mult=0.3) == [0, 2]
+
+
+def test_matches_naive_selection():
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(16)
+    candidates = rng.standard_normal((30, 16))
+    for lambda_mult in (0.2, 0.5, 0.7):
+        assert maximal_marginal_relevance(query, candidates, 8, lambda_mult) == \
+            naive_mmr(query, candidates, 8, lambda_mult)
+
+
+def test_k_is_capped_by_the_candidates():
+    assert sorted(maximal_marginal_relevance(QUERY, CANDIDATES, 10)) == [0, 1, 2]
+    assert maximal_marginal_relevance(QUERY, [], 3) == []
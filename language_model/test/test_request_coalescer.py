@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from requestCoalescer import RequestCoalescer
+
+
+class Recorder:
+    """Batch function that records its batches, a 'block' batch waits until released"""
+
+    def __init__(self, handle=lambda items: [item * 2 for item in items]):
+        self.handle = handle
+        self.batches = []
+        self.release = threading.Event()
+        self.blocking = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, items):
+        if items == ['block']:
+            self.blocking.set()
+            self.release.wait(5)
+            return items
+        with self._lock:
+            self.batches.append(sorted(items))
+        return self.handle(items)
+
+
+def run_concurrently(coalescer, items, keys=None):
+    """Submit items from one thread each while another call is in flight, so the leaders wait for followers"""
+    recorder = coalescer.process_batch
+    blocker = threading.Thread(target=coalescer.submit, args=('block', 'blocker'))
+    blocker.start()
+    recorder.blocking.wait(5)
+
+    keys = keys or [None] * len(items)
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    start = threading.Barrier(len(items))
+
+    def call(position):
+        start.wait()
+        try:
+            results[position] = coalescer.submit(items[position], key=keys[position])
+        except Exception as e:
+            errors[position] = e
+
+    threads = [threading.Thread(target=call, args=(position,)) for position in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    recorder.release.set()
+    blocker.join(timeout=5)
+    return results, errors
+
+
+def test_lone_request_runs_alone():
+    recorder = Recorder()
+    coalescer = RequestCoalescer(recorder, window=5)
+    assert coalescer.submit(3) == 6
+    assert recorder.batches == [[3]]
+
+
+def test_concurrent_requests_are_batched_and_answered_in_order():
+    recorder = Recorder()
+    coalescer = RequestCoalescer(recorder, window=5, max_batch_size=4)
+    results, errors = run_concurrently(coalescer, [1, 2, 3, 4])
+    assert results == [2, 4, 6, 8]
+    assert errors == [None] * 4
+    assert recorder.batches == [[1, 2, 3, 4]]
+
+
+def test_batches_are_split_by_key():
+    recorder = Recorder(handle=lambda items: items)
+    coalescer = RequestCoalescer(recorder, window=5, max_batch_size=2)
+    results, _ = run_concurrently(coalescer, ['a1', 'b1', 'a2', 'b2'], keys=['a', 'b', 'a', 'b'])
+    assert results == ['a1', 'b1', 'a2', 'b2']
+    assert sorted(recorder.batches) == [['a1', 'a2'], ['b1', 'b2']]
+
+
+def test_errors_reach_every_caller():
+    def fail(items):
+        raise RuntimeError("backend down")
+
+    recorder = Recorder(handle=fail)
+    coalescer = RequestCoalescer(recorder, window=5, max_batch_size=3)
+    _, errors = run_concurrently(coalescer, [1, 2, 3])
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert recorder.batches == [[1, 2, 3]]
+    with pytest.raises(RuntimeError):
+        coalescer.submit(4)
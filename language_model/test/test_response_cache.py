@@ -0,0 +1,43 @@
+import responseCache
+from responseCache import ResponseCache
+
+
+def test_exact_and_similar_queries_hit():
+    cache = ResponseCache(threshold=0.95)
+    cache.store('lab', 'What is Upanzi?', [1.0, 0.0], 'A network.')
+    assert cache.lookup('lab', '  What is   Upanzi?', [0.0, 1.0]) == 'A network.'
+    assert cache.lookup('lab', 'Tell me about Upanzi', [0.99, 0.05]) == 'A network.'
+    assert cache.lookup('lab', 'Where is the lab?', [0.0, 1.0]) is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_entries_are_scoped_per_collection():
+    cache = ResponseCache()
+    cache.store('lab', 'What is Upanzi?', [1.0, 0.0], 'A network.')
+    assert cache.lookup('other', 'What is Upanzi?', [1.0, 0.0]) is None
+
+    cache.store('other', 'Who?', [0.0, 1.0], 'Staff.')
+    cache.invalidate('lab')
+    assert cache.lookup('lab', 'What is Upanzi?', [1.0, 0.0]) is None
+    assert cache.lookup('other', 'Who?', [0.0, 1.0]) == 'Staff.'
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    cache.store('lab', 'a', [1.0, 0.0, 0.0], 'A')
+    cache.store('lab', 'b', [0.0, 1.0, 0.0], 'B')
+    cache.lookup('lab', 'a', None)
+    cache.store('lab', 'c', [0.0, 0.0, 1.0], 'C')
+    assert cache.lookup('lab', 'b', None) is None
+    assert cache.lookup('lab', 'a', None) == 'A'
+    assert len(cache) == 2
+
+
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(responseCache.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(ttl_seconds=10)
+    cache.store('lab', 'a', [1.0, 0.0], 'A')
+    now[0] += 11
+    assert cache.lookup('lab', 'a', [1.0, 0.0]) is None
+    assert len(cache) == 0